@@ -0,0 +1,416 @@
+""" Local stand-ins for the HGNC, UniProt, Ensembl and MyGene.info REST APIs used by gene_mapper.
+
+The servers answer from a synthetic gene universe in which gene i has the identifiers below, so any number of
+identifiers can be mapped without storing tables. Every UNMAPPED_EVERY-th gene is unknown to all services.
+
+    Symbol GENE<i> (previous symbol PREV<i>, alias ALIAS<i>), Entrez <ENTREZ_OFFSET + i>, UniProt P<i>,
+    Ensembl ENSG<i> / ENSP<i>, RefSeq NM_<i>, DIP DIP-<i>N
+
+Each server can add latency to every request and fail a fraction of them, and counts the requests it receives.
+The servers run in a child process so that they do not compete with the client for the GIL or count towards
+its memory use.
+"""
+import re
+import gzip
+import json
+import time
+import uuid
+import random
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote, urlencode
+from urllib.request import urlopen
+
+from gene_mapper import query_hgnc as hgnc
+from gene_mapper import query_uniprot as uni
+from gene_mapper import query_ensembl as ensg
+from gene_mapper import query_mygene
+
+SERVICES = ["hgnc", "uniprot", "ensembl", "mygene"]
+UNMAPPED_EVERY = 10
+ENTREZ_OFFSET = 100000
+# Ensembl genes with i % RETIRED_EVERY == RETIRED_EVERY - 2 have been replaced by ENSG<i + RETIRED_OFFSET>
+RETIRED_EVERY = 10
+RETIRED_OFFSET = 500000000
+# number of genes in the HGNC approved symbol list
+N_GENES = 1000000
+
+PATTERNS = {"Symbol": r"GENE(\d+)", "Previous": r"PREV(\d+)", "Alias": r"ALIAS(\d+)", "Entrez": r"(\d+)",
+            "Uniprot": r"P(\d+)", "Ensembl": r"ENSG(\d+)(?:\.\d+)?", "EnsemblProtein": r"ENSP(\d+)(?:\.\d+)?",
+            "Refseq": r"NM_(\d+)", "DIP": r"DIP-(\d+)N"}
+PATTERNS = {id_type: re.compile(pattern) for id_type, pattern in PATTERNS.items()}
+
+
+def make_id(id_type, i):
+    """ The identifier of type id_type for gene i"""
+    if id_type == "Entrez":
+        return str(ENTREZ_OFFSET + i)
+    if id_type in ["Ensembl", "EnsemblProtein"]:
+        return "ENS" + ("G" if id_type == "Ensembl" else "P") + str(i).zfill(11)
+    return {"Symbol": "GENE{}", "Previous": "PREV{}", "Alias": "ALIAS{}", "Uniprot": "P{}", "Refseq": "NM_{}",
+            "DIP": "DIP-{}N"}[id_type].format(i)
+
+
+def gene_index(id_type, identifier):
+    """ The gene an identifier of type id_type belongs to, or None if it is not in the gene universe"""
+    match = PATTERNS[id_type].fullmatch(str(identifier))
+    if match is None:
+        return None
+    i = int(match.group(1)) - (ENTREZ_OFFSET if id_type == "Entrez" else 0)
+    if (i < 0) or (i % UNMAPPED_EVERY == UNMAPPED_EVERY - 1):
+        return None
+    return i
+
+
+def input_ids(id_type, n):
+    """ n distinct identifiers of type id_type. Symbols mix approved, previous and alias symbols."""
+    if id_type != "Symbol":
+        return [make_id(id_type, i) for i in range(n)]
+    kinds = {6: "Previous", 7: "Alias"}
+    return [make_id(kinds.get(i % 10, "Symbol"), i) for i in range(n)]
+
+
+class MockServer(ThreadingHTTPServer):
+    """ HTTP server for one service, routing requests to handler functions
+
+    Args:
+        routes (list): (method, path regex, function) tuples. function(server, match, query, body) returns
+            (status, headers, body)
+        latency (float): seconds added to every request
+        error_rate (float): fraction of requests answered with error_status
+        error_status (int): status of injected errors. 429 responses include a Retry-After header.
+        retry_after (float): seconds sent in the Retry-After header
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, routes, latency=0, error_rate=0, error_status=503, retry_after=0.1, seed=0):
+        super().__init__(("127.0.0.1", 0), MockHandler)
+        self.routes = [(method, re.compile(pattern), function) for method, pattern, function in routes]
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.reset()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def reset(self):
+        with self.lock:
+            self.stats = {"requests": 0, "errors": 0, "bytes": 0}
+
+    def count(self, **counts):
+        with self.lock:
+            for key, value in counts.items():
+                self.stats[key] += value
+
+    def inject_error(self):
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def handle_request(self, method):
+        parsed = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if parsed.path == "/_stats":
+            return self.respond(200, {}, self.server.stats)
+        if parsed.path == "/_reset":
+            self.server.reset()
+            return self.respond(200, {}, {})
+        self.server.count(requests=1)
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        if self.server.inject_error():
+            self.server.count(errors=1)
+            status = self.server.error_status
+            headers = {"Retry-After": str(self.server.retry_after)} if status == 429 else {}
+            return self.respond(status, headers, {"error": "injected"})
+        query = parse_qs(parsed.query)
+        if body and (self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded")):
+            query.update(parse_qs(body.decode()))
+        elif body:
+            query["json"] = json.loads(body)
+        path = unquote(parsed.path)
+        for route_method, pattern, function in self.server.routes:
+            match = pattern.fullmatch(path)
+            if (route_method == method) and (match is not None):
+                status, headers, content = function(self.server, match, query, body)
+                return self.respond(status, headers, content)
+        self.respond(404, {}, {"error": "not found"})
+
+    def respond(self, status, headers, content):
+        if not isinstance(content, bytes):
+            content = json.dumps(content).encode()
+            headers = {"Content-Type": "application/json", **headers}
+        if not self.path.startswith("/_"):
+            self.server.count(bytes=len(content))
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+# HGNC
+
+_approved = None
+
+
+def approved_symbols(n_genes):
+    """ The HGNC approved symbol list response for genes 0 to n_genes - 1"""
+    docs = [{"symbol": make_id("Symbol", i)} for i in range(n_genes) if i % UNMAPPED_EVERY != UNMAPPED_EVERY - 1]
+    return json.dumps({"response": {"numFound": len(docs), "docs": docs}}).encode()
+
+
+def hgnc_approved(server, match, query, body):
+    return 200, {"Content-Type": "application/json", "ETag": f'"{N_GENES}"'}, _approved
+
+
+def hgnc_search(id_type):
+    def search(server, match, query, body):
+        i = gene_index(id_type, match.group(1))
+        docs = [] if i is None else [{"symbol": make_id("Symbol", i), "score": 1}]
+        return 200, {}, {"response": {"numFound": len(docs), "docs": docs}}
+    return search
+
+
+def hgnc_fetch(server, match, query, body):
+    i = gene_index("Symbol", match.group(1))
+    docs = [] if i is None else [{"symbol": make_id("Symbol", i), "status": "Approved",
+                                  "entrez_id": make_id("Entrez", i), "ensembl_gene_id": make_id("Ensembl", i),
+                                  "uniprot_ids": [make_id("Uniprot", i)]}]
+    return 200, {}, {"response": {"numFound": len(docs), "docs": docs}}
+
+
+HGNC_ROUTES = [("GET", r"/search/symbol/\*\+AND\+status:Approved", hgnc_approved),
+               ("GET", r"/search/prev_symbol/(.+)", hgnc_search("Previous")),
+               ("GET", r"/search/alias_symbol/(.+)", hgnc_search("Alias")),
+               ("GET", r"/fetch/symbol/(.+)", hgnc_fetch)]
+
+
+# UniProt
+
+UNIPROT_FROM = {"UniProtKB_AC-ID": "Uniprot", "DIP": "DIP"}
+UNIPROT_TO = {"GeneID": "Entrez", "Ensembl": "Ensembl", "Gene_Name": "Symbol", "UniProtKB": "Uniprot"}
+# seconds an ID mapping job reports itself as RUNNING after it is submitted
+JOB_SECONDS = 0
+
+
+def uniprot_run(server, match, query, body):
+    from_type, to_type = UNIPROT_FROM[query["from"][0]], UNIPROT_TO[query["to"][0]]
+    results, failed = [], []
+    for identifier in query["ids"][0].split(","):
+        i = gene_index(from_type, identifier)
+        if i is None:
+            failed.append(identifier)
+        elif to_type == "Uniprot":
+            results.append({"from": identifier, "to": {"primaryAccession": make_id("Uniprot", i)}})
+        else:
+            results.append({"from": identifier, "to": make_id(to_type, i)})
+    job_id = uuid.uuid4().hex
+    with server.lock:
+        server.jobs[job_id] = {"submitted": time.time(), "results": results, "failedIds": failed}
+    return 200, {}, {"jobId": job_id}
+
+
+def uniprot_status(server, match, query, body):
+    job = server.jobs.get(match.group(1))
+    if job is None:
+        return 404, {}, {"messages": ["job not found"]}
+    if time.time() - job["submitted"] < JOB_SECONDS:
+        return 200, {}, {"jobStatus": "RUNNING"}
+    return 200, {}, {"results": job["results"][:1], "failedIds": job["failedIds"][:1]}
+
+
+def uniprot_details(server, match, query, body):
+    return 200, {}, {"redirectURL": f"{server.url}/idmapping/results/{match.group(1)}"}
+
+
+def uniprot_results(server, match, query, body):
+    job = server.jobs[match.group(1)]
+    size = int(query.get("size", ["500"])[0])
+    cursor = int(query.get("cursor", ["0"])[0])
+    page = {"results": job["results"][cursor:cursor + size]}
+    if cursor == 0:
+        page["failedIds"] = job["failedIds"]
+    headers = {"x-total-results": str(len(job["results"]))}
+    if cursor + size < len(job["results"]):
+        next_query = urlencode({**{k: v[0] for k, v in query.items()}, "cursor": cursor + size})
+        headers["Link"] = f'<{server.url}/idmapping/results/{match.group(1)}?{next_query}>; rel="next"'
+    return 200, headers, page
+
+
+def uniprot_stream(server, match, query, body):
+    job = server.jobs[match.group(1)]
+    lines = ["From\tEntry" if "fields" in query else "From\tTo"]
+    for result in job["results"]:
+        to = result["to"]["primaryAccession"] if isinstance(result["to"], dict) else result["to"]
+        lines.append(f"{result['from']}\t{to}")
+    content = ("\n".join(lines) + "\n").encode()
+    if query.get("compressed", ["false"])[0] == "true":
+        content = gzip.compress(content)
+    return 200, {"Content-Type": "text/plain"}, content
+
+
+UNIPROT_ROUTES = [("POST", r"/idmapping/run", uniprot_run),
+                  ("GET", r"/idmapping/status/(\w+)", uniprot_status),
+                  ("GET", r"/idmapping/details/(\w+)", uniprot_details),
+                  ("GET", r"/idmapping/results/stream/(\w+)", uniprot_stream),
+                  ("GET", r"/idmapping/results/(\w+)", uniprot_results)]
+
+
+# Ensembl
+
+def ensembl_archive(server, match, query, body):
+    entries = []
+    for identifier in query["json"]["id"]:
+        id_type = "EnsemblProtein" if identifier.startswith("ENSP") else "Ensembl"
+        i = gene_index(id_type, identifier)
+        if i is None:
+            continue
+        stable_id = identifier.split(".")[0]
+        retired = i % RETIRED_EVERY == RETIRED_EVERY - 2
+        latest = make_id(id_type, i + RETIRED_OFFSET if retired else i) + ".1"
+        entries.append({"id": stable_id, "latest": latest, "version": 1, "is_current": "" if retired else 1,
+                        "type": "Gene" if id_type == "Ensembl" else "Translation", "release": "110"})
+    return 200, {}, entries
+
+
+ENSEMBL_ROUTES = [("POST", r"/archive/id/?", ensembl_archive)]
+
+
+# MyGene.info
+
+MYGENE_SCOPES = {"symbol": "Symbol", "entrezgene": "Entrez", "uniprot": "Uniprot", "ensembl.gene": "Ensembl",
+                 "ensembl.protein": "EnsemblProtein", "refseq": "Refseq"}
+
+
+def mygene_fields(i, fields):
+    hit = {"_id": make_id("Entrez", i), "_score": 20.0}
+    for field in fields.split(","):
+        if field in ["ensembl.gene", "ensembl.protein"]:
+            hit.setdefault("ensembl", {})[field.split(".")[1]] = make_id(MYGENE_SCOPES[field], i)
+        elif field == "entrezgene":
+            hit[field] = int(make_id("Entrez", i))
+        elif field in MYGENE_SCOPES:
+            hit[field] = make_id(MYGENE_SCOPES[field], i)
+    return hit
+
+
+def split_terms(terms):
+    # the MyGene client quotes each term
+    return [term.strip('"') for term in terms.split(",")]
+
+
+def mygene_query(server, match, query, body):
+    scopes = [MYGENE_SCOPES[scope] for scope in query.get("scopes", [""])[0].split(",") if scope in MYGENE_SCOPES]
+    fields = query.get("fields", ["symbol"])[0]
+    hits = []
+    for term in split_terms(query["q"][0]):
+        indices = [gene_index(id_type, term) for id_type in scopes]
+        indices = [i for i in indices if i is not None]
+        if len(indices) == 0:
+            hits.append({"query": term, "notfound": True})
+        else:
+            hits.append({"query": term, **mygene_fields(indices[0], fields)})
+    return 200, {}, hits
+
+
+def mygene_gene(server, match, query, body):
+    fields = query.get("fields", ["symbol"])[0]
+    hits = []
+    for identifier in split_terms(query["ids"][0]):
+        i = gene_index("Entrez", identifier)
+        hits.append({"query": identifier, "notfound": True} if i is None else
+                    {"query": identifier, **mygene_fields(i, fields)})
+    return 200, {}, hits
+
+
+MYGENE_ROUTES = [("POST", r"/query/?", mygene_query), ("POST", r"/gene/?", mygene_gene)]
+
+ROUTES = {"hgnc": HGNC_ROUTES, "uniprot": UNIPROT_ROUTES, "ensembl": ENSEMBL_ROUTES, "mygene": MYGENE_ROUTES}
+
+
+def serve(connection, n_genes, job_seconds, settings):
+    global N_GENES, JOB_SECONDS, _approved
+    N_GENES, JOB_SECONDS = n_genes, job_seconds
+    _approved = approved_symbols(n_genes)
+    servers = {service: MockServer(ROUTES[service], **settings.get(service, {})) for service in SERVICES}
+    for server in servers.values():
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    connection.send({service: server.url for service, server in servers.items()})
+    connection.recv()
+    for server in servers.values():
+        server.shutdown()
+
+
+class MockServices:
+    """ Runs a mock server for each service in a child process
+
+    Args:
+        n_genes (int): number of genes in the HGNC approved symbol list
+        job_seconds (float): seconds each UniProt ID mapping job runs for
+        latency (float): seconds added to every request
+        error_rate (float): fraction of requests failed with error_status
+        error_status (int): HTTP status of injected errors
+        services (dict): settings for individual services overriding the above, e.g. {"ensembl": {"error_rate": 0.1}}
+    """
+    def __init__(self, n_genes=N_GENES, job_seconds=JOB_SECONDS, latency=0, error_rate=0, error_status=503,
+                 services=None):
+        settings = {service: {"latency": latency, "error_rate": error_rate, "error_status": error_status,
+                              **(services or {}).get(service, {})} for service in SERVICES}
+        self.connection, child = multiprocessing.Pipe()
+        self.process = multiprocessing.get_context("spawn").Process(
+            target=serve, args=(child, n_genes, job_seconds, settings), daemon=True)
+        self.process.start()
+        self.urls = self.connection.recv()
+
+    def stats(self):
+        """ {service: {"requests": n, "errors": n, "bytes": n}} counted since the last reset"""
+        return {service: json.load(urlopen(url + "/_stats", timeout=10)) for service, url in self.urls.items()}
+
+    def reset(self):
+        for url in self.urls.values():
+            urlopen(url + "/_reset", timeout=10).read()
+
+    def stop(self):
+        self.connection.send("stop")
+        self.process.join(5)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+@contextmanager
+def use_services(urls):
+    """ Point the query modules at the given service URLs while the block runs"""
+    saved = hgnc.HGNC_URL, uni.API_URL, ensg.ENSEMBL_URL, query_mygene.client
+    hgnc.HGNC_URL, uni.API_URL, ensg.ENSEMBL_URL = urls["hgnc"], urls["uniprot"], urls["ensembl"]
+    query_mygene.client = query_mygene.new_client(urls["mygene"])
+    try:
+        yield
+    finally:
+        hgnc.HGNC_URL, uni.API_URL, ensg.ENSEMBL_URL, query_mygene.client = saved
@@ -0,0 +1,194 @@
+""" Throughput benchmarks for mapper.update_nodes and mapper.convert_node_ids against local mock services.
+
+Reports identifiers mapped per second, requests sent to each service and peak memory for each identifier type
+and input size, without touching the network::
+
+    python -m benchmarks.run_benchmarks --sizes 10 1000 100000 --latency 0.05 --output results.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tracemalloc
+import contextlib
+
+from gene_mapper import mapper
+from gene_mapper import cache
+from gene_mapper import rate_limit
+from gene_mapper import hgnc_snapshot
+from gene_mapper import ensembl_history
+from gene_mapper import uniprot_index
+from gene_mapper import ncbi_genes
+from gene_mapper import name_index
+from gene_mapper import query_hgnc as hgnc
+from benchmarks.mock_services import MockServices, use_services, input_ids, SERVICES
+
+SIZES = [10, 100, 1000, 10000, 100000, 1000000]
+# (function, initial id type, target id type), where the target is None for update_nodes
+CASES = [("update_nodes", "Symbol", None), ("update_nodes", "Entrez", None), ("update_nodes", "Uniprot", None),
+         ("update_nodes", "Ensembl", None), ("update_nodes", "DIP", None),
+         ("convert_node_ids", "Symbol", "Entrez"), ("convert_node_ids", "Entrez", "Symbol"),
+         ("convert_node_ids", "Uniprot", "Entrez"), ("convert_node_ids", "Ensembl", "Entrez")]
+
+
+def case_name(case):
+    return case[1] if case[2] is None else f"{case[1]}->{case[2]}"
+
+
+@contextlib.contextmanager
+def isolated(requests_per_second=None):
+    """ Run without the mapping cache or offline backends, so every run queries the services
+
+    Args:
+        requests_per_second (float): rate limit of every service instead of rate_limit.SERVICE_LIMITS
+    """
+    saved = (cache.get_cache(), hgnc_snapshot.get_snapshot(), ensembl_history.get_history(), rate_limit.get_scheduler(),
+             uniprot_index.get_index(), ncbi_genes.get_genes(), name_index.get_index())
+    cache.set_cache(None)
+    hgnc_snapshot.set_snapshot(None)
+    ensembl_history.set_history(None)
+    uniprot_index.set_index(None)
+    ncbi_genes.set_genes(None)
+    name_index.set_index(None)
+    # a fresh scheduler, so pauses from throttled requests do not carry over between runs
+    limits = saved[3].limits
+    if requests_per_second is not None:
+        limits = {service: dict(limit, rate=requests_per_second) for service, limit in limits.items()}
+    rate_limit.set_scheduler(rate_limit.Scheduler(limits))
+    try:
+        yield
+    finally:
+        cache.set_cache(saved[0])
+        hgnc_snapshot.set_snapshot(saved[1])
+        ensembl_history.set_history(saved[2])
+        rate_limit.set_scheduler(saved[3])
+        uniprot_index.set_index(saved[4])
+        ncbi_genes.set_genes(saved[5])
+        name_index.set_index(saved[6])
+
+
+def run_case(case, nodes, services=None, memory=True, use_async=False):
+    """ Time a single call of update_nodes or convert_node_ids
+
+    Args:
+        case (tuple): (function, initial id type, target id type)
+        nodes (set): identifiers to map
+        services (MockServices): servers whose request counts are reported
+        memory (bool): trace Python allocations to report peak memory, which slows the run down
+        use_async (bool): call async_update_nodes or async_convert_node_ids instead
+
+    Returns:
+        dict: timing, mapping counts, requests and errors per service and peak memory in MB
+    """
+    function, initial_id, target_id = case
+    # the approved HGNC symbols are otherwise downloaded only by the first run
+    hgnc._approved = None
+    if services is not None:
+        services.reset()
+    result = {"function": ("async_" if use_async else "") + function, "id_type": case_name(case), "ids": len(nodes)}
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            if use_async and (function == "update_nodes"):
+                node_map, failed = asyncio.run(mapper.async_update_nodes(nodes, initial_id))
+            elif use_async:
+                node_map, failed = asyncio.run(mapper.async_convert_node_ids(nodes, initial_id, target_id))
+            elif function == "update_nodes":
+                node_map, failed = mapper.update_nodes(nodes, initial_id)
+            else:
+                node_map, failed = mapper.convert_node_ids(nodes, initial_id, target_id)
+        result.update(mapped=len(node_map), failed=len(failed))
+    except Exception as e:
+        result.update(error=repr(e))
+    result["seconds"] = time.perf_counter() - start
+    result["ids_per_second"] = len(nodes) / result["seconds"]
+    if memory:
+        result["peak_memory_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    if services is not None:
+        stats = services.stats()
+        result["requests"] = {service: stats[service]["requests"] for service in SERVICES}
+        result["errors"] = {service: stats[service]["errors"] for service in SERVICES}
+    return result
+
+
+def format_result(result):
+    requests = " ".join(f"{service}={n}" for service, n in result.get("requests", {}).items() if n > 0)
+    memory = f"{result['peak_memory_mb']:9.1f}" if "peak_memory_mb" in result else f"{'-':>9}"
+    mapped = (f"{result['mapped']:>9} {result['failed']:>9}" if "error" not in result
+              else f"{'error':>9} {'':>9}")
+    return (f"{result['function']:<23} {result['id_type']:<16} {result['ids']:>8} {result['seconds']:9.2f} "
+            f"{result['ids_per_second']:11.0f} {mapped} {memory}  {requests or result.get('error', '')}")
+
+
+HEADER = (f"{'function':<23} {'id_type':<16} {'ids':>8} {'seconds':>9} {'ids/s':>11} {'mapped':>9} {'failed':>9} "
+          f"{'peak MB':>9}  requests")
+
+
+def run_benchmarks(sizes=SIZES, cases=CASES, memory=True, requests_per_second=None, out=sys.stdout, use_async=False,
+                   **settings):
+    """ Run every case at every size against freshly started mock services
+
+    Args:
+        sizes (list): numbers of identifiers to map
+        cases (list): (function, initial id type, target id type) tuples
+        memory (bool): report peak memory
+        requests_per_second (float): rate limit of every service instead of rate_limit.SERVICE_LIMITS
+        out (file): where to print a row per run, or None
+        use_async (bool): benchmark async_update_nodes and async_convert_node_ids instead
+        **settings: passed to MockServices, e.g. latency=0.05, error_rate=0.01
+
+    Returns:
+        list: a result dictionary per run
+    """
+    results = []
+    if out is not None:
+        print(HEADER, file=out)
+    with MockServices(n_genes=max(sizes), **settings) as services, use_services(services.urls), \
+            isolated(requests_per_second):
+        for case in cases:
+            for size in sizes:
+                result = run_case(case, set(input_ids(case[1], size)), services=services, memory=memory,
+                                  use_async=use_async)
+                results.append(result)
+                if out is not None:
+                    print(format_result(result), file=out, flush=True)
+    return results
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark gene_mapper against local mock services")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="numbers of identifiers to map")
+    parser.add_argument("--cases", nargs="+", choices=[case_name(case) for case in CASES],
+                        help="identifier types to benchmark, e.g. Symbol or Uniprot->Entrez (default all)")
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every request")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of failed requests")
+    parser.add_argument("--job-seconds", type=float, default=0, help="seconds each UniProt job runs for")
+    parser.add_argument("--rate", type=float, help="requests per second to each service (default the limits of the "
+                        "real services in rate_limit.SERVICE_LIMITS)")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="benchmark async_update_nodes and async_convert_node_ids")
+    parser.add_argument("--no-memory", action="store_true", help="do not trace memory, which slows mapping down")
+    parser.add_argument("--output", help="JSON file to write the results to")
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    args = parse_args(args)
+    cases = [case for case in CASES if (args.cases is None) or (case_name(case) in args.cases)]
+    results = run_benchmarks(args.sizes, cases, memory=not args.no_memory, requests_per_second=args.rate,
+                             latency=args.latency, error_rate=args.error_rate, error_status=args.error_status,
+                             job_seconds=args.job_seconds, use_async=args.use_async)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,42 +1,186 @@
-from datetime import datetime
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import timedelta
+
+# span that request statistics reported by the query modules are added to, separately for each thread and
+# asyncio task
+_recording = contextvars.ContextVar("recording", default=None)
+_recording_lock = threading.Lock()
+
+
+class Span:
+    """ A timed task, with its parent task and any attributes describing the work done.
+
+    Times are nanoseconds from time.perf_counter_ns.
+    """
+    def __init__(self, name, label, parent, attributes):
+        self.name = name
+        self.label = label
+        self.parent = parent
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.thread_id = threading.get_ident()
+        self.attributes = dict(attributes)
+        self.start = time.perf_counter_ns()
+        self.finish = None
+
+    @property
+    def elapsed(self):
+        """ Elapsed seconds, up to now if the span has not ended"""
+        finish = self.finish if self.finish is not None else time.perf_counter_ns()
+        return (finish - self.start) / 1e9
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, **counts):
+        """ Increment numeric attributes, e.g. span.add(requests=1, bytes=1024)"""
+        for key, value in counts.items():
+            self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def to_dict(self):
+        return {"name": self.name, "label": self.label, "parent": None if self.parent is None else self.parent.label,
+                "thread": self.thread_id, "start": self.start / 1e9, "elapsed": self.elapsed,
+                "attributes": self.attributes}
+
 
 class Timer:
+    """ Records nested, timed spans of work on a monotonic clock. Safe to use from several threads and asyncio
+    tasks.
+
+    Spans are nested under the span open in the same thread or asyncio task when they start. Threads started with
+    in_context continue the stack of the caller.
+    """
     def __init__(self):
-        self.start_times = {}
-        self.finish_times = {}
-        self.elapsed_times = {}
-        self.tasks = []
-        self.current_task_stack = []
-        self.indents = {}
-        
-    def start(self, taskstr):
-        if taskstr in self.start_times.keys():
-            taskstr=taskstr + "1"
-            i=1
-            while taskstr in self.start_times.keys():
-                i += 1
-                taskstr = taskstr[0:-1] + str(i) 
-        self.current_task_stack.append(taskstr)
-        self.indents[taskstr] = len(self.current_task_stack) - 1
-        self.tasks.append(taskstr)
-        self.start_times[taskstr] = datetime.now()
-        
-    def end(self, taskstr):
-        if taskstr in self.finish_times:
-            matching_tasks = [task for task in self.start_times.keys() if taskstr in task]
-            taskstr = matching_tasks[-1]
-        self.current_task_stack.remove(taskstr)
-        self.finish_times[taskstr] = datetime.now()
-        self.elapsed_times[taskstr] = str(self.finish_times[taskstr] - self.start_times[taskstr])
-        
-    def print_all_times(self):
+        self.spans = []
+        self._open = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+        # open spans of the current thread or task, innermost last
+        self._stack = contextvars.ContextVar(f"timer_stack_{id(self)}", default=())
+        self.origin = time.perf_counter_ns()
+
+    def start(self, taskstr, **attributes):
+        """ Start a span named taskstr. Repeated names are labelled taskstr1, taskstr2, ... when printed."""
+        # spans of this stack ended from another thread or task are no longer parents
+        stack = tuple(span for span in self._stack.get() if span.finish is None)
+        with self._lock:
+            count = self._counts.get(taskstr, 0)
+            self._counts[taskstr] = count + 1
+            label = taskstr if count == 0 else taskstr + str(count)
+            span = Span(taskstr, label, stack[-1] if stack else None, attributes)
+            self.spans.append(span)
+            self._open.setdefault(taskstr, []).append(span)
+        self._stack.set(stack + (span,))
+        return span
+
+    def end(self, taskstr, **attributes):
+        """ End the innermost span named taskstr open in this thread or task, or else the most recently started
+        open span named taskstr"""
+        stack = self._stack.get()
+        with self._lock:
+            open_spans = self._open.get(taskstr)
+            if not open_spans:
+                return None
+            own = [span for span in stack if (span.name == taskstr) and (span in open_spans)]
+            span = own[-1] if own else open_spans[-1]
+            open_spans.remove(span)
+        return self._finish(span, **attributes)
+
+    def _finish(self, span, **attributes):
+        span.finish = time.perf_counter_ns()
+        span.set(**attributes)
+        stack = self._stack.get()
+        if span in stack:
+            self._stack.set(tuple(open_span for open_span in stack if open_span is not span))
+        return span
+
+    @contextmanager
+    def span(self, taskstr, record_requests=False, **attributes):
+        """ Context manager timing a block of work
+
+        Args:
+            taskstr (str): name of the span
+            record_requests (bool): add request counts, bytes and retries reported by the query modules
+                while the block runs to this span
+            **attributes: initial attributes, e.g. service="uniprot", ids=1000
+        """
+        span = self.start(taskstr, **attributes)
+        token = _recording.set(span) if record_requests else None
         try:
-            for task in self.tasks:
-                if task not in self.elapsed_times:
-                    self.end(task)
-                if self.indents[task] > 0:
-                    print("".join(["|", "---"*self.indents[task], ">"]),self.elapsed_times[task], task)
-                else:
-                    print(self.elapsed_times[task], task)
-        except:
-            print(self.elapsed_times)
\ No newline at end of file
+            yield span
+        finally:
+            if token is not None:
+                _recording.reset(token)
+            # spans of the same name can be open in concurrent asyncio tasks, so this one is ended by identity
+            with self._lock:
+                self._open[taskstr].remove(span)
+            self._finish(span)
+
+    @property
+    def tasks(self):
+        return [span.label for span in self.spans]
+
+    @property
+    def elapsed_times(self):
+        return {span.label: str(timedelta(seconds=span.elapsed)) for span in self.spans if span.finish is not None}
+
+    def print_all_times(self):
+        for span in self.spans:
+            elapsed = str(timedelta(seconds=span.elapsed))
+            attributes = [f"{k}={v}" for k, v in span.attributes.items()]
+            if span.depth > 0:
+                print("".join(["|", "---"*span.depth, ">"]), elapsed, span.label, *attributes)
+            else:
+                print(elapsed, span.label, *attributes)
+
+    def to_json(self, path=None):
+        """ All spans as a list of dictionaries, optionally written to a JSON file"""
+        spans = [span.to_dict() for span in self.spans]
+        for span in spans:
+            span["start"] -= self.origin / 1e9
+        if path is not None:
+            with open(path, "w") as f:
+                json.dump(spans, f, indent=1)
+        return spans
+
+    def to_chrome_trace(self, path=None):
+        """ All spans as Chrome trace events, viewable in chrome://tracing or https://ui.perfetto.dev
+
+        Returns:
+            dict: the trace, also written to path if given
+        """
+        events = []
+        for span in self.spans:
+            finish = span.finish if span.finish is not None else time.perf_counter_ns()
+            events.append({"name": span.label, "cat": span.attributes.get("service", "gene_mapper"), "ph": "X",
+                           "ts": (span.start - self.origin) / 1e3, "dur": (finish - span.start) / 1e3,
+                           "pid": os.getpid(), "tid": span.thread_id, "args": span.attributes})
+        trace = {"traceEvents": events, "displayTimeUnit": "ms"}
+        if path is not None:
+            with open(path, "w") as f:
+                json.dump(trace, f)
+        return trace
+
+
+def record(**counts):
+    """ Add request statistics (e.g. requests=1, bytes=2048, retries=1) to the span currently recording them"""
+    span = _recording.get()
+    if span is not None:
+        with _recording_lock:
+            span.add(**counts)
+
+
+def in_context(function):
+    """ Wrap function to run in a copy of the caller's context, so that requests it sends from worker threads are
+    recorded in the caller's span"""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(function, *args, **kwargs)
+
+
+def record_response(response, *args, **kwargs):
+    """ requests response hook reporting each response to the recording span"""
+    record(requests=1, bytes=int(response.headers.get("Content-Length") or 0))
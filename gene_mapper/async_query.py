@@ -0,0 +1,323 @@
+import json
+import asyncio
+from collections import Counter
+import httpx
+import pandas as pd
+from gene_mapper import replay
+from gene_mapper import rate_limit
+from gene_mapper import query_hgnc as hgnc
+from gene_mapper import query_uniprot as uni
+from gene_mapper import query_ensembl as ensg
+from gene_mapper import query_mygene
+from gene_mapper.Timer import record, in_context
+
+# Asynchronous versions of the HGNC, UniProt, Ensembl and MyGene.info queries. All requests go through one
+# httpx.AsyncClient, so many can be in flight from a single thread. Only the requests are sent here, by Transport:
+# the offline backends, caching and merging of results are the coroutines of the synchronous query modules
+# (see gene_mapper.coroutines), so both give the same results.
+
+# connections kept open across all services
+MAX_CONNECTIONS = 100
+MAX_RETRIES = 5
+# 429 responses are retried by the rate_limit scheduler
+RETRY_STATUSES = [500, 502, 503, 504]
+
+
+async def record_response(response):
+    record(requests=1, bytes=int(response.headers.get("Content-Length") or 0))
+
+
+def new_client(max_connections=MAX_CONNECTIONS):
+    """ An httpx.AsyncClient for the query functions, whose requests can be recorded and replayed"""
+    transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(max_connections=max_connections))
+    return httpx.AsyncClient(transport=replay.AsyncArchiveTransport(transport), timeout=httpx.Timeout(60),
+                             event_hooks={"response": [record_response]})
+
+
+async def gather_limited(function, items, workers):
+    """ Await function(item) for every item, with at most `workers` running at once
+
+    Returns:
+        list: results in the order of items
+    """
+    items = list(items)
+    results = [None] * len(items)
+    indices = iter(range(len(items)))
+
+    async def worker():
+        for i in indices:
+            results[i] = await function(items[i])
+    await asyncio.gather(*[worker() for _ in range(max(1, min(workers, len(items))))])
+    return results
+
+
+async def send(client, method, url, service, retries=MAX_RETRIES, **kwargs):
+    """ Send a request within the rate limits of a service, retrying connection errors and 5xx responses
+
+    Args:
+        service (str): service in rate_limit.SERVICE_LIMITS whose limits the request counts against
+        **kwargs: passed to client.request
+
+    Returns:
+        httpx.Response: the first successful response, or the last one
+    """
+    for retry in range(retries + 1):
+        try:
+            response = await client.request(method, url, extensions={"service": service}, **kwargs)
+        except httpx.TransportError:
+            if retry == retries:
+                raise
+            record(retries=1)
+            await asyncio.sleep(0.25 * 2 ** retry)
+            continue
+        if (response.status_code in RETRY_STATUSES) and (retry < retries):
+            wait = rate_limit.retry_after(response, default=0.25 * 2 ** retry)
+            print(f"{url} returned {response.status_code}, retrying in {wait}s")
+            record(retries=1)
+            await asyncio.sleep(wait)
+            continue
+        return response
+
+
+def batched(ids, size):
+    # sorted so the same ids always make the same requests, as in the synchronous modules
+    ids = sorted(ids, key=str)
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
+
+
+# HGNC
+
+async def fetch_docs(client, path):
+    response = await send(client, "GET", hgnc.HGNC_URL + path, "hgnc", headers={'Accept': 'application/json'})
+    if response.status_code == 200:
+        return response.json()['response']['docs']
+    print('Error detected: ' + str(response.status_code), path)
+    return None
+
+
+async def fetch_symbol_docs(client, ids, endpoint, workers=None):
+    """ Query an HGNC endpoint once per symbol with up to `workers` requests in flight, hgnc.MAX_WORKERS if None
+
+    Returns:
+        list: (symbol, docs) tuples in input order, where docs is None for failed requests
+    """
+    ids = list(ids)
+    workers = hgnc.MAX_WORKERS if workers is None else workers
+    docs = await gather_limited(lambda symbol: fetch_docs(client, endpoint + symbol), ids, workers)
+    return list(zip(ids, docs))
+
+
+# UniProt
+
+async def iter_id_mapping_results_stream(client, url, field=None, chunksize=uni.STREAM_CHUNK_SIZE):
+    """ Stream all results of a job as gzip-compressed TSV, as uni.iter_id_mapping_results_stream, parsing the
+    body as it downloads
+
+    Yields:
+        pd.DataFrame: up to chunksize results with columns 'from' and 'to'
+    """
+    parser = uni.TsvChunkParser(chunksize)
+    async with client.stream("GET", uni.stream_url(url, field), extensions={"service": "uniprot"}) as response:
+        response.raise_for_status()
+        async for data in response.aiter_bytes():
+            for chunk in parser.feed(data):
+                yield chunk
+    for chunk in parser.close():
+        yield chunk
+
+
+async def run_id_mapping_job(client, ids, from_db, to_db, field=None, stream=False):
+    """ Submit a single ID mapping job, poll until it has finished and page through its results
+
+    Args:
+        stream (bool): fetch results from the compressed TSV stream endpoint rather than paging through JSON
+
+    Returns:
+        pd.DataFrame: results with columns 'from' and 'to'
+        list: ids that could not be mapped
+    """
+    response = await send(client, "POST", f"{uni.API_URL}/idmapping/run", "uniprot",
+                          data={"from": from_db, "to": to_db, "ids": ",".join(ids)})
+    response.raise_for_status()
+    job_id = response.json()["jobId"]
+    interval = uni.MIN_POLLING_INTERVAL
+    while True:
+        response = await send(client, "GET", f"{uni.API_URL}/idmapping/status/{job_id}", "uniprot")
+        response.raise_for_status()
+        status = response.json()
+        if "jobStatus" not in status:
+            break
+        if status["jobStatus"] not in ("NEW", "RUNNING"):
+            raise Exception(status["jobStatus"])
+        await asyncio.sleep(interval)
+        interval = min(interval * uni.POLLING_BACKOFF, uni.POLLING_INTERVAL)
+    if not (status["results"] or status["failedIds"]):
+        return pd.DataFrame(), []
+    response = await send(client, "GET", f"{uni.API_URL}/idmapping/details/{job_id}", "uniprot")
+    response.raise_for_status()
+    url, params = response.json()["redirectURL"], {"size": 500}
+    if stream:
+        chunks = [chunk async for chunk in iter_id_mapping_results_stream(client, url, field)]
+        results_df = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=["from", "to"])
+        mapped = set(results_df["from"])
+        return results_df, [i for i in ids if i not in mapped]
+    results, failed = [], []
+    while url:
+        response = await send(client, "GET", url, "uniprot", params=params)
+        response.raise_for_status()
+        page = response.json()
+        results += page.get("results", [])
+        failed += page.get("failedIds", [])
+        url, params = uni.get_next_link(response.headers), None
+    if field is not None:
+        results = [{"from": entry["from"], "to": entry["to"][field]} for entry in results]
+    return pd.DataFrame.from_dict(results), failed
+
+
+# Ensembl
+
+async def post_archive_batch(client, batch_ids, retries=ensg.MAX_RETRIES):
+    headers = {"Content-Type": "application/json", "Accept": "application/json"}
+    response = await send(client, "POST", ensg.ENSEMBL_URL + "/archive/id", "ensembl", retries=retries,
+                          headers=headers, content=json.dumps({"id": list(batch_ids)}))
+    response.raise_for_status()
+    return ensg.archive_frame(response.json())
+
+
+# MyGene.info
+
+def quoted(terms):
+    # the MyGene.info client quotes every term
+    return ",".join(f'"{term}"' for term in terms)
+
+
+async def mygene_post(client, endpoint, data, retries=query_mygene.MAX_RETRIES):
+    """ POST to a MyGene.info endpoint, retrying failed requests with jittered exponential backoff"""
+    url = query_mygene.client.url + endpoint
+    for retry in range(retries):
+        try:
+            response = await client.post(url, data=data, extensions={"service": "mygene"})
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            if retry < retries - 1:
+                record(retries=1)
+                wait = query_mygene.backoff(retry)
+                print(f"Retrying {endpoint} in {wait:.1f}s: {e}")
+                await asyncio.sleep(wait)
+            else:
+                print(f"Max retries reach for {endpoint}")
+                raise e
+
+
+def hits_frame(hits):
+    """ MyGene.info query hits as a DataFrame indexed by query term, with the terms with duplicate hits and no hits"""
+    if len(hits) == 0:
+        return pd.DataFrame(), [], []
+    no_hits = [hit["query"] for hit in hits if hit.get("notfound", False)]
+    counts = Counter(hit["query"] for hit in hits if not hit.get("notfound", False))
+    return pd.json_normalize(hits).set_index("query"), [q for q, n in counts.items() if n > 1], no_hits
+
+
+# Queries
+
+class Transport:
+    """ Sends the requests of the shared query coroutines through an httpx.AsyncClient"""
+    def __init__(self, client):
+        self.client = client
+
+    async def fetch_symbol_docs(self, ids, endpoint, workers=None):
+        return await fetch_symbol_docs(self.client, ids, endpoint, workers=workers)
+
+    async def search_approved_symbols(self, ids):
+        # the approved symbol list is downloaded at most once per hgnc.APPROVED_MAX_AGE, so a worker thread is
+        # used rather than duplicating its revalidation
+        return await asyncio.get_running_loop().run_in_executor(None, in_context(hgnc.search_approved_symbols), ids)
+
+    async def search_gene_names(self, ids, approved):
+        return await hgnc._search_gene_names(self, ids, approved)
+
+    async def query_mygene(self, ids, scopes, fields):
+        return await query_mygene._query_mygene(self, ids, scopes, fields, query_mygene.MAX_RETRIES, None, None)
+
+    async def run_jobs(self, chunks, from_db, to_db, field, stream, max_jobs):
+        return await gather_limited(
+            lambda chunk: run_id_mapping_job(self.client, chunk, from_db, to_db, field, stream=stream),
+            chunks, max_jobs)
+
+    async def post_batches(self, batches, workers):
+        return await gather_limited(lambda batch: post_archive_batch(self.client, batch), batches, workers)
+
+    async def query_batches(self, gene_list, scopes, fields, retries, batch_size, workers):
+        batch_size = query_mygene.BATCH_SIZE if batch_size is None else batch_size
+        workers = query_mygene.MAX_WORKERS if workers is None else workers
+
+        async def query_batch(batch):
+            return await mygene_post(self.client, "/query/", {"q": quoted(batch), "scopes": scopes, "fields": fields,
+                                                              "species": "human", "entrezonly": "true"},
+                                     retries=retries)
+        batch_hits = await gather_limited(query_batch, batched(gene_list, batch_size), workers)
+        return hits_frame([hit for hits in batch_hits for hit in hits])
+
+    async def get_batches(self, gene_list, target_id, retries, batch_size, workers):
+        batch_size = query_mygene.BATCH_SIZE if batch_size is None else batch_size
+        workers = query_mygene.MAX_WORKERS if workers is None else workers
+
+        async def get_batch(batch):
+            return await mygene_post(self.client, "/gene/", {"ids": quoted(batch), "fields": target_id},
+                                     retries=retries)
+        batch_hits = await gather_limited(get_batch, batched(gene_list, batch_size), workers)
+        results, _, _ = hits_frame([hit for hits in batch_hits for hit in hits])
+        return results
+
+
+async def perform_hgnc_query(client, ids, from_id, to_id, workers=None):
+    """ Update symbols to approved HGNC symbols, as hgnc.perform_hgnc_query"""
+    return await hgnc._perform_hgnc_query(Transport(client), ids, from_id, to_id, workers)
+
+
+async def query_other_id(client, ids, target_id, workers=None, errors=None):
+    """ Map approved symbols to another id, as hgnc.query_other_id"""
+    return await hgnc._query_other_id(Transport(client), ids, target_id, workers, errors)
+
+
+async def perform_uniprot_query(client, ids, from_db, to_db, chunk_size=None, max_jobs=None, stream=None):
+    """ Map identifiers using the UniProt ID mapping service, as uni.perform_uniprot_query
+
+    Returns:
+        pd.DataFrame: mapping results with columns 'from' and 'to'
+        list: ids that could not be mapped
+    """
+    return await uni._perform_uniprot_query(Transport(client), ids, from_db, to_db, chunk_size, max_jobs, stream)
+
+
+async def get_latest_ensembl_id(client, ids, batch_size=None, workers=None):
+    """ Find the latest version of Ensembl gene or protein ids, as ensg.get_latest_ensembl_id
+
+    Returns:
+        pd.DataFrame: results with columns 'from' and 'to'
+        list: ids that were not found
+    """
+    return await ensg._get_latest_ensembl_id(Transport(client), ids, batch_size, workers)
+
+
+async def query_mygene_terms(client, gene_list, scopes, fields, retries=query_mygene.MAX_RETRIES, batch_size=None,
+                             workers=None):
+    """ Search MyGene.info for human genes matching each query term, as query_mygene.query_mygene
+
+    Returns:
+        pd.DataFrame: results indexed by query term. A term can have several rows.
+        list: query terms with duplicate hits or no hits
+    """
+    return await query_mygene._query_mygene(Transport(client), gene_list, scopes, fields, retries, batch_size,
+                                            workers)
+
+
+async def get_mygene(client, gene_list, target_id, retries=query_mygene.MAX_RETRIES, batch_size=None, workers=None):
+    """ Retrieve a field for each Entrez gene id from MyGene.info, as query_mygene.get_mygene
+
+    Returns:
+        pd.DataFrame: results with columns 'from' and 'to', indexed by id
+        list: ids without a value for target_id
+    """
+    return await query_mygene._get_mygene(Transport(client), gene_list, target_id, retries, batch_size, workers)
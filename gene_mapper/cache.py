@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import pandas as pd
+from gene_mapper.Timer import record
+
+# Default time-to-live (seconds) for cached mappings from each upstream source
+DEFAULT_TTLS = {"hgnc": 30 * 86400, "uniprot": 30 * 86400, "ensembl": 90 * 86400, "mygene": 7 * 86400}
+DEFAULT_MAX_ENTRIES = 2000000
+# Time-to-live (seconds) of identifiers recorded as unmappable, kept shorter so new annotations are picked up
+DEFAULT_NEGATIVE_TTLS = {"hgnc": 7 * 86400, "mapper": 7 * 86400}
+DEFAULT_MAX_FAILURES = 500000
+DEFAULT_CACHE_FILE = "gene_mapper_cache.sqlite"
+
+_cache = None
+_cache_dir = None
+
+
+class MappingCache:
+    """ Persistent SQLite-backed store of identifier mappings keyed by (source, from_type, to_type, id).
+
+    Args:
+        path (str): Path to the SQLite database file, or ":memory:" for a process-local cache
+        ttls (dict): Time-to-live in seconds per source, overriding DEFAULT_TTLS
+        max_entries (int): Maximum number of stored mappings. Least recently used entries are evicted beyond this.
+        negative_ttls (dict): Time-to-live in seconds per source of identifiers recorded as unmappable, overriding
+            DEFAULT_NEGATIVE_TTLS
+        max_failures (int): Maximum number of unmappable identifiers stored, evicted least recently used first
+    """
+    def __init__(self, path=":memory:", ttls=None, max_entries=DEFAULT_MAX_ENTRIES, negative_ttls=None,
+                 max_failures=DEFAULT_MAX_FAILURES):
+        self.path = path
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.max_entries = max_entries
+        self.negative_ttls = {**DEFAULT_NEGATIVE_TTLS, **(negative_ttls or {})}
+        self.max_failures = max_failures
+        self.hits = {}
+        self.misses = {}
+        self.failed_hits = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS mappings (
+                                source TEXT, from_type TEXT, to_type TEXT, id TEXT,
+                                value TEXT, created REAL, accessed REAL,
+                                PRIMARY KEY (source, from_type, to_type, id))""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS mappings_accessed ON mappings (accessed)")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS failures (
+                                source TEXT, from_type TEXT, to_type TEXT, id TEXT, created REAL, accessed REAL,
+                                PRIMARY KEY (source, from_type, to_type, id))""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS failures_accessed ON failures (accessed)")
+        self._conn.commit()
+
+    def get_many(self, source, from_type, to_type, ids):
+        """ Retrieve cached, unexpired values for a set of identifiers
+
+        Args:
+            source (str): Upstream service the mapping came from, e.g. "hgnc"
+            from_type (str): Identifier type of the ids
+            to_type (str): Identifier type of the values
+            ids (iterable): Identifiers to look up
+
+        Returns:
+            dict: mapping from each cached identifier to its stored value
+        """
+        ids = [str(i) for i in ids]
+        found = {}
+        now = time.time()
+        oldest = now - self.ttls.get(source, max(self.ttls.values()))
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                batch = ids[i:i + 500]
+                rows = self._conn.execute(
+                    "SELECT id, value FROM mappings WHERE source=? AND from_type=? AND to_type=? AND created>=? "
+                    "AND id IN (%s)" % ",".join("?" * len(batch)), [source, from_type, to_type, oldest] + batch)
+                found.update({row[0]: json.loads(row[1]) for row in rows})
+            self._conn.executemany("UPDATE mappings SET accessed=? WHERE source=? AND from_type=? AND to_type=? AND id=?",
+                                   [(now, source, from_type, to_type, i) for i in found])
+            self._conn.commit()
+            self.hits[source] = self.hits.get(source, 0) + len(found)
+            self.misses[source] = self.misses.get(source, 0) + len(set(ids)) - len(found)
+        return found
+
+    def set_many(self, source, from_type, to_type, mapping):
+        """ Store identifier mappings, replacing existing entries for the same keys
+
+        Args:
+            source (str): Upstream service the mapping came from
+            from_type (str): Identifier type of the keys
+            to_type (str): Identifier type of the values
+            mapping (dict): mapping from identifiers to JSON-serializable values
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO mappings VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   [(source, from_type, to_type, str(k), json.dumps(v, default=_to_json), now, now)
+                                    for k, v in mapping.items()])
+            self._conn.commit()
+        self.evict()
+
+    def get_failed(self, source, from_type, to_type, ids):
+        """ Identifiers recorded as unmappable within their negative TTL
+
+        Returns:
+            set: the identifiers, as strings, that are known to be unmappable
+        """
+        ids = [str(i) for i in ids]
+        failed = set()
+        now = time.time()
+        oldest = now - self.negative_ttls.get(source, max(self.negative_ttls.values()))
+        with self._lock:
+            for i in range(0, len(ids), 500):
+                batch = ids[i:i + 500]
+                rows = self._conn.execute(
+                    "SELECT id FROM failures WHERE source=? AND from_type=? AND to_type=? AND created>=? "
+                    "AND id IN (%s)" % ",".join("?" * len(batch)), [source, from_type, to_type, oldest] + batch)
+                failed.update(row[0] for row in rows)
+            self._conn.executemany("UPDATE failures SET accessed=? WHERE source=? AND from_type=? AND to_type=? AND id=?",
+                                   [(now, source, from_type, to_type, i) for i in failed])
+            self._conn.commit()
+            self.failed_hits[source] = self.failed_hits.get(source, 0) + len(failed)
+        return failed
+
+    def set_failed(self, source, from_type, to_type, ids):
+        """ Record identifiers that the source definitively could not map"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?, ?, ?)",
+                                   [(source, from_type, to_type, str(i), now, now) for i in ids])
+            self._conn.commit()
+        self.evict()
+
+    def evict(self):
+        """ Remove expired entries and, if over capacity, the least recently accessed entries"""
+        now = time.time()
+        with self._lock:
+            for table, ttls, max_entries in [("mappings", self.ttls, self.max_entries),
+                                             ("failures", self.negative_ttls, self.max_failures)]:
+                for source, ttl in ttls.items():
+                    self._conn.execute("DELETE FROM %s WHERE source=? AND created<?" % table, (source, now - ttl))
+                n_entries = self._conn.execute("SELECT COUNT(*) FROM %s" % table).fetchone()[0]
+                if n_entries > max_entries:
+                    self._conn.execute("DELETE FROM %s WHERE rowid IN (SELECT rowid FROM %s "
+                                       "ORDER BY accessed LIMIT ?)" % (table, table), (n_entries - max_entries,))
+            self._conn.commit()
+
+    def clear(self, source=None):
+        """ Remove all entries, or only those from a single source, including unmappable identifiers"""
+        with self._lock:
+            for table in ["mappings", "failures"]:
+                if source is None:
+                    self._conn.execute("DELETE FROM %s" % table)
+                else:
+                    self._conn.execute("DELETE FROM %s WHERE source=?" % table, (source,))
+            self._conn.commit()
+
+    def stats(self):
+        """ Summarize cache usage
+
+        Returns:
+            dict: per-source entries, hits, misses and hit rate, and the unmappable identifiers stored and found
+        """
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT source, COUNT(*) FROM mappings GROUP BY source").fetchall())
+            failures = dict(self._conn.execute("SELECT source, COUNT(*) FROM failures GROUP BY source").fetchall())
+        stats = {}
+        for source in set(counts) | set(self.hits) | set(self.misses) | set(failures) | set(self.failed_hits):
+            hits, misses = self.hits.get(source, 0), self.misses.get(source, 0)
+            stats[source] = {"entries": counts.get(source, 0), "hits": hits, "misses": misses,
+                             "hit_rate": hits / (hits + misses) if (hits + misses) > 0 else 0.0,
+                             "failures": failures.get(source, 0), "failed_hits": self.failed_hits.get(source, 0)}
+        return stats
+
+    def close(self):
+        self._conn.close()
+
+
+def _to_json(obj):
+    # numpy scalars returned by pandas are not JSON serializable
+    if hasattr(obj, "item"):
+        return obj.item()
+    return str(obj)
+
+
+def set_cache(cache):
+    """ Set the MappingCache used by all query modules. Pass None to disable caching."""
+    global _cache
+    _cache = cache
+
+
+def get_cache():
+    return _cache
+
+
+def configure_cache(cache_dir, **kwargs):
+    """ Create a persistent MappingCache in cache_dir and use it for all queries
+
+    Args:
+        cache_dir (str): Directory in which to store the cache database
+        **kwargs: passed to MappingCache
+
+    Returns:
+        MappingCache: the active cache
+    """
+    global _cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    _cache_dir = cache_dir
+    set_cache(MappingCache(os.path.join(cache_dir, DEFAULT_CACHE_FILE), **kwargs))
+    return _cache
+
+
+def cache_file(filename):
+    """ Path for an auxiliary cache file in the configured cache directory, or None if there is none"""
+    if _cache_dir is None:
+        return None
+    return os.path.join(_cache_dir, filename)
+
+
+def lookup(source, from_type, to_type, ids):
+    """ Split identifiers into those already cached and those still requiring a remote query. The number found
+    is reported to the span recording requests, as "cached".
+
+    Returns:
+        dict: cached values for identifiers found in the cache
+        list: identifiers not found in the cache, in input order
+    """
+    ids = list(ids)
+    if _cache is None or len(ids) == 0:
+        return {}, ids
+    hits = _cache.get_many(source, from_type, to_type, ids)
+    record(cached=len(hits))
+    return hits, [i for i in ids if str(i) not in hits]
+
+
+def store(source, from_type, to_type, mapping):
+    """ Add newly queried mappings to the active cache, if there is one"""
+    if _cache is not None and len(mapping) > 0:
+        _cache.set_many(source, from_type, to_type, mapping)
+
+
+def lookup_failed(source, from_type, to_type, ids):
+    """ Split identifiers into those known to be unmappable and those still to be queried
+
+    Returns:
+        list: identifiers recorded as unmappable, in input order
+        list: the other identifiers, in input order
+    """
+    ids = list(ids)
+    if _cache is None or len(ids) == 0:
+        return [], ids
+    failed = _cache.get_failed(source, from_type, to_type, ids)
+    record(cached=len(failed))
+    return [i for i in ids if str(i) in failed], [i for i in ids if str(i) not in failed]
+
+
+def store_failed(source, from_type, to_type, ids):
+    """ Record identifiers that could not be mapped in the active cache, if there is one. Only pass definitive
+    misses, not identifiers whose requests failed."""
+    ids = list(ids)
+    if _cache is not None and len(ids) > 0:
+        _cache.set_failed(source, from_type, to_type, ids)
+
+
+def frame_to_rows(df, exclude=()):
+    """ Convert a DataFrame indexed by query into cacheable lists of row records per query
+
+    Args:
+        df (pd.DataFrame): results indexed by the query identifier, possibly with several rows per query
+        exclude (iterable): queries that should not be cached (e.g. those with no hit)
+
+    Returns:
+        dict: mapping from query to a list of row dictionaries
+    """
+    exclude = set(exclude)
+    rows = {}
+    for query, record in zip(df.index, df.to_dict(orient="records")):
+        if query not in exclude:
+            rows.setdefault(query, []).append(record)
+    return rows
+
+
+def rows_to_frame(rows):
+    """ Rebuild a query-indexed DataFrame from cached row records
+
+    Returns:
+        pd.DataFrame: results indexed by query
+        list: queries with more than one cached row
+    """
+    records = [record for query in rows for record in rows[query]]
+    index = [query for query in rows for _ in rows[query]]
+    dups = [query for query in rows if len(rows[query]) > 1]
+    return pd.DataFrame.from_records(records, index=index), dups
@@ -0,0 +1,63 @@
+import re
+import pandas as pd
+
+# Identifier formats, in order of precedence. An identifier is given the first type whose pattern matches it
+# completely, e.g. "1017" is Entrez rather than Symbol and "P04637" is Uniprot rather than Symbol.
+ID_PATTERNS = {
+    "Ensembl": r"ENSG\d{11}(?:\.\d+)?",
+    "EnsemblProtein": r"ENSP\d{11}(?:\.\d+)?",
+    "Refseq": r"(?:NM|NR|NP|XM|XR|XP|NC|NG|NT|NW|WP)_\d+(?:\.\d+)?",
+    "Uniprot": r"(?:[OPQ][0-9][A-Z0-9]{3}[0-9]|[A-NR-Z][0-9](?:[A-Z][A-Z0-9]{2}[0-9]){1,2})(?:-\d+)?|[A-Z0-9]{1,10}_HUMAN",
+    "DIP": r"DIP-\d+N",
+    "CHEBI": r"CHEBI:\d+",
+    "Entrez": r"\d+",
+    "Symbol": r"[A-Za-z0-9][A-Za-z0-9\-\.@#/]*",
+}
+# label of identifiers matching none of the patterns
+UNKNOWN = "Unknown"
+# full gene names of several words (e.g. "Cyclin dependent kinase 6"), which are searched with the symbols
+GENE_NAME = re.compile(r"\S+(?: \S+)+\Z")
+# many UniProt accessions also have the form of a symbol, and some symbols (B3GAT1, P2RY12) that of an accession
+SYMBOL = re.compile(ID_PATTERNS["Symbol"] + r"\Z")
+
+# a single alternation with a named group per type, so each identifier is matched once and the name of the
+# matching group is its type
+ID_REGEX = re.compile("(?:" + "|".join(f"(?P<{id_type}>{pattern})" for id_type, pattern in ID_PATTERNS.items())
+                      + r")\Z")
+
+
+def classify_ids(nodes):
+    """ Label each identifier with its identifier type
+
+    Args:
+        nodes (iterable): identifiers of any mix of the types in ID_PATTERNS
+
+    Returns:
+        pd.Series: identifier type of each identifier (UNKNOWN if none match), indexed by identifier
+    """
+    nodes = list(nodes)
+    match = ID_REGEX.match
+    labels = [_label(match(str(node))) for node in nodes]
+    return pd.Series(labels, index=nodes, dtype=object)
+
+
+def _label(match):
+    return match.lastgroup if match is not None else UNKNOWN
+
+
+def split_by_type(nodes):
+    """ Group identifiers by their identifier type. Gene names of unknown type are grouped with the symbols, since
+    updating symbols also searches gene names.
+
+    Returns:
+        dict: list of identifiers for each identifier type present
+    """
+    labels = classify_ids(nodes)
+    labels = pd.Series(["Symbol" if (label == UNKNOWN) and (GENE_NAME.match(str(node)) is not None) else label
+                        for node, label in labels.items()], index=labels.index, dtype=object)
+    return {id_type: group.index.tolist() for id_type, group in labels.groupby(labels, sort=False)}
+
+
+def symbol_shaped(nodes):
+    """ Identifiers that could also be HGNC symbols, e.g. UniProt accessions that UniProt does not know"""
+    return [node for node in nodes if SYMBOL.match(str(node)) is not None]
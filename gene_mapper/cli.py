@@ -1,17 +1,203 @@
 """Console script for gene_mapper."""
 import argparse
+import contextlib
 import sys
+from itertools import islice
 
+from gene_mapper import mapper
+from gene_mapper import sharding
+from gene_mapper import incremental
+from gene_mapper import cache
+from gene_mapper import hgnc_snapshot
+from gene_mapper import ensembl_history
+from gene_mapper import uniprot_index
+from gene_mapper import ncbi_genes
+from gene_mapper import name_index
+from gene_mapper import replay
+from gene_mapper import query_hgnc as hgnc
+from gene_mapper import query_uniprot as uni
+from gene_mapper import query_ensembl as ensg
+from gene_mapper import query_mygene
+from gene_mapper.planner import ConversionPlanner
+from gene_mapper.Timer import Timer
 
-def main():
-    """Console script for gene_mapper."""
-    parser = argparse.ArgumentParser()
-    parser.add_argument('_', nargs='*')
-    args = parser.parse_args()
+ID_TYPES = ["Symbol", "Entrez", "Uniprot", "Ensembl", "EnsemblProtein", "Refseq", "DIP"]
+# identifiers read and mapped at a time
+CHUNK_SIZE = 100000
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(prog="gene_mapper", description="Update and convert gene identifiers")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("-i", "--input", nargs="*", default=["-"],
+                        help="files with one identifier per line ('-' for stdin, the default)")
+    common.add_argument("-o", "--output", default="-", help="file for the mapping table ('-' for stdout, the default)")
+    common.add_argument("--failed", help="file to write identifiers that could not be mapped to")
+    common.add_argument("--workers", type=int, help="maximum concurrent requests per service")
+    common.add_argument("--batch-size", type=int, help="identifiers per request to each service")
+    common.add_argument("--processes", type=int, default=1, help="worker processes mapping each chunk "
+                        f"(shards smaller than {sharding.MIN_SHARD_SIZE} identifiers are not split further)")
+    common.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="identifiers read and mapped at a time")
+    common.add_argument("--cache-dir", help="directory for the persistent mapping cache")
+    common.add_argument("--hgnc-snapshot", help="HGNC complete set file to use instead of the HGNC REST API")
+    common.add_argument("--ensembl-history", nargs="*", help="Ensembl stable_id_event files to use instead of the "
+                        "Ensembl REST API")
+    common.add_argument("--hgnc-names", help="HGNC complete set file whose gene names are searched locally before "
+                        "MyGene.info (implied by --hgnc-snapshot)")
+    common.add_argument("--uniprot-index", help="UniProt index directory (python -m gene_mapper.uniprot_index) to "
+                        "use instead of the UniProt ID mapping service")
+    common.add_argument("--uniprot-stream", action="store_true", help="download UniProt ID mapping results as "
+                        "compressed TSV parsed in chunks, which uses less memory for very large jobs")
+    common.add_argument("--ncbi-gene-info", help="NCBI gene_info file to use instead of MyGene.info for Entrez "
+                        "updates and Entrez to Symbol conversions")
+    common.add_argument("--ncbi-gene-history", help="NCBI gene_history file resolving discontinued GeneIDs, with "
+                        "--ncbi-gene-info")
+    archive = common.add_mutually_exclusive_group()
+    archive.add_argument("--record", metavar="ARCHIVE", help="record every request to the services in this file")
+    archive.add_argument("--replay", metavar="ARCHIVE", help="answer every request from a recorded file instead "
+                         "of the network")
+    common.add_argument("--manifest", help="mapping manifest of a previous run. Only identifiers that are not in it "
+                        "are queried, and it is updated with the result of this run")
+    common.add_argument("--retry-failed", action="store_true", help="query identifiers that failed in the "
+                        "manifest's run again")
+    common.add_argument("--timings", action="store_true", help="print the time spent in each step to stderr")
+    common.add_argument("--trace", help="write the timed steps to this file in Chrome trace-event format")
+
+    update = subparsers.add_parser("update", parents=[common],
+                                   help="update identifiers to their latest version (mapper.update_nodes)")
+    update.add_argument("--id-type", required=True, choices=ID_TYPES + ["auto"],
+                        help="identifier type of the input, or auto to detect the type of each identifier")
+    update.add_argument("--keep", default="present", choices=["updated", "present", "all"])
+
+    convert = subparsers.add_parser("convert", parents=[common],
+                                    help="convert identifiers to another type (mapper.convert_node_ids)")
+    convert.add_argument("--from", dest="initial_id", required=True, choices=ID_TYPES + ["auto"],
+                         help="identifier type of the input, or auto to detect the type of each identifier")
+    convert.add_argument("--to", dest="target_id", required=True, choices=ID_TYPES)
+    convert.add_argument("--planner", action="store_true", help="choose the conversion route by measured cost")
+    return parser.parse_args(args)
+
+
+def configure_services(workers=None, batch_size=None, uniprot_stream=False):
+    """ Set the concurrency and request size used by every query module, and how UniProt results are fetched"""
+    if workers is not None:
+        hgnc.MAX_WORKERS = workers
+        ensg.MAX_WORKERS = workers
+        query_mygene.MAX_WORKERS = workers
+        uni.MAX_CONCURRENT_JOBS = workers
+    if batch_size is not None:
+        ensg.BATCH_SIZE = batch_size
+        query_mygene.BATCH_SIZE = batch_size
+        uni.CHUNK_SIZE = batch_size
+    uni.STREAM_RESULTS = uniprot_stream
+
+
+def read_ids(paths, chunk_size=CHUNK_SIZE):
+    """ Yield lists of up to chunk_size unique identifiers read line by line from files or stdin"""
+    seen = set()
 
-    print("Arguments: " + str(args._))
-    print("Replace this message by putting your code into "
-          "gene_mapper.cli.main")
+    def lines():
+        for path in paths:
+            f = sys.stdin if path == "-" else open(path)
+            try:
+                for line in f:
+                    node = line.strip()
+                    if node and (node not in seen):
+                        seen.add(node)
+                        yield node
+            finally:
+                if f is not sys.stdin:
+                    f.close()
+    ids = lines()
+    while True:
+        chunk = list(islice(ids, chunk_size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+@contextlib.contextmanager
+def open_output(path):
+    if (path is None) or (path == "-"):
+        yield sys.stdout
+    else:
+        with open(path, "w") as f:
+            yield f
+
+
+def mapping_function(args, planner=None):
+    """ The mapper function for the command, with its arguments after the nodes
+
+    Returns:
+        str: name of the function in mapper
+        tuple: positional arguments
+        dict: keyword arguments
+    """
+    if (args.command == "update") and (args.id_type == "auto"):
+        return "update_mixed_nodes", (), {"keep": args.keep}
+    if args.command == "update":
+        return "update_nodes", (args.id_type,), {"keep": args.keep}
+    if args.initial_id == "auto":
+        return "convert_mixed_node_ids", (args.target_id,), {}
+    return "convert_node_ids", (args.initial_id, args.target_id), {"planner": planner}
+
+
+def main(args=None):
+    """Console script for gene_mapper."""
+    args = parse_args(args)
+    configure_services(args.workers, args.batch_size, args.uniprot_stream)
+    if args.cache_dir is not None:
+        cache.configure_cache(args.cache_dir)
+    if (args.record or args.replay) is not None:
+        replay.load_archive(args.record or args.replay, mode="record" if args.record is not None else "replay")
+    timer = Timer()
+    planner = ConversionPlanner() if getattr(args, "planner", False) else None
+    function, function_args, function_kwargs = mapping_function(args, planner)
+    previous = incremental.load_manifest(args.manifest)
+    manifests = []
+    n_mapped, n_failed = 0, 0
+    with open_output(args.output) as out, open_output(args.failed) as failed_out:
+        out.write("from\tto\n")
+        # progress messages from the query modules go to stderr so stdout holds only the mapping table
+        with contextlib.redirect_stdout(sys.stderr):
+            if args.hgnc_snapshot is not None:
+                hgnc_snapshot.load_snapshot(args.hgnc_snapshot)
+            if args.ensembl_history is not None:
+                ensembl_history.load_history(args.ensembl_history)
+            if args.hgnc_names is not None:
+                name_index.load_index(args.hgnc_names)
+            if args.uniprot_index is not None:
+                uniprot_index.load_index(args.uniprot_index)
+            if args.ncbi_gene_info is not None:
+                ncbi_genes.load_genes(args.ncbi_gene_info, args.ncbi_gene_history)
+            for chunk in read_ids(args.input, args.chunk_size):
+                if args.manifest is not None:
+                    node_map, failed, manifest = incremental.map_incremental(
+                        function, set(chunk), *function_args, manifest=previous, retry_failed=args.retry_failed,
+                        processes=args.processes, timer=timer, **function_kwargs)
+                    manifests.append(manifest)
+                elif args.processes > 1:
+                    node_map, failed = sharding.map_sharded(function, set(chunk), *function_args,
+                                                            processes=args.processes, timer=timer, **function_kwargs)
+                else:
+                    node_map, failed = getattr(mapper, function)(set(chunk), *function_args, timer=timer,
+                                                                 **function_kwargs)
+                for node, new_id in node_map.items():
+                    out.write(f"{node}\t{'' if new_id != new_id else new_id}\n")
+                if args.failed is not None:
+                    failed_out.writelines(f"{node}\n" for node in failed)
+                out.flush()
+                n_mapped += len(node_map)
+                n_failed += len(failed)
+    if len(manifests) > 0:
+        incremental.Manifest.combine(manifests).save(args.manifest)
+    print(f"Mapped {n_mapped} identifiers, {n_failed} failed", file=sys.stderr)
+    if args.timings:
+        with contextlib.redirect_stdout(sys.stderr):
+            timer.print_all_times()
+    if args.trace is not None:
+        timer.to_chrome_trace(args.trace)
     return 0
 
 
@@ -0,0 +1,14 @@
+# The queries and mapping functions are written once as coroutines over an object that sends their requests
+# (a transport, or mapper.Services). The synchronous transports send each request before returning, so their
+# coroutines never suspend and run_sync finishes them without an event loop. The asynchronous transports in
+# async_query send the same requests from the running event loop.
+
+
+def run_sync(coroutine):
+    """ Run a coroutine whose awaits all complete immediately, and return its result"""
+    try:
+        coroutine.send(None)
+    except StopIteration as finished:
+        return finished.value
+    coroutine.close()
+    raise RuntimeError("a coroutine run synchronously was suspended")
@@ -0,0 +1,112 @@
+import pandas as pd
+
+# Column order of stable_id_event.txt(.gz) in the Ensembl core database dumps, e.g.
+# https://ftp.ensembl.org/pub/current_mysql/homo_sapiens_core_*/stable_id_event.txt.gz
+STABLE_ID_EVENT_COLUMNS = ["old_stable_id", "old_version", "new_stable_id", "new_version", "mapping_session_id",
+                           "type", "score"]
+# Column names in the output of the Ensembl ID History Converter
+ID_HISTORY_COLUMNS = {"Old stable ID": "old_stable_id", "New stable ID": "new_stable_id",
+                      "Release": "mapping_session_id", "Mapping score": "score"}
+
+_history = None
+
+
+class EnsemblHistory:
+    """ Local index resolving retired Ensembl stable ids to their latest replacement.
+
+    For each id the event from the most recent mapping session gives its successor (the highest scoring one if the
+    id was split). Successors are followed through later releases until a current id is reached. Ids retired
+    without a successor map to themselves, matching the behaviour of the /archive/id endpoint.
+
+    Args:
+        events (pd.DataFrame): stable id events with columns old_stable_id, new_stable_id, mapping_session_id
+            and score. new_stable_id is missing for retired ids.
+    """
+    def __init__(self, events):
+        events = events.dropna(subset=["old_stable_id"])
+        events = events.sort_values(by=["mapping_session_id", "score"], kind="stable")
+        last_events = events.drop_duplicates(subset=["old_stable_id"], keep="last")
+        successors = dict(zip(last_events["old_stable_id"], last_events["new_stable_id"]))
+        self.latest = {}
+        for stable_id in successors:
+            self.latest[stable_id] = self._resolve(stable_id, successors)
+        print("Indexed", len(self.latest), "Ensembl stable ids")
+
+    def _resolve(self, stable_id, successors):
+        chain = [stable_id]
+        current = stable_id
+        while True:
+            if current in self.latest:
+                resolved = self.latest[current]
+                break
+            successor = successors.get(current)
+            if (successor is None) or (successor != successor) or (successor == current) or (successor in chain):
+                # current, retired without replacement, or a cycle in the history
+                resolved = current
+                break
+            chain.append(successor)
+            current = successor
+        for chained_id in chain:
+            self.latest[chained_id] = resolved
+        return resolved
+
+    @classmethod
+    def from_files(cls, paths, types=("gene", "translation")):
+        """ Build the index from stable_id_event dumps or ID History Converter output
+
+        Args:
+            paths (str or list): one or more stable_id_event.txt(.gz) files (tab separated, no header) or
+                ID History Converter csv files
+            types (tuple): stable id types to keep from stable_id_event dumps
+
+        Returns:
+            EnsemblHistory: the index
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+        frames = []
+        for path in paths:
+            if path.endswith(".csv") or path.endswith(".csv.gz"):
+                events = pd.read_csv(path, dtype=str, skipinitialspace=True)
+                events = events.rename(columns=lambda c: ID_HISTORY_COLUMNS.get(c.strip(), c.strip()))
+                for column in ["old_stable_id", "new_stable_id"]:
+                    # the converter reports stable ids with their version, e.g. ENSG00000139618.15
+                    events[column] = events[column].str.split(".").str[0]
+                events.loc[events["new_stable_id"].isin(["<retired>", ""]), "new_stable_id"] = None
+            else:
+                events = pd.read_csv(path, sep="\t", header=None, names=STABLE_ID_EVENT_COLUMNS, na_values=["\\N"],
+                                     dtype={"old_stable_id": str, "new_stable_id": str, "type": str})
+                events = events.loc[events["type"].isin(types)]
+            frames.append(events.loc[:, ["old_stable_id", "new_stable_id", "mapping_session_id", "score"]])
+        events = pd.concat(frames, ignore_index=True)
+        events["mapping_session_id"] = pd.to_numeric(events["mapping_session_id"], errors="coerce")
+        events["score"] = pd.to_numeric(events["score"], errors="coerce").fillna(0)
+        return cls(events)
+
+    def get_latest_ensembl_id(self, ids):
+        """ Same return values as query_ensembl.get_latest_ensembl_id, without network access"""
+        ids = list(ids)
+        # versioned input ids (ENSG00000139618.15) are looked up by their stable id
+        latest = [self.latest.get(i.split(".")[0]) for i in ids]
+        results_df = pd.DataFrame({"from": [i for i, to in zip(ids, latest) if to is not None],
+                                   "to": [to for to in latest if to is not None]})
+        missing = [i for i, to in zip(ids, latest) if to is None]
+        return results_df, missing
+
+
+def set_history(history):
+    """ Set the EnsemblHistory used by query_ensembl in place of the archive endpoint. None restores the REST API."""
+    global _history
+    _history = history
+
+
+def get_history():
+    return _history
+
+
+def load_history(paths, **kwargs):
+    """ Build an EnsemblHistory from dump files and use it for all Ensembl updates"""
+    set_history(EnsemblHistory.from_files(paths, **kwargs))
+    # arguments to load it again, e.g. in sharding worker processes
+    _history.source = ((paths,), kwargs)
+    return _history
@@ -0,0 +1,28 @@
+import gzip
+import json
+import pandas as pd
+
+# Reading of HGNC complete set files, shared by hgnc_snapshot and name_index.
+# Complete set files are available from https://www.genenames.org/download/archive/
+MULTI_VALUE_FIELDS = ["alias_symbol", "prev_symbol", "alias_name", "prev_name"]
+
+
+def read_records(path):
+    """ HGNC entries of a complete set file (hgnc_complete_set.txt or .json, optionally gzipped) as dictionaries"""
+    if path.endswith(".json") or path.endswith(".json.gz"):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt") as f:
+            data = json.load(f)
+        return data["response"]["docs"] if "response" in data else data
+    columns = ["symbol", "status", "name", "entrez_id"] + MULTI_VALUE_FIELDS
+    return pd.read_csv(path, sep="\t", dtype=str, usecols=lambda c: c in columns,
+                       keep_default_na=False).to_dict("records")
+
+
+def split_field(value):
+    """ Values of a multi-valued field, given as a list or a '|' separated string"""
+    if value is None or value != value:
+        return []
+    if isinstance(value, str):
+        return [v.strip() for v in value.strip('"').split("|") if v.strip()]
+    return list(value)
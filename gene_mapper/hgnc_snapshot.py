@@ -0,0 +1,96 @@
+from gene_mapper import name_index
+from gene_mapper.hgnc_records import read_records, split_field
+
+_snapshot = None
+
+
+class HGNCSnapshot:
+    """ In-memory hash indexes over an HGNC complete set dump, allowing symbol updating without REST calls.
+
+    Args:
+        records (list): HGNC entries as dictionaries with at least 'symbol' and 'status'. Multi-valued fields
+            (alias_symbol, prev_symbol, alias_name, prev_name) may be lists or '|' separated strings.
+    """
+    def __init__(self, records):
+        self.previous = {}
+        self.alias = {}
+        self.entrez = {}
+        self.names = {}
+        approved = set()
+        for entry in records:
+            if entry.get("status", "Approved") != "Approved":
+                continue
+            symbol = entry["symbol"]
+            approved.add(symbol)
+            for prev in split_field(entry.get("prev_symbol")):
+                self.previous.setdefault(prev, set()).add(symbol)
+            for alias in split_field(entry.get("alias_symbol")):
+                self.alias.setdefault(alias, set()).add(symbol)
+            entrez_id = entry.get("entrez_id")
+            if (entrez_id is not None) and (entrez_id == entrez_id) and (str(entrez_id) != ""):
+                self.entrez[symbol] = str(entrez_id).split(".")[0]
+            if entry.get("name"):
+                self.names[symbol] = entry["name"]
+        self.approved = frozenset(approved)
+        self.name_index = name_index.NameIndex.from_records(records)
+
+    @classmethod
+    def from_file(cls, path):
+        """ Load an HGNC complete set file (hgnc_complete_set.txt or .json, optionally gzipped)
+
+        Args:
+            path (str): path to the TSV or JSON dump
+
+        Returns:
+            HGNCSnapshot: indexes built from the file
+        """
+        records = read_records(path)
+        print("Loaded HGNC snapshot", path)
+        return cls(records)
+
+    def search_approved_symbols(self, ids):
+        approved_map = {sym: sym for sym in ids if sym in self.approved}
+        missing = set(ids).difference(approved_map.keys())
+        return approved_map, missing
+
+    def query_previous_symbols(self, ids):
+        return _resolve(ids, self.previous)
+
+    def query_alias_symbols(self, ids):
+        return _resolve(ids, self.alias)
+
+    def query_other_id(self, ids, target_id):
+        if target_id != "Entrez":
+            raise NotImplementedError("Only Entrez ids are indexed in the HGNC snapshot")
+        target_map = {sym: self.entrez[sym] for sym in ids if sym in self.entrez}
+        missing = set(ids).difference(target_map.keys())
+        return target_map, missing
+
+    def search_gene_names(self, ids):
+        """ Ranked matching of full gene names to approved symbols, see name_index.NameIndex"""
+        return self.name_index.search_gene_names(ids)
+
+
+def _resolve(ids, index):
+    # where a symbol is ambiguous take the first approved symbol alphabetically so results are reproducible
+    id_map = {sym: sorted(index[sym])[0] for sym in ids if sym in index}
+    missing = set(ids).difference(id_map.keys())
+    return id_map, missing
+
+
+def set_snapshot(snapshot):
+    """ Set the HGNCSnapshot used by query_hgnc in place of REST calls. Pass None to go back to the REST API."""
+    global _snapshot
+    _snapshot = snapshot
+
+
+def get_snapshot():
+    return _snapshot
+
+
+def load_snapshot(path):
+    """ Load an HGNC complete set file and use it for all HGNC queries"""
+    set_snapshot(HGNCSnapshot.from_file(path))
+    # arguments to load it again, e.g. in sharding worker processes
+    _snapshot.source = ((path,), {})
+    return _snapshot
@@ -0,0 +1,169 @@
+import os
+import gzip
+import json
+import time
+import numpy as np
+import pandas as pd
+from gene_mapper import mapper
+from gene_mapper import sharding
+from gene_mapper.Timer import Timer
+from gene_mapper.mapping_table import MappingTable
+
+# Incremental re-mapping. A Manifest records the result of a run, and the next run with the same function and
+# identifier types only queries the nodes that are not in it, so a repeated build costs time proportional to
+# what changed rather than to the size of the network.
+
+MANIFEST_VERSION = 1
+
+
+class Manifest:
+    """ The nodes mapped by a run of a mapper function, their mapped identifiers and the nodes that failed.
+
+    Mappings are stored as update_nodes returns them with keep="present", so the same manifest serves any keep.
+
+    Args:
+        function (str): name of the mapper function, e.g. "update_nodes"
+        args (list): its identifier type arguments, e.g. ["Symbol"] or ["Uniprot", "Entrez"]
+        mapping (MappingTable or dict): mapped identifier of each node that could be mapped
+        failed (list): nodes that could not be mapped
+        created (float): time of the run that queried the oldest of the mappings, as seconds since the epoch,
+            now if None
+    """
+    def __init__(self, function, args, mapping=None, failed=(), created=None):
+        self.function = function
+        self.args = list(args)
+        self.mapping = MappingTable.from_mapping(mapping if mapping is not None else {})
+        self.failed = list(failed)
+        self.created = time.time() if created is None else created
+
+    def __len__(self):
+        return len(self.mapping) + len(self.failed)
+
+    def matches(self, function, args):
+        """ Whether the manifest was made by the same function with the same identifier types"""
+        return (function == self.function) and (list(args) == self.args)
+
+    @classmethod
+    def combine(cls, manifests):
+        """ Merge manifests of the same function, e.g. from successive chunks of one run, keeping the oldest time"""
+        manifests = list(manifests)
+        return cls(manifests[0].function, manifests[0].args,
+                   MappingTable.concat([manifest.mapping for manifest in manifests]),
+                   [node for manifest in manifests for node in manifest.failed],
+                   created=min(manifest.created for manifest in manifests))
+
+    def save(self, path):
+        """ Write the manifest as JSON, gzipped if path ends with .gz"""
+        opener = gzip.open if path.endswith(".gz") else open
+        data = {"version": MANIFEST_VERSION, "function": self.function, "args": self.args, "created": self.created,
+                "from": self.mapping.index.tolist(), "to": [None if v != v else v for v in self.mapping.values()],
+                "failed": self.failed}
+        with opener(path, "wt") as f:
+            json.dump(data, f, default=_to_json)
+
+    @classmethod
+    def load(cls, path):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt") as f:
+            data = json.load(f)
+        if data.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"{path} is not a version {MANIFEST_VERSION} mapping manifest")
+        return cls(data["function"], data["args"], MappingTable(data["from"], data["to"]), data["failed"],
+                   created=data["created"])
+
+
+def _to_json(obj):
+    # numpy scalars returned by pandas are not JSON serializable
+    if hasattr(obj, "item"):
+        return obj.item()
+    return str(obj)
+
+
+def load_manifest(path):
+    """ The Manifest in path, or None if the file does not exist yet"""
+    if (path is None) or not os.path.exists(path):
+        return None
+    return Manifest.load(path)
+
+
+def map_incremental(function, nodes, *args, manifest=None, retry_failed=False, max_age=None, processes=1,
+                    timer=None, **kwargs):
+    """ Run a mapper function on the nodes that are not in the manifest of a previous run
+
+    Nodes mapped in the previous run reuse its result, nodes that failed stay failed unless retry_failed is set,
+    and only the remaining nodes are queried. Nodes of the previous run that are not in nodes are left out of
+    the new manifest.
+
+    Args:
+        function (str): "update_nodes", "convert_node_ids", "update_mixed_nodes" or "convert_mixed_node_ids"
+        nodes (set): identifiers to map
+        *args: identifier types passed to the function after the nodes
+        manifest (Manifest): result of a previous run, or None to map every node
+        retry_failed (bool): query nodes that failed in the previous run again
+        max_age (float): ignore a manifest older than this many seconds and map every node
+        processes (int): map the new nodes in this many processes with sharding.map_sharded
+        **kwargs: passed to the function. keep is applied to the merged result.
+
+    Returns:
+        MappingTable: mapping between input nodes and new identifiers
+        list: nodes that could not be mapped
+        Manifest: manifest of this run, to pass to the next one
+    """
+    if timer is None:
+        timer = Timer()
+    keep = kwargs.pop("keep", None)
+    if keep is not None:
+        kwargs["keep"] = "present"
+    nodes = pd.Index(list(set(nodes)), dtype=object)
+    if (manifest is not None) and not manifest.matches(function, args):
+        raise ValueError(f"The manifest is for {manifest.function}{tuple(manifest.args)}, not {function}{args}")
+    if (manifest is not None) and (max_age is not None) and (time.time() - manifest.created > max_age):
+        print("Manifest is older than", max_age, "seconds, mapping all nodes")
+        manifest = None
+    if manifest is None:
+        manifest = Manifest(function, args, created=0)
+    with timer.span("Incremental " + function, nodes=len(nodes)) as span:
+        previous = nodes.isin(manifest.mapping.index)
+        previously_failed = nodes.isin(manifest.failed) & ~previous
+        new = ~previous if retry_failed else ~(previous | previously_failed)
+        reused = MappingTable(nodes[previous], manifest.mapping.apply(nodes[previous]))
+        failed = [] if retry_failed else nodes[previously_failed].tolist()
+        span.set(reused=int(previous.sum()) + len(failed), queried=int(new.sum()))
+        print("Reusing", span.attributes["reused"], "mapped nodes, querying", span.attributes["queried"])
+        queried = MappingTable()
+        if new.any() and (processes > 1):
+            queried, queried_failed = sharding.map_sharded(function, set(nodes[new]), *args, processes=processes,
+                                                           timer=timer, **kwargs)
+            failed += list(queried_failed)
+        elif new.any():
+            queried, queried_failed = getattr(mapper, function)(set(nodes[new]), *args, timer=timer, **kwargs)
+            failed += list(queried_failed)
+        node_map = MappingTable.concat([reused, queried])
+    # reused mappings are as old as the previous manifest, so max_age eventually refreshes them
+    run = Manifest(function, args, node_map, failed,
+                   created=manifest.created if span.attributes["reused"] > 0 else None)
+    return _keep_mapped(node_map, failed, keep), failed, run
+
+
+def _keep_mapped(node_map, failed, keep):
+    # apply update_nodes' keep option to a result mapped with keep="present"
+    if keep == "updated":
+        updated = node_map.index.values != node_map.values_array()
+        return MappingTable(node_map.index[updated], node_map.values_array()[updated])
+    if keep == "all":
+        return MappingTable.concat([node_map, MappingTable(failed, np.full(len(failed), np.nan, dtype=object))])
+    return node_map
+
+
+def update_nodes_incremental(nodes, id_type, manifest=None, keep="present", retry_failed=False, max_age=None,
+                             timer=None):
+    """ mapper.update_nodes on the nodes not in a previous run's manifest, see map_incremental"""
+    return map_incremental("update_nodes", nodes, id_type, manifest=manifest, keep=keep, retry_failed=retry_failed,
+                           max_age=max_age, timer=timer)
+
+
+def convert_node_ids_incremental(nodes, initial_id, target_id, manifest=None, retry_failed=False, max_age=None,
+                                 timer=None):
+    """ mapper.convert_node_ids on the nodes not in a previous run's manifest, see map_incremental"""
+    return map_incremental("convert_node_ids", nodes, initial_id, target_id, manifest=manifest,
+                           retry_failed=retry_failed, max_age=max_age, timer=timer)
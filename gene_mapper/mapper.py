@@ -3,15 +3,31 @@ import numpy as np
 from gene_mapper import query_uniprot as uni
 from gene_mapper import query_hgnc as hgnc
 from gene_mapper import query_ensembl as ensg
-from gene_mapper import Timer
-import mygene
+from gene_mapper import async_query as aq
+from gene_mapper import cache
+from gene_mapper import hgnc_snapshot
+from gene_mapper import uniprot_index
+from gene_mapper import ncbi_genes
+from gene_mapper import classify
+from gene_mapper.mapping_table import MappingTable
+from gene_mapper.coroutines import run_sync
+from gene_mapper.Timer import Timer, in_context
+from gene_mapper.query_mygene import query_mygene, get_mygene
 import csv
+import asyncio
 import re
 from itertools import combinations
+from concurrent.futures import ThreadPoolExecutor
 import os
 
 from datetime import datetime
 
+MYGENE_FIELDS = {"Symbol": "symbol", "Entrez": 'entrezgene', "Uniprot": "uniprot", "Ensembl": "ensembl.gene",
+                 "Refseq": "refseq", "EnsemblProtein": "ensembl.protein"}
+# nodes sent to UniProt by update_nodes, and nodes never sent to HGNC as symbols
+UNIPROT_QUERY = re.compile(r"[a-zA-Z0-9\.-]+\Z")
+NOT_SYMBOL = re.compile("CHEBI:|_HUMAN")
+
 
 def update_nodes(nodes, id_type, keep="present", timer=None):
     """ Takes a set of node identifiers and updates them to the latest version of the same identifier type.
@@ -23,194 +39,480 @@ def update_nodes(nodes, id_type, keep="present", timer=None):
         whether updated or not, "all" to keep all nodes (even if they are not present in the mapping data)
 
     Returns:
-        dict: Mapping between input nodes (key) and updated identifiers (values)
+        MappingTable: Mapping between input nodes (key) and updated identifiers (values)
+    """
+    return run_sync(_update_nodes(Services(), nodes, id_type, keep, timer))
+
+
+async def async_update_nodes(nodes, id_type, keep="present", timer=None):
+    """ Asynchronous version of update_nodes, sending all requests from the running event loop
+
+    Args:
+        nodes (set): The set of nodes to be updated
+        id_type (str): The type of identifier being used and updated
+        keep (str): "updated", "present" or "all", as for update_nodes
+
+    Returns:
+        MappingTable: Mapping between input nodes (key) and updated identifiers (values)
+        list: nodes that could not be updated
     """
+    async with aq.new_client() as client:
+        return await _update_nodes(AsyncServices(client), nodes, id_type, keep, timer)
+
+
+async def _update_nodes(services, nodes, id_type, keep, timer):
     # must return 1:1
     if timer is None:
         timer = Timer()
-    timer.start("Update Nodes")
-    updated_node_map = {}
+    timer.start("Update Nodes", id_type=id_type, nodes=len(nodes))
     if id_type == "Uniprot":
-        query_nodes = [node for node in nodes if (("_HUMAN" in node) or (re.fullmatch("[a-zA-Z0-9\.-]+", node) is not None))]
-        results, failed = uni.perform_uniprot_query(ids = query_nodes, from_db="UniProtKB_AC-ID", to_db="Uniprot")
+        query_nodes, excluded = _uniprot_nodes(nodes)
+        with timer.span("UniProt query", record_requests=True, service="uniprot", ids=len(query_nodes)):
+            results, failed = await services.perform_uniprot_query(query_nodes, "UniProtKB_AC-ID", "Uniprot")
         #print("DUPLICATED UNIPROT MAPPINGS")
         #print(results.loc[results.duplicated()])
         #remove duplicates
-        failed = list(failed) + [node for node in nodes if node not in query_nodes]
+        failed = list(failed) + excluded
         results = results.drop_duplicates(subset=["from"])
     elif id_type == "Symbol":
-        exclude_prefix_suffix = ["CHEBI:", "_HUMAN"]
-        query_nodes = [node for node in list(nodes) if re.search("|".join(exclude_prefix_suffix), node) is None]
-        results, failed = hgnc.perform_hgnc_query(query_nodes, "Symbol", "Symbol")
-        results = pd.DataFrame.from_dict(results, orient="index", columns = ["to"])
-        results["from"] = results.index.values
-        failed = list(failed) + [node for node in list(nodes) if re.search("|".join(exclude_prefix_suffix), node) is not None]
+        query_nodes, excluded = _symbol_nodes(nodes)
+        with timer.span("HGNC query", record_requests=True, service="hgnc", ids=len(query_nodes)):
+            results, failed = await services.perform_hgnc_query(query_nodes, "Symbol", "Symbol")
+        results = _symbol_frame(results)
+        failed = list(failed) + excluded
     elif id_type in ["Ensembl", "EnsemblProtein"]:
-        results, failed = ensg.get_latest_ensembl_id(nodes)
+        with timer.span("Ensembl query", record_requests=True, service="ensembl", ids=len(nodes)):
+            results, failed = await services.get_latest_ensembl_id(nodes)
     elif id_type == "Entrez":
-        results, failed = get_mygene(nodes, 'entrezgene')
-        results.index = results.index.astype(str)
-        results["to"] = results["to"].astype(str)
-        results["from"] = results["from"].astype(str)
-    elif id_type == "DIP":
-        dip_ids = [n for n in nodes if "DIP-" in n]
-        results = pd.DataFrame({"to":dip_ids, "from":dip_ids})
-        failed = [n for n in nodes if "DIP-" not in n]
-    elif id_type == "Refseq":
-        refseq_ids = [n for n in nodes if "_" in n]
-        results = pd.DataFrame({"to":refseq_ids, "from":refseq_ids})
-        failed = [n for n in nodes if "_" not in n]
+        with timer.span("MyGene query", record_requests=True, service="mygene", ids=len(nodes)):
+            results, failed = await services.get_mygene(nodes, 'entrezgene')
+        results = _entrez_frame(results)
+    elif id_type in ["DIP", "Refseq"]:
+        results, failed = _check_format(nodes, id_type)
+
+    updated_node_map = _keep_nodes(results, failed, keep)
+    timer.end("Update Nodes", mapped=len(updated_node_map), failed=len(failed))
+    return updated_node_map, failed
+
+
+class Services:
+    """ The synchronous query modules, as coroutines that finish without suspending.
+
+    update_nodes and convert_node_ids are written once as coroutines over a Services object. With this class
+    they are run to completion by run_sync, without an event loop, and with AsyncServices from the running event
+    loop.
+    """
+    async def perform_uniprot_query(self, ids, from_db, to_db):
+        return uni.perform_uniprot_query(ids=ids, from_db=from_db, to_db=to_db)
+
+    async def perform_hgnc_query(self, ids, from_id, to_id):
+        return hgnc.perform_hgnc_query(ids, from_id, to_id)
+
+    async def query_other_id(self, ids, target_id, errors=None):
+        return hgnc.query_other_id(ids, target_id, errors=errors)
+
+    async def get_latest_ensembl_id(self, ids):
+        return ensg.get_latest_ensembl_id(ids)
+
+    async def get_mygene(self, ids, target_id):
+        return get_mygene(ids, target_id)
+
+    async def query_mygene(self, ids, scopes, fields):
+        return query_mygene(ids, scopes=scopes, fields=fields)
+
+    def uniprot_chunks(self, ids):
+        # perform_uniprot_query splits its ids into concurrent jobs itself
+        return [ids]
+
+    async def gather(self, function, items, workers):
+        return [await function(item) for item in items]
+
+    async def call(self, function, *args):
+        return function(*args)
+
+
+class AsyncServices(Services):
+    """ The asynchronous queries of async_query, sharing one httpx.AsyncClient"""
+    def __init__(self, client):
+        self.client = client
+
+    async def perform_uniprot_query(self, ids, from_db, to_db):
+        return await aq.perform_uniprot_query(self.client, ids, from_db, to_db)
+
+    async def perform_hgnc_query(self, ids, from_id, to_id):
+        return await aq.perform_hgnc_query(self.client, ids, from_id, to_id)
+
+    async def query_other_id(self, ids, target_id, errors=None):
+        return await aq.query_other_id(self.client, ids, target_id, errors=errors)
+
+    async def get_latest_ensembl_id(self, ids):
+        return await aq.get_latest_ensembl_id(self.client, ids)
 
+    async def get_mygene(self, ids, target_id):
+        return await aq.get_mygene(self.client, ids, target_id)
+
+    async def query_mygene(self, ids, scopes, fields):
+        return await aq.query_mygene_terms(self.client, ids, scopes=scopes, fields=fields)
+
+    def uniprot_chunks(self, ids):
+        # each chunk runs its UniProt job and then its fallbacks, independently of the other chunks
+        return aq.batched(ids, uni.CHUNK_SIZE)
+
+    async def gather(self, function, items, workers):
+        return await aq.gather_limited(function, items, workers)
+
+    async def call(self, function, *args):
+        # blocking functions, e.g. a ConversionPlanner, run in a worker thread
+        return await asyncio.get_running_loop().run_in_executor(None, in_context(function), *args)
+
+
+def _uniprot_nodes(nodes):
+    # UniProt accessions and entry names, and the nodes that are neither
+    query_nodes, excluded = [], []
+    for node in nodes:
+        if ("_HUMAN" in node) or (UNIPROT_QUERY.match(node) is not None):
+            query_nodes.append(node)
+        else:
+            excluded.append(node)
+    return query_nodes, excluded
+
+
+def _symbol_nodes(nodes):
+    # nodes that could be gene symbols, and ChEBI ids and UniProt entry names
+    query_nodes, excluded = [], []
+    for node in nodes:
+        if NOT_SYMBOL.search(node) is None:
+            query_nodes.append(node)
+        else:
+            excluded.append(node)
+    return query_nodes, excluded
+
+
+def _symbol_frame(results):
+    results = pd.DataFrame.from_dict(results, orient="index", columns = ["to"])
+    results["from"] = results.index.values
+    return results
+
+
+def _entrez_frame(results):
+    results.index = results.index.astype(str)
+    results["to"] = results["to"].astype(str)
+    results["from"] = results["from"].astype(str)
+    return results
+
+
+def _check_format(nodes, id_type):
+    # DIP and RefSeq ids are kept as they are if they have the expected format
+    marker = "DIP-" if id_type == "DIP" else "_"
+    valid_ids = [n for n in nodes if marker in n]
+    return pd.DataFrame({"to": valid_ids, "from": valid_ids}), [n for n in nodes if marker not in n]
+
+
+def _keep_nodes(results, failed, keep):
     # process the final data
     if keep == "updated":
         results = results.loc[results["from"] != results["to"]]
     elif keep == "all":
         results = pd.concat([results, pd.DataFrame({"from": failed, "to": np.nan})], axis=0)
-    # convert to a dictionary
     if len(results) > 0:
-        results = results.set_index('from')
-        updated_node_map = results["to"].to_dict()
-    else:
-        updated_node_map = {}
-    timer.end("Update Nodes")
-    return updated_node_map, failed
-    
-def convert_node_ids(nodes, initial_id, target_id, timer=None):
+        return MappingTable.from_frame(results)
+    return MappingTable()
+
+
+def convert_node_ids(nodes, initial_id, target_id, timer=None, planner=None):
     """ Converts nodes between two different identifier types
 
     Args:
         nodes (set): Set of nodes to be converted
         initial_id (str): Identifier type of input nodes
         target_id (str): Identifier type to be converted to
+        planner (ConversionPlanner): if given, the conversion route is chosen by the planner's cost model
+            instead of the fixed sequence of services below
         
     Returns:
-        dict: mapping between input nodes and new identifier
-        set: nodes that were not able to be mapped to new identifiers.
+        MappingTable: mapping between input nodes and new identifier
+        set: nodes that were not able to be mapped to new identifiers. Nodes that every service failed to map
+            are recorded in the cache, and are returned here without being queried again until they expire.
     """
+    return run_sync(_convert_node_ids(Services(), nodes, initial_id, target_id, timer, planner))
+
+
+async def async_convert_node_ids(nodes, initial_id, target_id, timer=None, planner=None):
+    """ Asynchronous version of convert_node_ids, sending all requests from the running event loop
+
+    UniProt accessions are converted in chunks of uni.CHUNK_SIZE, up to uni.MAX_CONCURRENT_JOBS at once. The
+    MyGene.info fallbacks for each chunk start as soon as its UniProt job finishes, while other jobs are still
+    being polled. A planner's conversion runs in a worker thread.
+
+    Args:
+        nodes (set): Set of nodes to be converted
+        initial_id (str): Identifier type of input nodes
+        target_id (str): Identifier type to be converted to
+        planner (ConversionPlanner): as for convert_node_ids
+
+    Returns:
+        MappingTable: mapping between input nodes and new identifier
+        list: nodes that were not able to be mapped to new identifiers.
+    """
+    async with aq.new_client() as client:
+        return await _convert_node_ids(AsyncServices(client), nodes, initial_id, target_id, timer, planner)
+
+
+async def _convert_node_ids(services, nodes, initial_id, target_id, timer, planner):
     # TODO can any of these be looped together?
     # TODO for multiple Ids will need to split and do each separately. 
-    mygene_fields = {"Symbol": "symbol", "Entrez": 'entrezgene', "Uniprot": "uniprot", "Ensembl": "ensembl.gene",
-                    "Refseq":"refseq", "EnsemblProtein":"ensembl.protein"}
+    mygene_fields = MYGENE_FIELDS
     if timer is None:
         timer = Timer()
-    timer.start("Convert node IDs")
-    if (initial_id == "Symbol") and (target_id == 'Entrez'):
+    timer.start("Convert node IDs", initial_id=initial_id, target_id=target_id, nodes=len(nodes))
+    known_failed, nodes = cache.lookup_failed("mapper", initial_id, target_id, nodes)
+    # nodes whose HGNC requests failed are not known to be unmappable
+    errors = set()
+    if len(nodes) == 0:
+        converted_node_map, still_missing = {}, []
+    elif planner is not None:
+        with timer.span("Planned conversion", record_requests=True, service="planner", ids=len(nodes)):
+            converted_node_map, still_missing = await services.call(planner.convert, nodes, initial_id, target_id)
+    elif (initial_id == "Symbol") and (target_id == 'Entrez'):
         # we will use mygeneinfo to do the conversion...
-        converted_df, missing = query_mygene(nodes, "symbol", "entrezgene")
-        converted_node_map = converted_df.dropna(subset=["_id"])["_id"].to_dict()
+        with timer.span("MyGene query", record_requests=True, service="mygene", ids=len(nodes)):
+            converted_df, missing = await services.query_mygene(nodes, "symbol", "entrezgene")
+        converted_node_map = (converted_df.dropna(subset=["_id"])["_id"].to_dict()
+                              if "_id" in converted_df.columns else {})
+        still_missing = missing
         if len(missing) > 0:
-            missing_map, still_missing = hgnc.query_other_id(missing, "Entrez")
+            with timer.span("HGNC query", record_requests=True, service="hgnc", ids=len(missing)):
+                missing_map, still_missing = await services.query_other_id(missing, "Entrez", errors=errors)
             converted_node_map = {**converted_node_map, **missing_map}
-        else:
-            still_missing=missing
     elif (initial_id == "Entrez") and (target_id == "Symbol"):
-        converted_df, still_missing = get_mygene(nodes, "symbol")
+        with timer.span("MyGene query", record_requests=True, service="mygene", ids=len(nodes)):
+            converted_df, still_missing = await services.get_mygene(nodes, "symbol")
         converted_df["from"] = converted_df["from"].astype(str)
         converted_df.index = converted_df.index.astype(str)
         converted_node_map = converted_df["to"].to_dict()
-    elif (initial_id == "Uniprot") or (initial_id == "DIP"):
-        if (initial_id == "DIP"):
-            dip_df, missing_dip = uni.perform_uniprot_query(ids = nodes, from_db="DIP", to_db="Uniprot")
-            dip_df['from'] = dip_df['from'].astype(str)
-            dip_df['to'] = dip_df['to'].astype(str)
-            if (target_id == "Uniprot"):
-                return
-            else:
-                nodes = dip_df["to"].unique()
+    elif initial_id == "DIP":
+        with timer.span("UniProt query", record_requests=True, service="uniprot", ids=len(nodes)):
+            dip_df, missing_dip = await services.perform_uniprot_query(nodes, "DIP", "Uniprot")
+        dip_df = dip_df.astype(str)
+        if target_id == "Uniprot":
+            converted_node_map = dip_df.set_index("from")["to"].to_dict()
+            still_missing = missing_dip
+        else:
+            converted_node_map, still_missing = await _convert_uniprot(services, dip_df["to"].unique(), target_id,
+                                                                       timer)
+            converted_node_map, still_missing = _dip_map(dip_df, missing_dip, converted_node_map)
+    elif initial_id == "Uniprot":
+        converted_node_map, still_missing = await _convert_uniprot(services, nodes, target_id, timer)
+    elif initial_id in ["Ensembl", "Refseq", "EnsemblProtein"]:
+        field = mygene_fields[target_id]
+        with timer.span("MyGene query", record_requests=True, service="mygene", ids=len(nodes)):
+            converted_df, still_missing = await services.query_mygene(nodes, mygene_fields[initial_id], field)
+        if field in converted_df.columns:
+            converted_df = converted_df.dropna(subset=[field])
+            converted_node_map = converted_df[field].to_dict()
+        else:
+            converted_node_map = {}
+            still_missing = converted_df.index.tolist()
         
-        converted_df, still_missing = uni.perform_uniprot_query(ids = nodes, from_db="UniProtKB_AC-ID", to_db=target_id)
-        converted_df['from'] = converted_df['from'].astype(str)
-        converted_df.index = converted_df["from"]
-        converted_df['to'] = converted_df['to'].astype(str)
-        converted_node_map = converted_df['to'].to_dict()
+    if planner is None:
+        # the planner's routes do not report failed requests, so only the fixed routes record misses
+        _store_misses(initial_id, target_id, still_missing, converted_node_map, errors)
+    if len(known_failed) > 0:
+        still_missing = list(still_missing) + known_failed
+    timer.end("Convert node IDs", mapped=len(converted_node_map), failed=len(still_missing))
+    return MappingTable.from_dict(converted_node_map), still_missing
+
+
+async def _convert_uniprot(services, nodes, target_id, timer):
+    # convert UniProt accessions, then look up those UniProt cannot convert on MyGene.info, and finally convert
+    # the symbols UniProt gives for the rest
+    field = MYGENE_FIELDS[target_id]
+
+    async def convert_chunk(chunk):
+        with timer.span("UniProt query", record_requests=True, service="uniprot", ids=len(chunk)):
+            converted_df, still_missing = await services.perform_uniprot_query(chunk, "UniProtKB_AC-ID", target_id)
+        converted_node_map = _uniprot_map(converted_df)
         # secondary check for missing ids. 
         if len(still_missing) > 0:
-            secondary, still_missing = query_mygene(still_missing, scopes='uniprot', fields=mygene_fields[target_id])
-            if mygene_fields[target_id] in secondary.columns:  #otherwise none were found
-                
-                secondary = secondary.dropna(subset=[mygene_fields[target_id]])
-                secondary[mygene_fields[target_id]] = secondary[mygene_fields[target_id]].astype(str)
-                # add to the node map
-                converted_node_map = {**converted_node_map, **secondary[mygene_fields[target_id]].to_dict()}
+            with timer.span("MyGene query", record_requests=True, service="mygene", ids=len(still_missing)):
+                secondary, still_missing = await services.query_mygene(still_missing, 'uniprot', field)
+            converted_node_map = {**converted_node_map, **_secondary_map(secondary, field)}
         # third check for missing ids (convert first to symbol via uniprot and then to Entrez
         if len(still_missing) > 0:
-            missing_df, still_missing = uni.perform_uniprot_query(ids = set(still_missing), from_db="UniProtKB_AC-ID", to_db='Symbol')
+            with timer.span("UniProt query", record_requests=True, service="uniprot", ids=len(still_missing)):
+                missing_df, still_missing = await services.perform_uniprot_query(set(still_missing), "UniProtKB_AC-ID",
+                                                                                 'Symbol')
             if len(missing_df) > 0:
-                tertiary, still_missing = query_mygene(missing_df["to"].values, scopes='symbol', fields=mygene_fields[target_id])
-                still_missing = list(missing_df[missing_df["to"].isin(still_missing)]["from"])
-                missing_df.index = missing_df["from"]
-                missing_dict= missing_df["to"].to_dict()
-                if mygene_fields[target_id] in tertiary.columns:
-                    tertiary = tertiary.dropna(subset=[mygene_fields[target_id]])
-                    tertiary["input"] = tertiary.index.values
-                    tertiary = tertiary.drop_duplicates(subset=[mygene_fields[target_id], "input"])
-                    tertiary_dict = {}
-                    for node in missing_dict:
-                        if missing_dict[node] in tertiary.index.values:
-                            tertiary_dict[node] = tertiary.loc[missing_dict[node], mygene_fields[target_id]]
-                    converted_node_map = {**converted_node_map, **tertiary_dict}
-        if (initial_id == "DIP"):
-            uniprot_df = pd.DataFrame.from_dict(converted_node_map, orient="index", columns=["target"])
-            full_df = dip_df.join(uniprot_df, on="to", how="left")
-            full_df.dropna(inplace=True)
-            full_df.index = full_df["from"]
-            converted_node_map = full_df["target"].to_dict()
-            still_missing = missing_dip + list(set(dip_df["from"]).difference(set(full_df["from"])))
-        
-    elif initial_id in ["Ensembl", "Refseq", "EnsemblProtein"]:
-        converted_df, still_missing = query_mygene(nodes, scopes=mygene_fields[initial_id], fields=mygene_fields[target_id])
-        if mygene_fields[target_id] in converted_df.columns:
-            converted_df = converted_df.dropna(subset=[mygene_fields[target_id]])
-            converted_node_map = converted_df[mygene_fields[target_id]].to_dict()
+                with timer.span("MyGene query", record_requests=True, service="mygene", ids=len(missing_df)):
+                    tertiary, still_missing = await services.query_mygene(missing_df["to"].values, 'symbol', field)
+                tertiary_dict, still_missing = _tertiary_map(missing_df, tertiary, still_missing, field)
+                converted_node_map = {**converted_node_map, **tertiary_dict}
+        return converted_node_map, list(still_missing)
+    chunk_results = await services.gather(convert_chunk, services.uniprot_chunks(nodes), uni.MAX_CONCURRENT_JOBS)
+    converted_node_map = {k: v for chunk_map, _ in chunk_results for k, v in chunk_map.items()}
+    return converted_node_map, [node for _, chunk_missing in chunk_results for node in chunk_missing]
+
+
+def _store_misses(initial_id, target_id, still_missing, converted_node_map, errors):
+    # queries with duplicate hits are reported missing but may still be mapped, and an offline backend can be
+    # older than the services, so neither is recorded as a definitive miss
+    if offline_backend():
+        return
+    misses = set(still_missing).difference(converted_node_map.keys()).difference(errors)
+    cache.store_failed("mapper", initial_id, target_id, misses)
+
+
+def offline_backend():
+    """ Whether an HGNC snapshot, UniProt index or NCBI gene files answer queries in place of the services"""
+    return ((hgnc_snapshot.get_snapshot() is not None) or (uniprot_index.get_index() is not None)
+            or (ncbi_genes.get_genes() is not None))
+
+
+def _uniprot_map(converted_df):
+    if len(converted_df) == 0:
+        return {}
+    converted_df['from'] = converted_df['from'].astype(str)
+    converted_df.index = converted_df["from"]
+    converted_df['to'] = converted_df['to'].astype(str)
+    return converted_df['to'].to_dict()
+
+
+def _secondary_map(secondary, field):
+    if field not in secondary.columns:  #otherwise none were found
+        return {}
+    secondary = secondary.dropna(subset=[field])
+    secondary[field] = secondary[field].astype(str)
+    return secondary[field].to_dict()
+
+
+def _tertiary_map(missing_df, tertiary, still_missing, field):
+    # map accessions to the targets of the symbols UniProt gave for them
+    still_missing = list(missing_df[missing_df["to"].isin(still_missing)]["from"])
+    missing_df.index = missing_df["from"]
+    missing_dict= missing_df["to"].to_dict()
+    tertiary_dict = {}
+    if field in tertiary.columns:
+        tertiary = tertiary.dropna(subset=[field])
+        tertiary["input"] = tertiary.index.values
+        tertiary = tertiary.drop_duplicates(subset=[field, "input"])
+        for node in missing_dict:
+            if missing_dict[node] in tertiary.index.values:
+                tertiary_dict[node] = tertiary.loc[missing_dict[node], field]
+    return tertiary_dict, still_missing
+
+
+def _dip_map(dip_df, missing_dip, converted_node_map):
+    # map DIP ids to the targets of their UniProt accessions
+    uniprot_df = pd.DataFrame.from_dict(converted_node_map, orient="index", columns=["target"])
+    full_df = dip_df.join(uniprot_df, on="to", how="left")
+    full_df.dropna(inplace=True)
+    full_df.index = full_df["from"]
+    still_missing = missing_dip + list(set(dip_df["from"]).difference(set(full_df["from"])))
+    return full_df["target"].to_dict(), still_missing
+
+
+def update_mixed_nodes(nodes, keep="present", timer=None):
+    """ Updates a set of nodes with a mix of identifier types, detecting the type of each node.
+
+    Nodes are labelled with classify.classify_ids and each identifier type is updated by update_nodes, with the
+    types handled in parallel as they mostly query different services. Nodes of unknown type and ChEBI ids
+    cannot be updated. UniProt accessions that UniProt does not know but that could be symbols (B3GAT1) are
+    updated as symbols, and gene names as symbols from the start.
+
+    Args:
+        nodes (set): The set of nodes to be updated
+        keep (str): "updated", "present" or "all", as for update_nodes
+
+    Returns:
+        MappingTable: Mapping between input nodes (key) and updated identifiers (values)
+        list: nodes that could not be updated
+    """
+    if timer is None:
+        timer = Timer()
+    groups = classify.split_by_type(nodes)
+    unsupported = [node for id_type in [classify.UNKNOWN, "CHEBI"] for node in groups.pop(id_type, [])]
+    jobs = {id_type: (update_nodes, (set(group), id_type), {"keep": keep, "timer": timer})
+            for id_type, group in groups.items()}
+    if "Uniprot" in jobs:
+        jobs["Uniprot"] = (_retry_as_symbols, (set(groups["Uniprot"]), None), {"keep": keep, "timer": timer})
+    return _run_by_type(jobs, unsupported, keep, timer)
+
+
+def convert_mixed_node_ids(nodes, target_id, timer=None):
+    """ Converts a set of nodes with a mix of identifier types to target_id, detecting the type of each node.
+
+    Each identifier type is converted by convert_node_ids in parallel. Nodes that are already of the target type
+    are updated to their latest version by update_nodes instead. Nodes of a type that cannot be converted to
+    target_id are returned as failed. As in update_mixed_nodes, UniProt accessions that fail and could be
+    symbols are converted as symbols.
+
+    Args:
+        nodes (set): Set of nodes to be converted
+        target_id (str): Identifier type to be converted to
+
+    Returns:
+        MappingTable: mapping between input nodes and new identifier
+        list: nodes that were not able to be mapped to new identifiers
+    """
+    if timer is None:
+        timer = Timer()
+    groups = classify.split_by_type(nodes)
+    jobs, unsupported = {}, []
+    for id_type, group in groups.items():
+        if id_type == target_id:
+            jobs[id_type] = (update_nodes, (set(group), id_type), {"timer": timer})
+        elif (id_type == "Uniprot") and can_convert(id_type, target_id):
+            jobs[id_type] = (_retry_as_symbols, (set(group), target_id), {"timer": timer})
+        elif can_convert(id_type, target_id):
+            jobs[id_type] = (convert_node_ids, (set(group), id_type, target_id), {"timer": timer})
         else:
-            converted_node_map = {}
-            still_missing = converted_df.index.tolist()
-        
-    timer.end("Convert node IDs")
-    return converted_node_map, still_missing
-
-def query_mygene(gene_list, scopes, fields, retries=10):
-    mg = mygene.MyGeneInfo()
-    for retry in range(retries):
-        try:
-            results_df = mg.querymany(qterms=gene_list, scopes=scopes, fields=fields, species='human', 
-                                returnall=True, verbose=False, as_dataframe=True, entrezonly=True)
-            break
-        except Exception as e:
-            if retry < retries - 1:
-                #print("PF", gene_list)
-                print(f"Retrying mg.querymany: {e}")
-            else:
-                print("Max retries reach for mg.querymany")
-                raise e
-    mapped = results_df["out"]
-    dups = results_df["dup"]
-    missing = results_df["missing"]
-    unmapped = []
-    if len(dups) > 0:
-        unmapped += list(results_df["dup"]["query"].values)
-    if len(missing) > 0:
-        unmapped += list(results_df["missing"]["query"].values)
-    return mapped, unmapped
-
-def get_mygene(gene_list, target_id, retries=10):
-    mg = mygene.MyGeneInfo()
-    for retry in range(retries):
-        try:
-            results = mg.getgenes(gene_list, as_dataframe=True, fields=target_id)
-            break
-        except Exception as e:
-            if retry < retries - 1:
-                print(f"Retrying mg.getgenes: {e}")
-            else:
-                print("Max retries reach for mg.getgenes")
-                raise e
-    failed = list(results.loc[results[target_id].isna()].index.values)
-    results = results.dropna(subset=[target_id])
-    results["from"] = results.index.values
-    results = results.loc[:, ("from", target_id)]
-    results.columns = ["from", "to"]
-    
-    return results, failed
+            unsupported += group
+    return _run_by_type(jobs, unsupported, "present", timer)
+
+
+def _retry_as_symbols(nodes, target_id, keep="present", timer=None):
+    # update (target_id None) or convert UniProt accessions, and then the failed ones that could be symbols as
+    # symbols. Failed nodes are only added for keep="all" once both have run.
+    first_keep = "present" if keep == "all" else keep
+    if target_id is None:
+        node_map, failed = update_nodes(nodes, "Uniprot", keep=first_keep, timer=timer)
+    else:
+        node_map, failed = convert_node_ids(nodes, "Uniprot", target_id, timer=timer)
+    retry = set(classify.symbol_shaped(failed))
+    node_maps = [node_map]
+    if (len(retry) > 0) and (target_id in [None, "Symbol"]):
+        symbol_map, symbol_failed = update_nodes(retry, "Symbol", keep=first_keep, timer=timer)
+    elif (len(retry) > 0) and can_convert("Symbol", target_id):
+        symbol_map, symbol_failed = convert_node_ids(retry, "Symbol", target_id, timer=timer)
+    else:
+        symbol_map, symbol_failed, retry = MappingTable(), [], set()
+    node_maps.append(symbol_map)
+    failed = [node for node in failed if node not in retry] + list(symbol_failed)
+    if keep == "all":
+        node_maps.append(MappingTable(failed, [np.nan] * len(failed)))
+    return MappingTable.concat(node_maps), failed
+
+
+def can_convert(initial_id, target_id):
+    """ Whether convert_node_ids has a route from initial_id to target_id"""
+    if initial_id in ["Symbol", "Entrez"]:
+        return {initial_id, target_id} == {"Symbol", "Entrez"}
+    if initial_id in ["Uniprot", "DIP"]:
+        return target_id in ["Entrez", "Ensembl", "Symbol"]
+    return (initial_id in ["Ensembl", "Refseq", "EnsemblProtein"]) and (target_id in MYGENE_FIELDS)
+
 
-    
+def _run_by_type(jobs, unsupported, keep, timer):
+    # run the mapping job for each identifier type concurrently and combine the results
+    node_maps, failed = [], []
+    if len(jobs) > 0:
+        with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+            futures = {id_type: executor.submit(in_context(function), *args, **kwargs)
+                       for id_type, (function, args, kwargs) in jobs.items()}
+        for id_type in jobs:
+            type_map, type_failed = futures[id_type].result()
+            node_maps.append(type_map)
+            failed += list(type_failed)
+    if keep == "all":
+        node_maps.append(MappingTable(unsupported, [np.nan] * len(unsupported)))
+    return MappingTable.concat(node_maps), failed + unsupported
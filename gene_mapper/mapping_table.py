@@ -0,0 +1,156 @@
+from collections.abc import Mapping, ItemsView, ValuesView
+import numpy as np
+import pandas as pd
+
+
+class MappingTable(Mapping):
+    """ Compact, read-only mapping from input identifiers to mapped identifiers, as returned by
+    mapper.update_nodes and mapper.convert_node_ids.
+
+    Input identifiers are held in a pandas Index and mapped identifiers as integer codes into an array of the
+    distinct mapped identifiers, so an identifier that many nodes map to is stored once. Nodes kept without a
+    mapping (keep="all") have code -1 and map to NaN. It can be used wherever a dict of node to identifier was
+    used, and applied to whole arrays with apply.
+
+    Args:
+        keys (iterable): input identifiers. If an identifier is repeated its last value is kept, as in a dict.
+        values (iterable): mapped identifier of each key, NaN or None for no mapping
+    """
+    def __init__(self, keys=(), values=()):
+        index = pd.Index(list(keys), dtype=object)
+        values = np.asarray(list(values) if not isinstance(values, np.ndarray) else values, dtype=object)
+        if len(index) != len(values):
+            raise ValueError(f"{len(index)} keys but {len(values)} values")
+        if index.has_duplicates:
+            unique = ~index.duplicated(keep="last")
+            index, values = index[unique], values[unique]
+        codes, categories = pd.factorize(values)
+        self.index = index
+        self.codes = codes.astype(np.int32)
+        self.categories = np.asarray(categories, dtype=object)
+
+    @classmethod
+    def from_dict(cls, mapping):
+        return cls(mapping.keys(), list(mapping.values()))
+
+    @classmethod
+    def from_frame(cls, df, key="from", value="to"):
+        """ Table mapping the key column of a DataFrame to its value column"""
+        return cls(df[key].values, df[value].values)
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        """ The mapping itself if it is a MappingTable, otherwise a table with the same items"""
+        return mapping if isinstance(mapping, cls) else cls.from_dict(mapping)
+
+    @classmethod
+    def concat(cls, mappings):
+        """ Combine several mappings into one table, later mappings taking precedence for repeated keys"""
+        tables = [cls.from_mapping(mapping) for mapping in mappings]
+        if len(tables) == 0:
+            return cls()
+        return cls(np.concatenate([table.index.values for table in tables]),
+                   np.concatenate([table.values_array() for table in tables]))
+
+    def values_array(self):
+        """ Mapped identifier of each key as an object array, NaN for keys without one"""
+        return np.append(self.categories, np.array([np.nan], dtype=object))[self.codes]
+
+    def __getitem__(self, key):
+        code = self.codes[self.index.get_loc(key)]
+        return self.categories[code] if code >= 0 else np.nan
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def items(self):
+        return _ItemsView(self)
+
+    def values(self):
+        return _ValuesView(self)
+
+    def __repr__(self):
+        return f"MappingTable({len(self)} ids, {len(self.categories)} distinct mapped ids)"
+
+    @property
+    def nbytes(self):
+        """ Approximate memory used by the table, including the identifier strings"""
+        return (self.index.memory_usage(deep=True) + self.codes.nbytes
+                + pd.Index(self.categories, dtype=object).memory_usage(deep=True))
+
+    def astype(self, dtype):
+        """ Table with every mapped identifier converted to dtype, e.g. str. Missing values stay NaN."""
+        return _from_arrays(self.index, self.codes, np.array([dtype(v) for v in self.categories], dtype=object))
+
+    def apply(self, values, default=np.nan, keep_unmapped=False):
+        """ Map an array of identifiers in one vectorized lookup
+
+        Args:
+            values (pd.Series, np.ndarray or list): identifiers to map
+            default: value for identifiers that are not in the table or have no mapping
+            keep_unmapped (bool): keep identifiers that are not in the table as they are instead of using default
+
+        Returns:
+            pd.Series with the index and name of values if values is a Series, otherwise np.ndarray
+        """
+        array = values.values if isinstance(values, pd.Series) else np.asarray(values, dtype=object)
+        positions = self.index.get_indexer(array)
+        codes = np.full(len(array), -1, dtype=np.int32)
+        found = positions >= 0
+        codes[found] = self.codes[positions[found]]
+        mapped = np.append(self.categories, np.array([default], dtype=object))[codes]
+        if keep_unmapped:
+            mapped[~found] = array[~found]
+        if isinstance(values, pd.Series):
+            return pd.Series(mapped, index=values.index, name=values.name, dtype=object)
+        return mapped
+
+    def to_series(self):
+        """ Series of mapped identifiers indexed by input identifier, with categorical values"""
+        return pd.Series(pd.Categorical.from_codes(self.codes, self.categories), index=self.index)
+
+    def to_frame(self):
+        """ DataFrame with columns "from" and "to", with the "to" column categorical"""
+        return pd.DataFrame({"from": self.index.values,
+                             "to": pd.Categorical.from_codes(self.codes, self.categories)})
+
+    def to_arrow(self):
+        """ pyarrow Table with a string "from" column and a dictionary-encoded "to" column
+
+        The codes are handed to Arrow as the dictionary indices without copying them, with unmapped keys (code -1)
+        marked in a validity bitmap, and the identifiers are converted from their object arrays directly.
+        Requires pyarrow.
+        """
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError("MappingTable.to_arrow requires pyarrow, install it with pip install pyarrow")
+        codes = np.ascontiguousarray(self.codes, dtype=np.int32)
+        validity = None
+        if (codes < 0).any():
+            validity = pa.py_buffer(np.packbits(codes >= 0, bitorder="little"))
+        indices = pa.Array.from_buffers(pa.int32(), len(codes), [validity, pa.py_buffer(codes)])
+        to = pa.DictionaryArray.from_arrays(indices, pa.array(self.categories, type=pa.string()))
+        return pa.table({"from": pa.array(self.index.values, type=pa.string()), "to": to})
+
+
+class _ItemsView(ItemsView):
+    def __iter__(self):
+        return zip(self._mapping.index, self._mapping.values_array())
+
+
+class _ValuesView(ValuesView):
+    def __iter__(self):
+        return iter(self._mapping.values_array())
+
+
+def _from_arrays(index, codes, categories):
+    table = MappingTable.__new__(MappingTable)
+    table.index, table.codes, table.categories = index, codes, categories
+    return table
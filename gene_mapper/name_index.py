@@ -0,0 +1,170 @@
+import re
+import math
+import unicodedata
+from gene_mapper import hgnc_records
+
+# Local search of gene names (e.g. "Cyclin dependent kinase 6") for their approved HGNC symbol, over the approved,
+# previous and alias names of an HGNC complete set file.
+
+# kinds of names, in order of preference when several genes match a query equally well
+NAME_KINDS = ["approved", "previous", "alias"]
+# HGNC complete set fields holding the names of each kind
+NAME_FIELDS = {"approved": "name", "previous": "prev_name", "alias": "alias_name"}
+# lowest score, between 0 and 1, of a name that is accepted as a match
+MIN_SCORE = 0.7
+# weight of word bigrams relative to single words, which rewards names with the same word order
+BIGRAM_WEIGHT = 0.5
+# a name is left unmatched if the second best symbol scores within this of the best
+AMBIGUITY_MARGIN = 0.05
+# features appearing in more names than this (e.g. "protein") are not used to find candidate names
+MAX_POSTINGS = 2000
+GREEK_LETTERS = {"α": "alpha", "β": "beta", "γ": "gamma", "δ": "delta", "ε": "epsilon", "κ": "kappa",
+                 "λ": "lambda", "μ": "mu", "ω": "omega"}
+TOKEN = re.compile(r"[a-z0-9]+")
+
+_index = None
+
+
+def normalize(name):
+    """ Lowercase ASCII word tokens of a name, spelling out Greek letters and dropping punctuation"""
+    name = "".join(GREEK_LETTERS.get(c, c) for c in str(name).lower())
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    return TOKEN.findall(name)
+
+
+def features(tokens):
+    """ Word unigrams and bigrams of a tokenized name"""
+    return set(tokens) | {a + " " + b for a, b in zip(tokens, tokens[1:])}
+
+
+def numbered(tokens):
+    """ Tokens containing digits, which tell members of a gene family apart (kinase 6, subunit E1)"""
+    return frozenset(token for token in tokens if any(c.isdigit() for c in token))
+
+
+class NameIndex:
+    """ Inverted index of word unigrams and bigrams over gene names, ranking names by IDF-weighted overlap.
+
+    A query first looks for a name with the same normalized tokens, which is a dictionary lookup. Otherwise the
+    names sharing one of its less common features are scored by the Dice coefficient of their IDF-weighted
+    features, and the best name scoring at least MIN_SCORE gives the symbol. Only names with the same numbered
+    tokens can match, so "cyclin dependent kinase" does not match "cyclin dependent kinase 6". Equal scores are
+    ranked by NAME_KINDS and then alphabetically, so results are reproducible. A name shared by several genes
+    as the same kind of name matches all of them, and is left unmatched by search_gene_names.
+
+    Args:
+        names (iterable): (symbol, name, kind) tuples, with kind one of NAME_KINDS
+    """
+    def __init__(self, names):
+        self.symbols = []
+        self.ranks = []
+        self.features = []
+        self.numbers = []
+        self.exact = {}
+        postings = {}
+        for symbol, name, kind in names:
+            tokens = normalize(name)
+            if len(tokens) == 0:
+                continue
+            rank = NAME_KINDS.index(kind)
+            key = " ".join(tokens)
+            best_rank, symbols = self.exact.get(key, (rank, set()))
+            if rank < best_rank:
+                best_rank, symbols = rank, set()
+            if rank == best_rank:
+                symbols.add(symbol)
+            self.exact[key] = (best_rank, symbols)
+            position = len(self.symbols)
+            self.symbols.append(symbol)
+            self.ranks.append(rank)
+            self.features.append(features(tokens))
+            self.numbers.append(numbered(tokens))
+            for feature in self.features[-1]:
+                postings.setdefault(feature, []).append(position)
+        self.exact = {key: tuple(sorted(symbols)) for key, (_, symbols) in self.exact.items()}
+        self.postings = {feature: tuple(names) for feature, names in postings.items()}
+        self.idf = {feature: math.log(1 + len(self.symbols) / len(names)) * (BIGRAM_WEIGHT if " " in feature else 1)
+                    for feature, names in postings.items()}
+        # features of a query that no name has weigh as much as the rarest ones
+        self.max_idf = max(self.idf.values(), default=1)
+        self.weights = [sum(self.idf[feature] for feature in name_features) for name_features in self.features]
+        print("Indexed", len(self.symbols), "gene names")
+
+    @classmethod
+    def from_records(cls, records):
+        """ Index the approved, previous and alias names of HGNC entries (see hgnc_snapshot.HGNCSnapshot)"""
+        names = []
+        for entry in records:
+            if entry.get("status", "Approved") != "Approved":
+                continue
+            for kind in NAME_KINDS:
+                for name in hgnc_records.split_field(entry.get(NAME_FIELDS[kind])):
+                    names.append((entry["symbol"], name, kind))
+        return cls(names)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def search(self, name, limit=5):
+        """ Best matching symbols for a name
+
+        Returns:
+            list: up to limit (symbol, score) tuples, best first, with scores between MIN_SCORE and 1. Exact
+            matches are returned alone with score 1.
+        """
+        tokens = normalize(name)
+        key = " ".join(tokens)
+        if key in self.exact:
+            return [(symbol, 1.0) for symbol in self.exact[key][:limit]]
+        query = features(tokens)
+        numbers = numbered(tokens)
+        known = sorted((feature for feature in query if feature in self.postings),
+                       key=lambda feature: len(self.postings[feature]))
+        if len(known) == 0:
+            return []
+        selective = [feature for feature in known if len(self.postings[feature]) <= MAX_POSTINGS] or known[:1]
+        candidates = set()
+        for feature in selective:
+            candidates.update(self.postings[feature])
+        query_weight = sum(self.idf.get(feature, self.max_idf * (BIGRAM_WEIGHT if " " in feature else 1))
+                           for feature in query)
+        best = {}
+        for position in candidates:
+            if self.numbers[position] != numbers:
+                continue
+            shared = query & self.features[position]
+            score = 2 * sum(self.idf[feature] for feature in shared) / (query_weight + self.weights[position])
+            symbol = self.symbols[position]
+            ranked = (-score, self.ranks[position], symbol)
+            if (score >= MIN_SCORE) and ((symbol not in best) or (ranked < best[symbol])):
+                best[symbol] = ranked
+        return [(symbol, -score) for score, _, symbol in sorted(best.values())[:limit]]
+
+    def search_gene_names(self, ids):
+        """ Same return values as query_hgnc.search_gene_names: the best symbol of each name that matches, and the
+        names without a match"""
+        name_map = {}
+        for name in ids:
+            matches = self.search(name, limit=2)
+            if (len(matches) == 1) or ((len(matches) == 2) and (matches[0][1] - matches[1][1] > AMBIGUITY_MARGIN)):
+                name_map[name] = matches[0][0]
+        missing = [name for name in ids if name not in name_map]
+        return name_map, missing
+
+
+def set_index(index):
+    """ Set the NameIndex used by query_hgnc.search_gene_names before MyGene.info. None restores MyGene.info."""
+    global _index
+    _index = index
+
+
+def get_index():
+    return _index
+
+
+def load_index(path):
+    """ Index the names in an HGNC complete set file and use them for gene name searches"""
+    set_index(NameIndex.from_records(hgnc_records.read_records(path)))
+    # arguments to load it again, e.g. in sharding worker processes
+    _index.source = ((path,), {})
+    return _index
@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+
+# Gene files from https://ftp.ncbi.nlm.nih.gov/gene/DATA/: GENE_INFO/Mammalia/Homo_sapiens.gene_info.gz (or the
+# all-species gene_info.gz) and gene_history.gz, both tab separated with a header line starting with '#'
+HUMAN_TAX_ID = 9606
+# rows of the files read at a time, since the all-species files are too large to read at once
+READ_CHUNK_SIZE = 1000000
+# successor of a discontinued GeneID that was not replaced
+DISCONTINUED = -1
+# longest chain of merges followed, which also stops cycles in the history
+MAX_CHAIN = 100
+# MyGene.info fields that can be retrieved from the gene files
+INDEXED_FIELDS = ("entrezgene", "symbol")
+
+_genes = None
+
+
+class NCBIGenes:
+    """ Integer-keyed arrays resolving Entrez GeneIDs to their current GeneID and symbol, without MyGene.info.
+
+    Current GeneIDs are held in a sorted int64 array with the code of their symbol in an array of distinct
+    symbols, and discontinued GeneIDs in a sorted int64 array with the current GeneID each was merged into
+    (DISCONTINUED if it was withdrawn). A batch of ids is resolved with one binary search per array.
+
+    Args:
+        genes (pd.DataFrame): current genes with columns GeneID and Symbol
+        history (pd.DataFrame): discontinued genes with columns Discontinued_GeneID and GeneID, where GeneID is
+            missing for genes withdrawn without a replacement
+    """
+    def __init__(self, genes, history=None):
+        genes = genes.drop_duplicates(subset=["GeneID"]).sort_values("GeneID")
+        self.gene_ids = genes["GeneID"].to_numpy(dtype=np.int64)
+        codes, symbols = pd.factorize(genes["Symbol"])
+        self.symbol_codes = codes.astype(np.int32)
+        self.symbols = np.asarray(symbols, dtype=object)
+        # GeneID of each symbol, for the symbols of exactly one current gene
+        self.symbol_index = pd.Index(self.symbols)
+        named = self.symbol_codes >= 0
+        self.symbol_counts = np.bincount(self.symbol_codes[named], minlength=len(self.symbols))
+        self.symbol_gene_ids = np.full(len(self.symbols), DISCONTINUED, dtype=np.int64)
+        self.symbol_gene_ids[self.symbol_codes[named]] = self.gene_ids[named]
+        if history is None:
+            history = pd.DataFrame({"Discontinued_GeneID": [], "GeneID": []})
+        history = history.drop_duplicates(subset=["Discontinued_GeneID"]).sort_values("Discontinued_GeneID")
+        self.old_ids = history["Discontinued_GeneID"].to_numpy(dtype=np.int64)
+        self.new_ids = self._follow(history["GeneID"].fillna(DISCONTINUED).to_numpy(dtype=np.int64))
+        print("Indexed", len(self.gene_ids), "current and", len(self.old_ids), "discontinued GeneIDs")
+
+    def _follow(self, new_ids):
+        # a GeneID can be merged into one that is later discontinued itself, so follow each chain to its end
+        for _ in range(MAX_CHAIN):
+            positions, merged = _search(self.old_ids, new_ids)
+            if not merged.any():
+                break
+            new_ids = new_ids.copy()
+            new_ids[merged] = new_ids[positions[merged]]
+        return new_ids
+
+    @classmethod
+    def from_files(cls, gene_info_path, gene_history_path=None, tax_id=HUMAN_TAX_ID, chunksize=READ_CHUNK_SIZE):
+        """ Build the arrays from a gene_info file and optionally gene_history, keeping the genes of tax_id
+
+        Returns:
+            NCBIGenes: the arrays
+        """
+        genes = _read_rows(gene_info_path, ["#tax_id", "GeneID", "Symbol"], tax_id, chunksize)
+        history = None
+        if gene_history_path is not None:
+            history = _read_rows(gene_history_path, ["#tax_id", "GeneID", "Discontinued_GeneID"], tax_id, chunksize)
+        print("Loaded NCBI gene files", gene_info_path, gene_history_path or "")
+        return cls(genes, history)
+
+    def current_ids(self, ids):
+        """ Current GeneID of each id, as an int64 array with DISCONTINUED for ids that are withdrawn, unknown
+        or not GeneIDs"""
+        numbers = pd.to_numeric(pd.Series(list(ids), dtype=object), errors="coerce")
+        valid = (numbers.notna() & (numbers == numbers.round())).to_numpy()
+        query = np.where(valid, numbers.fillna(DISCONTINUED).to_numpy(), DISCONTINUED).astype(np.int64)
+        current = np.full(len(query), DISCONTINUED, dtype=np.int64)
+        _, is_current = _search(self.gene_ids, query)
+        current[is_current] = query[is_current]
+        positions, merged = _search(self.old_ids, query)
+        merged &= ~is_current
+        current[merged] = self.new_ids[positions[merged]]
+        return current
+
+    def symbol_ids(self, symbols):
+        """ Same return values as query_mygene.query_mygene(symbols, "symbol", "entrezgene"): GeneIDs in columns
+        "_id" and "entrezgene" indexed by symbol, and the symbols that are not the symbol of exactly one gene"""
+        symbols = list(symbols)
+        codes = self.symbol_index.get_indexer(pd.Index(symbols, dtype=object))
+        found = codes >= 0
+        found[found] = self.symbol_counts[codes[found]] == 1
+        ids = self.symbol_gene_ids[codes[found]].astype(str).astype(object)
+        queries = np.asarray(symbols, dtype=object)
+        results = pd.DataFrame({"_id": ids, "entrezgene": ids}, index=queries[found])
+        return results, queries[~found].tolist()
+
+    def get_mygene(self, gene_list, target_id):
+        """ Same return values as query_mygene.get_mygene for target_id "entrezgene" or "symbol" """
+        if target_id not in INDEXED_FIELDS:
+            raise NotImplementedError("Only entrezgene and symbol are indexed from the NCBI gene files")
+        gene_list = list(gene_list)
+        current = self.current_ids(gene_list)
+        if target_id == "entrezgene":
+            found = current != DISCONTINUED
+            to = current[found].astype(str).astype(object)
+        else:
+            positions, found = _search(self.gene_ids, current)
+            to = self.symbols[self.symbol_codes[positions[found]]]
+        ids = np.asarray(gene_list, dtype=object)
+        results = pd.DataFrame({"from": ids[found], "to": to}, index=ids[found])
+        return results, ids[~found].tolist()
+
+
+def _search(keys, query):
+    # position of each query value in the sorted keys, and whether it is there
+    positions = np.minimum(np.searchsorted(keys, query), max(len(keys) - 1, 0))
+    found = (keys[positions] == query) if len(keys) > 0 else np.zeros(len(query), dtype=bool)
+    return positions, found
+
+
+def _read_rows(path, columns, tax_id, chunksize):
+    chunks = []
+    reader = pd.read_csv(path, sep="\t", usecols=columns, dtype=str, chunksize=chunksize, na_values=["-"],
+                         keep_default_na=False)
+    for chunk in reader:
+        chunks.append(chunk.loc[chunk["#tax_id"] == str(tax_id)])
+    rows = pd.concat(chunks, ignore_index=True).drop(columns="#tax_id")
+    for column in rows.columns:
+        if column.endswith("GeneID"):
+            rows[column] = pd.to_numeric(rows[column], errors="coerce")
+    return rows
+
+
+def set_genes(genes):
+    """ Set the NCBIGenes used by query_mygene.get_mygene in place of MyGene.info. None restores the API."""
+    global _genes
+    _genes = genes
+
+
+def get_genes():
+    return _genes
+
+
+def load_genes(gene_info_path, gene_history_path=None, **kwargs):
+    """ Build NCBIGenes from the NCBI gene files and use them for all Entrez updates and Entrez to Symbol
+    conversions"""
+    set_genes(NCBIGenes.from_files(gene_info_path, gene_history_path, **kwargs))
+    # arguments to load them again, e.g. in sharding worker processes
+    _genes.source = ((gene_info_path, gene_history_path), kwargs)
+    return _genes
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+from gene_mapper import mapper
+from gene_mapper import sharding
+from gene_mapper.mapping_table import MappingTable
+
+# edges read from the input file at a time
+CHUNK_SIZE = 1000000
+
+
+def read_edges(path, sep="\t", header=None, chunksize=CHUNK_SIZE):
+    """ Iterate over an edge list file in chunks, reading every column as strings"""
+    return pd.read_csv(path, sep=sep, header=header, dtype=str, chunksize=chunksize, keep_default_na=False)
+
+
+def collect_nodes(path, columns=(0, 1), sep="\t", header=None, chunksize=CHUNK_SIZE):
+    """ Collect the unique node identifiers in the given columns of an edge list file
+
+    Args:
+        path (str): edge list file
+        columns (tuple): names or positions of the node columns
+        sep (str): column separator
+        header (int): row number of the header, or None if the file has no header
+        chunksize (int): edges read at a time
+
+    Returns:
+        set: unique node identifiers across all node columns
+    """
+    nodes = set()
+    for chunk in read_edges(path, sep=sep, header=header, chunksize=chunksize):
+        for column in columns:
+            nodes.update(chunk[column].unique())
+    nodes.discard("")
+    return nodes
+
+
+def remap_edges(in_path, out_path, node_map, columns=(0, 1), sep="\t", header=None, chunksize=CHUNK_SIZE,
+                drop_unmapped=True):
+    """ Rewrite an edge list file chunk by chunk, replacing node identifiers according to node_map
+
+    Each chunk is mapped with a single vectorized index lookup per column rather than per-edge dictionary access.
+
+    Args:
+        in_path (str): edge list file to read
+        out_path (str): file to write the remapped edges to
+        node_map (MappingTable or dict): mapping from current to new node identifiers
+        columns (tuple): names or positions of the node columns
+        sep (str): column separator
+        header (int): row number of the header, or None if the file has no header
+        chunksize (int): edges processed at a time
+        drop_unmapped (bool): drop edges with a node missing from node_map, otherwise keep its original identifier
+
+    Returns:
+        int: number of edges written
+    """
+    node_map = MappingTable.from_mapping(node_map).astype(str)
+    n_written = 0
+    for i, chunk in enumerate(read_edges(in_path, sep=sep, header=header, chunksize=chunksize)):
+        for column in columns:
+            mapped = node_map.apply(chunk[column].values, default=None)
+            if not drop_unmapped:
+                mapped = np.where(pd.isna(mapped), chunk[column].values, mapped)
+            chunk[column] = mapped
+        if drop_unmapped:
+            chunk = chunk.dropna(subset=list(columns))
+        chunk.to_csv(out_path, sep=sep, index=False, header=(header is not None) and (i == 0),
+                     mode="w" if i == 0 else "a")
+        n_written += len(chunk)
+    return n_written
+
+
+def update_edge_file(in_path, out_path, id_type, columns=(0, 1), timer=None, processes=1, **kwargs):
+    """ Update the node identifiers of an edge list file to their latest version using mapper.update_nodes
+
+    Nodes are collected in a first pass and queried once, so memory depends on the number of unique nodes rather
+    than the number of edges. With processes > 1 the nodes are mapped in that many worker processes (see
+    sharding.map_sharded). Other keyword arguments are passed to remap_edges.
+
+    Returns:
+        int: number of edges written
+        list: nodes that could not be updated
+    """
+    read_kwargs = {k: kwargs[k] for k in ["sep", "header", "chunksize"] if k in kwargs}
+    nodes = collect_nodes(in_path, columns=columns, **read_kwargs)
+    print("Collected", len(nodes), "unique nodes")
+    if processes > 1:
+        node_map, failed = sharding.update_nodes_sharded(nodes, id_type, keep="present", processes=processes,
+                                                         timer=timer)
+    else:
+        node_map, failed = mapper.update_nodes(nodes, id_type, keep="present", timer=timer)
+    return remap_edges(in_path, out_path, node_map, columns=columns, **kwargs), failed
+
+
+def convert_edge_file(in_path, out_path, initial_id, target_id, columns=(0, 1), timer=None, planner=None,
+                      processes=1, **kwargs):
+    """ Convert the node identifiers of an edge list file to another identifier type using mapper.convert_node_ids
+
+    With processes > 1 the nodes are mapped in that many worker processes. Other keyword arguments are passed to
+    remap_edges.
+
+    Returns:
+        int: number of edges written
+        list: nodes that could not be converted
+    """
+    read_kwargs = {k: kwargs[k] for k in ["sep", "header", "chunksize"] if k in kwargs}
+    nodes = collect_nodes(in_path, columns=columns, **read_kwargs)
+    print("Collected", len(nodes), "unique nodes")
+    if processes > 1:
+        node_map, still_missing = sharding.convert_node_ids_sharded(nodes, initial_id, target_id, processes=processes,
+                                                                    timer=timer, planner=planner)
+    else:
+        node_map, still_missing = mapper.convert_node_ids(nodes, initial_id, target_id, timer=timer, planner=planner)
+    return remap_edges(in_path, out_path, node_map, columns=columns, **kwargs), still_missing
@@ -0,0 +1,229 @@
+import os
+import json
+from itertools import product
+from functools import partial
+from gene_mapper import cache
+from gene_mapper import query_uniprot as uni
+from gene_mapper import query_hgnc as hgnc
+from gene_mapper.query_mygene import query_mygene, get_mygene
+from gene_mapper.mapper import MYGENE_FIELDS
+from gene_mapper.Timer import Timer, record
+
+# starting estimates of seconds per identifier and fraction of identifiers mapped, before any measurements
+PRIOR_COSTS = {"uniprot": (0.01, 0.9), "mygene": (0.005, 0.8), "hgnc": (0.05, 0.7)}
+# weight given to each new measurement in the moving averages
+SMOOTHING = 0.3
+MAX_HOPS = 3
+# number of paths tried, cheapest first, before giving up on the remaining identifiers
+MAX_PATHS = 3
+COSTS_FILE = "planner_costs.json"
+
+
+# Edges are partial applications of module-level functions, so that a planner can be pickled and sent to the
+# worker processes of gene_mapper.sharding.
+
+def uniprot_edge(from_db, to_db):
+    return partial(_run_uniprot, from_db, to_db)
+
+
+def _run_uniprot(from_db, to_db, ids):
+    results_df, _ = uni.perform_uniprot_query(ids=list(ids), from_db=from_db, to_db=to_db)
+    if len(results_df) == 0:
+        return {}
+    results_df = results_df.drop_duplicates(subset=["from"])
+    return {str(k): str(v) for k, v in zip(results_df["from"], results_df["to"])}
+
+
+def mygene_query_edge(from_type, to_type):
+    return partial(_run_mygene_query, from_type, to_type)
+
+
+def _run_mygene_query(from_type, to_type, ids):
+    results_df, _ = query_mygene(list(ids), scopes=MYGENE_FIELDS[from_type], fields=MYGENE_FIELDS[to_type])
+    column = MYGENE_FIELDS[to_type]
+    if (column not in results_df.columns) and (to_type == "Entrez") and ("_id" in results_df.columns):
+        column = "_id"
+    if column not in results_df.columns:
+        return {}
+    results_df = results_df.dropna(subset=[column])
+    results_df = results_df[~results_df.index.duplicated(keep="first")]
+    return {str(k): _first(v) for k, v in results_df[column].items()}
+
+
+def mygene_entrez_edge(to_type):
+    return partial(_run_mygene_entrez, to_type)
+
+
+def _run_mygene_entrez(to_type, ids):
+    results_df, _ = get_mygene(list(ids), MYGENE_FIELDS[to_type])
+    return {str(k): _first(v) for k, v in zip(results_df["from"], results_df["to"])}
+
+
+def hgnc_edge(to_type):
+    return partial(_run_hgnc, to_type)
+
+
+def _run_hgnc(to_type, ids):
+    target_map, _ = hgnc.query_other_id(list(ids), to_type)
+    return {str(k): str(v) for k, v in target_map.items()}
+
+
+def _first(value):
+    # MyGene returns a list when a gene has several values for a field
+    if isinstance(value, list):
+        value = value[0] if len(value) > 0 else None
+    if isinstance(value, dict):
+        value = value.get("gene", value.get("protein"))
+    return str(value)
+
+
+def default_edges():
+    """ The conversions available from each source, as {(source, from_type, to_type): function}"""
+    edges = {("uniprot", "DIP", "Uniprot"): uniprot_edge("DIP", "Uniprot"),
+             ("hgnc", "Symbol", "Entrez"): hgnc_edge("Entrez")}
+    for to_type in ["Entrez", "Ensembl", "Symbol"]:
+        edges[("uniprot", "Uniprot", to_type)] = uniprot_edge("UniProtKB_AC-ID", to_type)
+        if to_type != "Entrez":
+            edges[("mygene", "Entrez", to_type)] = mygene_entrez_edge(to_type)
+    for from_type, to_type in product(["Symbol", "Uniprot", "Ensembl", "Refseq", "EnsemblProtein"],
+                                      ["Entrez", "Ensembl", "Symbol"]):
+        if from_type != to_type:
+            edges[("mygene", from_type, to_type)] = mygene_query_edge(from_type, to_type)
+    return edges
+
+
+class CostModel:
+    """ Moving averages of the measured latency per identifier and hit rate of each conversion edge.
+
+    Args:
+        path (str): JSON file in which measurements are kept between runs, or None to keep them in memory
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.measurements = {}
+        if (path is not None) and os.path.exists(path):
+            with open(path) as f:
+                self.measurements = json.load(f)
+
+    @staticmethod
+    def key(edge):
+        return ":".join(edge)
+
+    def estimate(self, edge):
+        """ Returns (seconds per identifier, hit rate) for an edge"""
+        latency, hit_rate = PRIOR_COSTS.get(edge[0], (0.01, 0.5))
+        return tuple(self.measurements.get(self.key(edge), (latency, hit_rate)))
+
+    def record(self, edge, n_ids, seconds, n_mapped, n_queried=None):
+        """ Update the estimates for an edge after running it on n_ids identifiers, of which n_queried (by default
+        all) were sent to the service rather than answered by the mapping cache"""
+        n_queried = n_ids if n_queried is None else n_queried
+        if (n_ids == 0) or (n_queried == 0):
+            return
+        latency, hit_rate = self.estimate(edge)
+        latency = (1 - SMOOTHING) * latency + SMOOTHING * seconds / n_queried
+        hit_rate = (1 - SMOOTHING) * hit_rate + SMOOTHING * n_mapped / n_ids
+        self.measurements[self.key(edge)] = (latency, hit_rate)
+
+    def path_cost(self, path):
+        """ Expected seconds spent per identifier successfully mapped along a path of edges"""
+        seconds, reached = 0, 1
+        for edge in path:
+            latency, hit_rate = self.estimate(edge)
+            seconds += reached * latency
+            reached *= max(hit_rate, 1e-6)
+        return seconds / reached
+
+    def save(self):
+        if self.path is not None:
+            # written to a temporary file and moved into place, since sharding workers may save at the same time
+            temporary = f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary, "w") as f:
+                json.dump(self.measurements, f, indent=1)
+            os.replace(temporary, self.path)
+
+
+class ConversionPlanner:
+    """ Chooses and runs the cheapest sequence of conversions between two identifier types.
+
+    Candidate paths through the graph of available (source, from_type, to_type) edges are ranked by the cost
+    model. All identifiers are sent along the cheapest path, and any left unmapped fall back to the next cheapest,
+    with every hop run as one batch.
+
+    Args:
+        edges (dict): {(source, from_type, to_type): function} where function takes a list of identifiers and
+            returns a dict of those it could convert. Defaults to default_edges().
+        costs (CostModel): measured edge costs. Defaults to a model stored in the cache directory, if configured.
+        max_hops (int): maximum number of edges in a path
+        max_paths (int): maximum number of paths tried for each conversion
+    """
+    def __init__(self, edges=None, costs=None, max_hops=MAX_HOPS, max_paths=MAX_PATHS):
+        self.edges = edges if edges is not None else default_edges()
+        self.costs = costs if costs is not None else CostModel(cache.cache_file(COSTS_FILE))
+        self.max_hops = max_hops
+        self.max_paths = max_paths
+
+    def paths(self, initial_id, target_id):
+        """ All paths of at most max_hops edges from initial_id to target_id that visit no type twice"""
+        found = []
+        stack = [(initial_id, [])]
+        while stack:
+            id_type, path = stack.pop()
+            if (id_type == target_id) and (len(path) > 0):
+                found.append(path)
+                continue
+            if len(path) == self.max_hops:
+                continue
+            visited = set([initial_id] + [edge[2] for edge in path])
+            for edge in self.edges:
+                if (edge[1] == id_type) and (edge[2] not in visited):
+                    stack.append((edge[2], path + [edge]))
+        return found
+
+    def plan(self, initial_id, target_id):
+        """ The max_paths cheapest candidate paths, cheapest first"""
+        return sorted(self.paths(initial_id, target_id), key=self.costs.path_cost)[:self.max_paths]
+
+    def run_edge(self, edge, ids):
+        # identifiers answered by the mapping cache cost almost nothing, so the latency is measured per
+        # identifier sent to the service, and not at all if the cache answered every one
+        with Timer().span(" ".join(edge), record_requests=True) as span:
+            mapping = self.edges[edge](ids)
+        counts = dict(span.attributes)
+        # the counts also belong to the span recording the whole conversion
+        record(**counts)
+        n_queried = len(ids) - min(counts.get("cached", 0), len(ids))
+        self.costs.record(edge, len(ids), span.elapsed, len(mapping), n_queried)
+        return mapping
+
+    def run_path(self, path, ids):
+        current = {n: n for n in ids}
+        for edge in path:
+            values = list(dict.fromkeys(current.values()))
+            print("Converting", len(values), "ids via", edge[0], edge[1], "->", edge[2])
+            mapping = self.run_edge(edge, values)
+            current = {n: mapping[v] for n, v in current.items() if v in mapping}
+            if len(current) == 0:
+                break
+        return current
+
+    def convert(self, nodes, initial_id, target_id):
+        """ Convert nodes between identifier types
+
+        Returns:
+            dict: mapping between input nodes and new identifiers
+            list: nodes that could not be mapped by any path
+        """
+        remaining = list(dict.fromkeys(str(n) for n in nodes))
+        converted = {}
+        plan = self.plan(initial_id, target_id)
+        if len(plan) == 0:
+            raise ValueError(f"No conversion path from {initial_id} to {target_id}")
+        for path in plan:
+            if len(remaining) == 0:
+                break
+            mapping = self.run_path(path, remaining)
+            converted.update(mapping)
+            remaining = [n for n in remaining if n not in mapping]
+        self.costs.save()
+        return converted, remaining
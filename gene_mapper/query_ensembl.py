@@ -1,40 +1,116 @@
 import requests, sys
 import pandas as pd
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from gene_mapper import cache
+from gene_mapper import replay
+from gene_mapper import rate_limit
+from gene_mapper import ensembl_history
+from gene_mapper.Timer import record, record_response, in_context
+from gene_mapper.coroutines import run_sync
 
-def get_latest_ensembl_id(ids):
-    server = "https://rest.ensembl.org"
-    ext = "/archive/id"
-    ids = list(ids)
+ENSEMBL_URL = "https://rest.ensembl.org"
+BATCH_SIZE = 100
+MAX_WORKERS = 4
+MAX_RETRIES = 5
+# 429 responses are retried by the rate_limit scheduler
+RETRY_STATUSES = [500, 502, 503, 504]
+
+session = requests.Session()
+adapter = replay.ArchiveAdapter("ensembl", pool_maxsize=MAX_WORKERS * 2)
+session.mount("https://", adapter)
+session.mount("http://", adapter)
+session.hooks["response"].append(record_response)
+
+def post_archive_batch(batch_ids, retries=MAX_RETRIES):
+    """ Post one batch of ids to the archive endpoint, retrying failed requests
+
+    Args:
+        batch_ids (list): Ensembl ids to look up
+        retries (int): number of retries after 5xx responses or connection errors
+
+    Returns:
+        pd.DataFrame: results with columns 'from' and 'to'
+    """
     headers={ "Content-Type" : "application/json", "Accept" : "application/json"}
-    # Initialize an empty list to store the results
-    results_df_list = []
-    # Split the list of IDs into batches of 1000
-    for i in range(0, len(ids), 100):
-        print("Query batch", i, "-", min(i+100, len(ids)))
-        batch_ids = ids[i:min(i+100, len(ids))]
-        # Send the API request with the current batch of IDs with retry logic
-        retries = 5
-        session = requests.Session()
-        session.mount('https://', requests.adapters.HTTPAdapter(max_retries=retries))
-        r = session.post(server+ext, headers=headers, data='{ "id" :' + json.dumps(list(batch_ids)) +'}')
-        #r = requests.post(server+ext, headers=headers, data='{ "id" :' + json.dumps(list(batch_ids)) +'}')
-        if not r.ok:
-            #print(r.request)
-            #print("\n".join(batch_ids))
-            r.raise_for_status()
-            sys.exit()
-        # Process the API response
-        decoded = r.json()
-        decoded_df = pd.DataFrame.from_dict(decoded)
-        decoded_df["to"] = decoded_df.apply(parse_archive_results, axis=1)
-        batch_results_df = decoded_df.loc[:, ("id", "to")]
-        batch_results_df.columns = ["from", "to"]
-        results_df_list.append(batch_results_df)
+    for retry in range(retries + 1):
+        try:
+            r = session.post(ENSEMBL_URL + "/archive/id", headers=headers, data=json.dumps({"id": list(batch_ids)}))
+        except requests.ConnectionError:
+            if retry == retries:
+                raise
+            record(retries=1)
+            time.sleep(2 ** retry)
+            continue
+        if (r.status_code in RETRY_STATUSES) and (retry < retries):
+            wait = rate_limit.retry_after(r, default=2 ** retry)
+            print(f"Ensembl returned {r.status_code}, retrying in {wait}s")
+            record(retries=1)
+            time.sleep(wait)
+            continue
+        r.raise_for_status()
+        break
+    return archive_frame(r.json())
+
+
+def archive_frame(decoded):
+    """ Latest ids from an archive endpoint response, as a DataFrame with columns 'from' and 'to'"""
+    decoded_df = pd.DataFrame.from_dict(decoded)
+    if len(decoded_df) == 0:
+        return pd.DataFrame(columns=["from", "to"])
+    decoded_df["to"] = decoded_df.apply(parse_archive_results, axis=1)
+    batch_results_df = decoded_df.loc[:, ("id", "to")]
+    batch_results_df.columns = ["from", "to"]
+    return batch_results_df
+
+
+class Transport:
+    """ Posts the batches of get_latest_ensembl_id from up to `workers` threads at once (see gene_mapper.coroutines)"""
+    async def post_batches(self, batches, workers):
+        """ Results of post_archive_batch for each batch, in order"""
+        if (workers <= 1) or (len(batches) <= 1):
+            return [post_archive_batch(batch) for batch in batches]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(in_context(post_archive_batch), batches))
+
+
+def get_latest_ensembl_id(ids, batch_size=None, workers=None):
+    """ Find the latest version of Ensembl gene or protein ids using the archive endpoint
+
+    Args:
+        ids (iterable): Ensembl ids to update
+        batch_size (int): number of ids per request, BATCH_SIZE if None
+        workers (int): maximum number of concurrent requests, MAX_WORKERS if None. All requests share the
+            "ensembl" limits of the rate_limit scheduler.
+
+    Returns:
+        pd.DataFrame: results with columns 'from' and 'to'
+        list: ids that were not found
+    """
+    return run_sync(_get_latest_ensembl_id(Transport(), ids, batch_size, workers))
+
+
+async def _get_latest_ensembl_id(transport, ids, batch_size, workers):
+    history = ensembl_history.get_history()
+    if history is not None:
+        return history.get_latest_ensembl_id(ids)
+    batch_size = BATCH_SIZE if batch_size is None else batch_size
+    workers = MAX_WORKERS if workers is None else workers
+    cached_map, ids = cache.lookup("ensembl", "Ensembl", "Ensembl", ids)
+    cached_df = pd.DataFrame({"from": list(cached_map.keys()), "to": list(cached_map.values())})
+    # sorted so the same ids always make the same batches, which lets recorded requests be replayed
+    ids = sorted(ids)
+    batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+    print("Querying", len(ids), "Ensembl ids in", len(batches), "batches")
+    results_df_list = await transport.post_batches(batches, workers)
     # Concatenate all the results into a single DataFrame
-    results_df = pd.concat(results_df_list)
+    results_df = pd.concat([cached_df] + results_df_list)
+    if len(results_df_list) > 0:
+        cache.store("ensembl", "Ensembl", "Ensembl", pd.concat(results_df_list).set_index("from")["to"].to_dict())
     # Find the IDs that were missing from the API response
-    missing = [node for node in ids if node not in results_df['from'].values]
+    found = set(results_df['from'])
+    missing = [node for node in ids if node not in found]
     return results_df, missing
 
 
@@ -1,144 +1,257 @@
 import pandas as pd
 import httplib2 as http
 import json
-import mygene
+from gene_mapper import cache
+from gene_mapper import replay
+from gene_mapper.query_mygene import query_mygene
+from gene_mapper import hgnc_snapshot
+from gene_mapper import name_index
+from gene_mapper.Timer import record, in_context
+from gene_mapper.coroutines import run_sync
 
 from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import os
 http.RETIRES=10
 
-def query_mygene(gene_list, scopes, fields, retries=10):
-    mg = mygene.MyGeneInfo()
-    for retry in range(retries):
-        try:
-            results_df = mg.querymany(qterms=gene_list, scopes=scopes, fields=fields, species='human', 
-                                returnall=True, verbose=False, as_dataframe=True, entrezonly=True)
-            break
-        except Exception as e:
-            if retry < retries - 1:
-                #print("QH", gene_list)
-                print(f"Retrying mg.querymany: {e}")
-            else:
-                print("Max retries reach for mg.querymany")
-                raise e
-    mapped = results_df["out"]
-    dups = results_df["dup"]
-    missing = results_df["missing"]
-    unmapped = []
-    if len(dups) > 0:
-        unmapped += list(results_df["dup"]["query"].values)
-    if len(missing) > 0:
-        unmapped += list(results_df["missing"]["query"].values)
-    return mapped, unmapped
+HGNC_URL = 'https://rest.genenames.org'
+# HGNC asks clients to stay below 10 requests per second
+MAX_WORKERS = 8
 
+APPROVED_CACHE_FILE = "hgnc_approved_symbols.json"
+# seconds before the approved symbol list is revalidated with the server
+APPROVED_MAX_AGE = 3600
+
+_local = threading.local()
+_approved = None
 
 def search_approved_symbols(ids):
+    snapshot = hgnc_snapshot.get_snapshot()
+    if snapshot is not None:
+        approved_map, missing = snapshot.search_approved_symbols(ids)
+        return approved_map, missing, snapshot.approved
+    print("Checking approved symbols")
+    approved = get_approved_symbols()
+    approved_map = {sym: sym for sym in ids if sym in approved}
+    missing = set(ids).difference(approved_map.keys())
+    return approved_map, missing, approved
+
+
+def get_approved_symbols(max_age=APPROVED_MAX_AGE):
+    """ Get the set of approved HGNC symbols, downloading it only when it has changed
+
+    The set is kept in memory and, if a cache directory is configured, on disk. Copies older than max_age
+    seconds are revalidated with If-None-Match/If-Modified-Since so an unchanged list is not downloaded again.
+
+    Args:
+        max_age (float): seconds for which a copy is used without revalidation
+
+    Returns:
+        frozenset: approved symbols
+    """
+    global _approved
+    approved_file = cache.cache_file(APPROVED_CACHE_FILE)
+    if (_approved is None) and (approved_file is not None) and os.path.exists(approved_file):
+        with open(approved_file) as f:
+            stored = json.load(f)
+        _approved = {**stored, "symbols": frozenset(stored["symbols"])}
+    if (_approved is not None) and (time.time() - _approved["checked"] < max_age):
+        return _approved["symbols"]
     headers = {'Accept': 'application/json'}
-    uri = 'https://rest.genenames.org'
+    if _approved is not None:
+        if _approved.get("etag"):
+            headers["If-None-Match"] = _approved["etag"]
+        if _approved.get("last_modified"):
+            headers["If-Modified-Since"] = _approved["last_modified"]
     path = '/search/symbol/*+AND+status:Approved'
-    target = urlparse(uri+path)
-    method = 'GET'
-    body = ''
-    h = http.Http()
-    print("Checking approved symbols")
-    response, content = h.request(target.geturl(), method, body, headers)
-    if response['status'] == '200':
+    target = urlparse(HGNC_URL+path)
+    response, content = get_connection().request(target.geturl(), 'GET', '', headers)
+    record(requests=1, bytes=len(content))
+    if response['status'] == '304':
+        _approved["checked"] = time.time()
+    elif response['status'] == '200':
         print("Response received")
-# assume that content is a json reply
-# parse content with the json module 
         data = json.loads(content)
-        approved_df = pd.DataFrame.from_dict(data['response']['docs'])
-        approved_ids = approved_df.loc[approved_df.symbol.isin(ids), "symbol"]
-        approved_map = {sym:sym for sym in approved_ids}
-        missing = set(ids).difference(set(approved_ids))
+        _approved = {"symbols": frozenset(doc['symbol'] for doc in data['response']['docs']),
+                     "etag": response.get('etag'), "last_modified": response.get('last-modified'),
+                     "checked": time.time()}
+    elif _approved is not None:
+        print('Error detected: ' + response['status'], "using previously downloaded approved symbols")
+        return _approved["symbols"]
     else:
-        print('Error detected: ' + response['status'])
-    return approved_map, missing, approved_df
+        raise ValueError('Error detected: ' + response['status'])
+    if approved_file is not None:
+        with open(approved_file, "w") as f:
+            json.dump({**_approved, "symbols": sorted(_approved["symbols"])}, f)
+    return _approved["symbols"]
+
+
+def approved_set(approved):
+    # accept the approved symbol DataFrame used by earlier versions as well as a set
+    if isinstance(approved, pd.DataFrame):
+        return frozenset(approved["symbol"]) if "symbol" in approved.columns else frozenset()
+    return approved
+
+
+def get_connection():
+    # httplib2.Http is not thread safe, so each worker thread keeps its own keep-alive connection
+    if not hasattr(_local, "http"):
+        _local.http = replay.ArchiveHttp("hgnc", timeout=60)
+    return _local.http
+
 
+def fetch_docs(path):
+    """ Request a single HGNC REST path, reusing the calling thread's connection
 
-def query_previous_symbols(ids, approved_df=pd.DataFrame()):
+    Returns:
+        list: the 'docs' of the response, or None if the request failed
+    """
     headers = {'Accept': 'application/json'}
-    uri = 'https://rest.genenames.org'
-    previous_map = {}
+    target = urlparse(HGNC_URL + path)
+    response, content = get_connection().request(target.geturl(), 'GET', '', headers)
+    record(requests=1, bytes=len(content))
+    if response['status'] == '200':
+        data = json.loads(content)
+        return data['response']['docs']
+    print('Error detected: ' + response['status'], path)
+    return None
+
+
+def fetch_symbol_docs(ids, endpoint, workers=None):
+    """ Query an HGNC endpoint once per symbol, running up to `workers` requests concurrently
+
+    Args:
+        ids (iterable): symbols to query
+        endpoint (str): REST path prefix, e.g. '/search/prev_symbol/'
+        workers (int): maximum number of concurrent requests, MAX_WORKERS if None. 1 runs sequentially.
+
+    Returns:
+        list: (symbol, docs) tuples in input order, where docs is None for failed requests
+    """
+    ids = list(ids)
+    workers = MAX_WORKERS if workers is None else workers
+    paths = [endpoint + symbol for symbol in ids]
+    if (workers <= 1) or (len(ids) <= 1):
+        return list(zip(ids, map(fetch_docs, paths)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(zip(ids, executor.map(in_context(fetch_docs), paths)))
+
+
+def failed_requests(results, errors):
+    # symbols whose request failed are added to errors, so that they are not recorded as unmappable
+    if errors is not None:
+        errors.update(symbol for symbol, docs in results if docs is None)
+    return results
+
+
+class Transport:
+    """ The blocking requests of the HGNC queries below, which are coroutines over a transport so that
+    async_query can run the same queries with requests sent from an event loop (see gene_mapper.coroutines)"""
+    async def fetch_symbol_docs(self, ids, endpoint, workers=None):
+        return fetch_symbol_docs(ids, endpoint, workers=workers)
+
+    async def search_approved_symbols(self, ids):
+        return search_approved_symbols(ids)
+
+    async def search_gene_names(self, ids, approved):
+        return search_gene_names(ids, approved)
+
+    async def query_mygene(self, ids, scopes, fields):
+        return query_mygene(ids, scopes=scopes, fields=fields)
+
+
+def query_previous_symbols(ids, approved=frozenset(), workers=None, errors=None):
+    return run_sync(_query_previous_symbols(Transport(), ids, approved, workers, errors))
+
+
+async def _query_previous_symbols(transport, ids, approved, workers, errors):
+    snapshot = hgnc_snapshot.get_snapshot()
+    if snapshot is not None:
+        return snapshot.query_previous_symbols(ids)
     print("Checking previous symbols")
-    #print("Number of ids to check", len(ids))
-    #print(ids)
-    #raise TimeoutError
-    for i, symbol in enumerate(ids):
-        #print(i, "Previous")
-        path = '/search/prev_symbol/' + symbol
-        target = urlparse(uri+path)
-        method = 'GET'
-        body = ''
-        h = http.Http()
-        response, content = h.request(target.geturl(), method, body, headers)
-        if response['status'] == '200':
-# assume that content is a json reply
-# parse content with the json module 
-            data = json.loads(content)
-            for entry in data['response']['docs']:
-                if entry['symbol'] in approved_df.symbol.values:
-                    previous_map[symbol] = entry['symbol']
-        else:
-            print('Error detected: ' + response['status'], symbol)
-    missing = set(ids).difference(set(previous_map.keys()))
-    return previous_map, missing
-
-
-def query_alias_symbols(ids, approved_df=pd.DataFrame()):
-    headers = {'Accept': 'application/json'}
-    uri = 'https://rest.genenames.org'
-    alias_map = {}
+    return await _query_approved_docs(transport, ids, '/search/prev_symbol/', approved, workers, errors)
+
+
+def query_alias_symbols(ids, approved=frozenset(), workers=None, errors=None):
+    return run_sync(_query_alias_symbols(Transport(), ids, approved, workers, errors))
+
+
+async def _query_alias_symbols(transport, ids, approved, workers, errors):
+    snapshot = hgnc_snapshot.get_snapshot()
+    if snapshot is not None:
+        return snapshot.query_alias_symbols(ids)
     print("Searching aliases")
-    for symbol in ids:
-        path = '/search/alias_symbol/' + symbol
-        target = urlparse(uri+path)
-        method = 'GET'
-        body = ''
-        h = http.Http()
-        response, content = h.request(target.geturl(), method, body, headers)
-        if response['status'] == '200':
-# assume that content is a json reply
-# parse content with the json module 
-            data = json.loads(content)
-            for entry in data['response']['docs']:
-                if entry['symbol'] in approved_df.symbol.values:
-                    alias_map[symbol] = entry['symbol']
-        else:
-            print('Error detected: ' + response['status'], symbol)
-    missing = set(ids).difference(set(alias_map.keys()))
-    return alias_map, missing
-
-
-def query_other_id(ids, target_id):
-    headers = {'Accept': 'application/json'}
-    uri = 'https://rest.genenames.org'
-    if target_id == "Entrez":
-        field = 'entrez_id'
-    target_map = {}
+    return await _query_approved_docs(transport, ids, '/search/alias_symbol/', approved, workers, errors)
+
+
+async def _query_approved_docs(transport, ids, endpoint, approved, workers, errors):
+    # approved symbols found by searching an endpoint for each id
+    approved = approved_set(approved)
+    symbol_map = {}
+    results = await transport.fetch_symbol_docs(ids, endpoint, workers=workers)
+    for symbol, docs in failed_requests(results, errors):
+        for entry in docs or []:
+            if entry['symbol'] in approved:
+                symbol_map[symbol] = entry['symbol']
+    missing = set(ids).difference(symbol_map.keys())
+    return symbol_map, missing
+
+
+def query_other_id(ids, target_id, workers=None, errors=None):
+    return run_sync(_query_other_id(Transport(), ids, target_id, workers, errors))
+
+
+async def _query_other_id(transport, ids, target_id, workers, errors):
+    snapshot = hgnc_snapshot.get_snapshot()
+    if snapshot is not None:
+        return snapshot.query_other_id(ids, target_id)
+    field = {"Entrez": 'entrez_id'}[target_id]
+    target_map, ids = cache.lookup("hgnc", "Symbol", target_id, ids)
     print("Searching", target_id)
-    for symbol in ids:
-        path = '/fetch/symbol/' + symbol
-        target = urlparse(uri+path)
-        method = 'GET'
-        body = ''
-        h = http.Http()
-        response, content = h.request(target.geturl(), method, body, headers)
-        if response['status'] == '200':
-# assume that content is a json reply
-# parse content with the json module 
-            data = json.loads(content)
-            for entry in data['response']['docs']:
-                if entry['status'] == "Approved":
-                    if field in entry.keys():
-                        target_map[symbol] = entry[field]
-        else:
-            print('Error detected: ' + response['status'], symbol)
-    missing = set(ids).difference(set(target_map.keys()))
+    results = await transport.fetch_symbol_docs(ids, '/fetch/symbol/', workers=workers)
+    for symbol, docs in failed_requests(results, errors):
+        for entry in docs or []:
+            if (entry['status'] == "Approved") and (field in entry.keys()):
+                target_map[symbol] = entry[field]
+    ids = set(ids)
+    cache.store("hgnc", "Symbol", target_id, {k: v for k, v in target_map.items() if k in ids})
+    missing = ids.difference(target_map.keys())
     return target_map, missing
 
 
-def search_gene_names(ids, approved_df=pd.DataFrame()):
-    name_df, _ = query_mygene(ids, scopes="name,other_names", fields='symbol')
+def search_gene_names(ids, approved=frozenset()):
+    """ Approved symbols of full gene names, from the local name index if there is one and otherwise MyGene.info
+
+    Names are searched in name_index.get_index(), or the names of the HGNC snapshot. MyGene.info is only asked
+    for the names they do not match, and not at all when working offline from a snapshot.
+    """
+    return run_sync(_search_gene_names(Transport(), ids, approved))
+
+
+async def _search_gene_names(transport, ids, approved):
+    name_map, missing = local_gene_names(ids)
+    if (len(missing) == 0) or (hgnc_snapshot.get_snapshot() is not None):
+        return name_map, missing
+    name_df, _ = await transport.query_mygene(missing, scopes="name,other_names", fields='symbol')
+    mygene_map, missing = best_names(name_df, missing)
+    return {**name_map, **mygene_map}, missing
+
+
+def local_gene_names(ids):
+    """ Symbols of the gene names matched by the local name index, and the names it does not match"""
+    index = name_index.get_index()
+    snapshot = hgnc_snapshot.get_snapshot()
+    if (index is None) and (snapshot is not None):
+        index = snapshot.name_index
+    if index is None:
+        return {}, list(ids)
+    return index.search_gene_names(ids)
+
+
+def best_names(name_df, ids):
+    """ The highest scoring symbol MyGene.info found for each gene name, and the names without a symbol"""
     if 'symbol' in name_df.columns:
         name_df = name_df.dropna(subset=['symbol'])
         name_df = name_df.sort_values(by='_score', ascending=False)
@@ -150,24 +263,33 @@ def search_gene_names(ids, approved_df=pd.DataFrame()):
         missing = ids
     return name_map, missing
 
-def perform_hgnc_query(ids, from_id, to_id):
-    if (from_id == "Symbol") and (to_id == "Symbol"):
-        print("Initial Ids", len(ids))
-        approved_map, missing, approved_df = search_approved_symbols(ids)
-        print("Check names", len(missing))
-        name_map, missing = search_gene_names(missing, approved_df)        
-        print("Previous Ids", len(missing))
-        previous_map, missing = query_previous_symbols(missing, approved_df)
-        print("Alias Ids", len(missing))
-        alias_map, missing = query_alias_symbols(missing, approved_df)
-        id_map = {**approved_map, **alias_map, **previous_map, **name_map}
-        return id_map, missing
-    else:
-        # use my gene info to retrieve Entrez ids
-        
-        # then any missing query HGNC on a case by case basis
-        
-        raise(NotImplementedError, "Only symbol updating supported")
+
+def perform_hgnc_query(ids, from_id, to_id, workers=None):
+    return run_sync(_perform_hgnc_query(Transport(), ids, from_id, to_id, workers))
+
+
+async def _perform_hgnc_query(transport, ids, from_id, to_id, workers):
+    if (from_id != "Symbol") or (to_id != "Symbol"):
+        raise NotImplementedError("Only symbol updating supported")
+    cached_map, ids = cache.lookup("hgnc", from_id, to_id, ids)
+    known_failed, ids = cache.lookup_failed("hgnc", from_id, to_id, ids)
+    if len(ids) == 0:
+        return cached_map, set(known_failed)
+    print("Initial Ids", len(ids))
+    approved_map, missing, approved = await transport.search_approved_symbols(ids)
+    print("Check names", len(missing))
+    name_map, missing = await transport.search_gene_names(missing, approved)
+    print("Previous Ids", len(missing))
+    errors = set()
+    previous_map, missing = await _query_previous_symbols(transport, missing, approved, workers, errors)
+    print("Alias Ids", len(missing))
+    alias_map, missing = await _query_alias_symbols(transport, missing, approved, workers, errors)
+    id_map = {**approved_map, **alias_map, **previous_map, **name_map}
+    cache.store("hgnc", from_id, to_id, id_map)
+    # misses of an offline snapshot are not definitive, since the live service may know them
+    if hgnc_snapshot.get_snapshot() is None:
+        cache.store_failed("hgnc", from_id, to_id, set(missing).difference(errors))
+    return {**cached_map, **id_map}, set(missing).union(known_failed)
 
 
 if False:
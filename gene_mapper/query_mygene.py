@@ -0,0 +1,191 @@
+import time
+import random
+import httpx
+import mygene
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from gene_mapper import cache
+from gene_mapper import replay
+from gene_mapper import ncbi_genes
+from gene_mapper.Timer import record, in_context
+from gene_mapper.coroutines import run_sync
+
+# MyGene.info accepts up to 1000 terms per POST request
+BATCH_SIZE = 1000
+MAX_WORKERS = 4
+MAX_RETRIES = 10
+# retry delays grow exponentially from BACKOFF_BASE seconds up to BACKOFF_MAX, with random jitter
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+# seconds to wait for a response (and to connect) before the request fails and is retried
+TIMEOUT = httpx.Timeout(60, connect=10)
+
+
+def new_client(url=None):
+    """ A MyGeneInfo client whose requests can be recorded and replayed, optionally for another server url
+
+    The client's requests are sent through an httpx client of our own, which biothings_client uses from version
+    0.4 (see requirements_dev.txt). Older versions send requests with the requests package, which would bypass
+    the HTTP archive and the rate limits, so they are refused.
+    """
+    mg = mygene.MyGeneInfo()
+    if not hasattr(mg, "http_client_setup"):
+        raise ImportError("gene_mapper requires biothings_client>=0.4, install it with "
+                          "pip install 'biothings_client>=0.4'")
+    if url is not None:
+        mg.url = url
+    mg.http_client = httpx.Client(transport=replay.ArchiveTransport(service="mygene"), timeout=TIMEOUT)
+    mg.http_client_setup = True
+    # requests are paced by the rate_limit scheduler rather than a fixed sleep after every batch
+    mg.delay = 0
+    return mg
+
+
+# a single client shares its pooled HTTP connections between all queries
+client = new_client()
+
+
+def backoff(retry):
+    """ Seconds to wait before the given retry: exponential in the retry number with full jitter"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** retry))
+
+
+def with_retries(method, *args, retries=MAX_RETRIES, **kwargs):
+    """ Call a MyGeneInfo method, retrying failed requests with jittered exponential backoff"""
+    for retry in range(retries):
+        try:
+            record(requests=1)
+            return method(*args, **kwargs)
+        except Exception as e:
+            if retry < retries - 1:
+                record(retries=1)
+                wait = backoff(retry)
+                print(f"Retrying mg.{method.__name__} in {wait:.1f}s: {e}")
+                time.sleep(wait)
+            else:
+                print(f"Max retries reach for mg.{method.__name__}")
+                raise e
+
+
+def run_batches(function, gene_list, batch_size=None, workers=None):
+    """ Apply function to batches of gene_list, running up to `workers` batches at once
+
+    batch_size and workers default to BATCH_SIZE and MAX_WORKERS.
+
+    Returns:
+        list: results for each batch, in sorted order of the genes
+    """
+    # sorted so the same genes always make the same batches, which lets recorded requests be replayed
+    gene_list = sorted(gene_list, key=str)
+    batch_size = BATCH_SIZE if batch_size is None else batch_size
+    workers = MAX_WORKERS if workers is None else workers
+    batches = [gene_list[i:i + batch_size] for i in range(0, len(gene_list), batch_size)]
+    if (workers <= 1) or (len(batches) <= 1):
+        return [function(batch) for batch in batches]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(in_context(function), batches))
+
+
+class Transport:
+    """ Sends the batches of query_mygene and get_mygene through the MyGeneInfo client, from up to `workers`
+    threads at once"""
+    async def query_batches(self, gene_list, scopes, fields, retries, batch_size, workers):
+        """ querymany results of all batches, with the terms with duplicate hits and no hits"""
+        def query_batch(batch):
+            return with_retries(client.querymany, qterms=batch, scopes=scopes, fields=fields, species='human',
+                                returnall=True, verbose=False, as_dataframe=True, entrezonly=True, retries=retries)
+        batch_results = run_batches(query_batch, gene_list, batch_size=batch_size, workers=workers)
+        mapped = pd.concat([results_df["out"] for results_df in batch_results])
+        dups = [results_df["dup"] for results_df in batch_results if len(results_df["dup"]) > 0]
+        missing = [results_df["missing"] for results_df in batch_results if len(results_df["missing"]) > 0]
+        dup_queries = list(pd.concat(dups)["query"].values) if len(dups) > 0 else []
+        no_hits = list(pd.concat(missing)["query"].values) if len(missing) > 0 else []
+        return mapped, dup_queries, no_hits
+
+    async def get_batches(self, gene_list, target_id, retries, batch_size, workers):
+        """ getgenes results of all batches"""
+        def get_batch(batch):
+            return with_retries(client.getgenes, batch, as_dataframe=True, fields=target_id, retries=retries)
+        return pd.concat(run_batches(get_batch, gene_list, batch_size=batch_size, workers=workers))
+
+
+def query_mygene(gene_list, scopes, fields, retries=MAX_RETRIES, batch_size=None, workers=None):
+    """ Search MyGene.info for human genes matching each query term. Symbols searched for their Entrez ids are
+    looked up in the NCBI gene files instead if ncbi_genes.NCBIGenes are set.
+
+    Args:
+        gene_list (iterable): query terms
+        scopes (str): fields to search, e.g. "symbol" or "uniprot"
+        fields (str): fields to return
+        retries (int): attempts per batch before giving up
+        batch_size (int): query terms per request, BATCH_SIZE if None
+        workers (int): maximum number of concurrent requests, MAX_WORKERS if None
+
+    Returns:
+        pd.DataFrame: results indexed by query term. A term can have several rows.
+        list: query terms with duplicate hits or no hits
+    """
+    return run_sync(_query_mygene(Transport(), gene_list, scopes, fields, retries, batch_size, workers))
+
+
+async def _query_mygene(transport, gene_list, scopes, fields, retries, batch_size, workers):
+    genes = ncbi_genes.get_genes()
+    if (genes is not None) and (scopes == "symbol") and (fields == "entrezgene"):
+        return genes.symbol_ids(gene_list)
+    cached_rows, gene_list = cache.lookup("mygene", scopes, fields, gene_list)
+    cached_df, cached_dups = cache.rows_to_frame(cached_rows)
+    if len(gene_list) == 0:
+        return cached_df, cached_dups
+    mapped, dup_queries, no_hits = await transport.query_batches(gene_list, scopes, fields, retries, batch_size,
+                                                                 workers)
+    cache.store("mygene", scopes, fields, cache.frame_to_rows(mapped, exclude=no_hits))
+    if len(cached_df) > 0:
+        mapped = pd.concat([cached_df, mapped])
+    return mapped, cached_dups + dup_queries + no_hits
+
+
+def select_field(results, target_id):
+    """ Split getgenes results into ids with a value for target_id, as columns 'from' and 'to', and ids without"""
+    if target_id not in results.columns:
+        results[target_id] = None
+    failed = list(results.loc[results[target_id].isna()].index.values)
+    results = results.dropna(subset=[target_id])
+    results["from"] = results.index.values
+    results = results.loc[:, ("from", target_id)]
+    results.columns = ["from", "to"]
+    return results, failed
+
+
+def get_mygene(gene_list, target_id, retries=MAX_RETRIES, batch_size=None, workers=None):
+    """ Retrieve a field for each Entrez gene id from MyGene.info, or from the NCBI gene files if
+    ncbi_genes.NCBIGenes are set
+
+    Args:
+        gene_list (iterable): Entrez gene ids
+        target_id (str): field to retrieve, e.g. "symbol" or "entrezgene"
+        retries (int): attempts per batch before giving up
+        batch_size (int): ids per request, BATCH_SIZE if None
+        workers (int): maximum number of concurrent requests, MAX_WORKERS if None
+
+    Returns:
+        pd.DataFrame: results with columns 'from' and 'to', indexed by id
+        list: ids without a value for target_id
+    """
+    return run_sync(_get_mygene(Transport(), gene_list, target_id, retries, batch_size, workers))
+
+
+async def _get_mygene(transport, gene_list, target_id, retries, batch_size, workers):
+    genes = ncbi_genes.get_genes()
+    if (genes is not None) and (target_id in ncbi_genes.INDEXED_FIELDS):
+        return genes.get_mygene(gene_list, target_id)
+    cached_map, gene_list = cache.lookup("mygene", "entrezgene", target_id, gene_list)
+    cached_df = pd.DataFrame({"from": list(cached_map.keys()), "to": list(cached_map.values())},
+                             index=list(cached_map.keys()))
+    if len(gene_list) == 0:
+        return cached_df, []
+    results = await transport.get_batches(gene_list, target_id, retries, batch_size, workers)
+    results, failed = select_field(results, target_id)
+    cache.store("mygene", "entrezgene", target_id, results["to"].to_dict())
+    if len(cached_df) > 0:
+        results = pd.concat([cached_df, results])
+    return results, failed
@@ -2,21 +2,43 @@ import re
 import time
 import json
 import zlib
+from concurrent.futures import ThreadPoolExecutor
 from xml.etree import ElementTree
 from urllib.parse import urlparse, parse_qs, urlencode
 import requests
-from requests.adapters import HTTPAdapter, Retry
+from requests.adapters import Retry
 import pandas as pd
+from gene_mapper import cache
+from gene_mapper import replay
+from gene_mapper import uniprot_index
+from gene_mapper.Timer import record_response, in_context
+from gene_mapper.coroutines import run_sync
 
 # adapted from https://www.uniprot.org/help/id_mapping on October 14, 2022
 
+# polling starts at MIN_POLLING_INTERVAL seconds and backs off to at most POLLING_INTERVAL
 POLLING_INTERVAL = 3
+MIN_POLLING_INTERVAL = 0.2
+POLLING_BACKOFF = 1.5
 API_URL = "https://rest.uniprot.org"
+# ids per ID mapping job (the server accepts at most 100,000) and number of jobs run at once
+CHUNK_SIZE = 10000
+MAX_CONCURRENT_JOBS = 4
+# rows parsed at a time when streaming TSV results, and the TSV column holding each JSON field
+STREAM_CHUNK_SIZE = 50000
+STREAM_FIELDS = {"primaryAccession": "accession"}
+# fetch results from the TSV stream endpoint rather than paging through JSON, e.g. set by --uniprot-stream
+STREAM_RESULTS = False
+# UniProt database names of the identifier types that can be mapped to
+TO_DBS = {"Entrez": 'GeneID', "Ensembl": 'Ensembl', "Symbol": 'Gene_Name', "Uniprot": "UniProtKB", "DIP": "DIP"}
 
 
 retries = Retry(total=5, backoff_factor=0.25, status_forcelist=[500, 502, 503, 504])
 session = requests.Session()
-session.mount("https://", HTTPAdapter(max_retries=retries))
+adapter = replay.ArchiveAdapter("uniprot", max_retries=retries, pool_maxsize=MAX_CONCURRENT_JOBS * 2)
+session.mount("https://", adapter)
+session.mount("http://", adapter)
+session.hooks["response"].append(record_response)
 
 
 def check_response(response):
@@ -28,7 +50,7 @@ def check_response(response):
 
 
 def submit_id_mapping(from_db, to_db, ids):
-    request = requests.post(
+    request = session.post(
         f"{API_URL}/idmapping/run",data={"from": from_db, "to": to_db, "ids": ",".join(ids)},
     )
     check_response(request)
@@ -44,14 +66,16 @@ def get_next_link(headers):
 
 
 def check_id_mapping_results_ready(job_id):
+    interval = MIN_POLLING_INTERVAL
     while True:
         request = session.get(f"{API_URL}/idmapping/status/{job_id}")
         check_response(request)
         j = request.json()
         if "jobStatus" in j:
-            if j["jobStatus"] == "RUNNING":
-                print(f"Retrying in {POLLING_INTERVAL}s")
-                time.sleep(POLLING_INTERVAL)
+            if j["jobStatus"] in ("NEW", "RUNNING"):
+                print(f"Retrying in {interval:.2f}s")
+                time.sleep(interval)
+                interval = min(interval * POLLING_BACKOFF, POLLING_INTERVAL)
             else:
                 raise Exception(j["jobStatus"])
         else:
@@ -178,16 +202,210 @@ def get_id_mapping_results_stream(url):
     )
     return decode_results(request, file_format, compressed)
 
-def perform_uniprot_query(ids, from_db, to_db):
-    # need to see how this performs for actual conversions
-    dbs = {"Entrez":'GeneID', "Ensembl": 'Ensembl', "Symbol": 'Gene_Name', "Uniprot": "UniProtKB", "DIP":"DIP"}
-    field = 'primaryAccession' if to_db == "Uniprot" else None
-    job_id = submit_id_mapping(
-        from_db=from_db, to_db=dbs[to_db], ids=ids
-    )
+
+def stream_url(url, field=None):
+    """ Stream endpoint URL for the results of a job, as gzip-compressed TSV with only the columns needed"""
+    parsed = urlparse(url.replace("/results/", "/results/stream/") if "/stream/" not in url else url)
+    query = parse_qs(parsed.query)
+    query.update({"format": ["tsv"], "compressed": ["true"]})
+    if field is not None:
+        query["fields"] = [STREAM_FIELDS[field]]
+    return parsed._replace(query=urlencode(query, doseq=True)).geturl()
+
+
+class TsvChunkParser:
+    """ Incremental parser of TSV results, gzip-compressed or not, fed the response body as it downloads so that
+    neither the body nor all of its rows are held at once
+
+    Args:
+        chunksize (int): number of rows in each DataFrame returned
+    """
+    def __init__(self, chunksize=STREAM_CHUNK_SIZE):
+        self.chunksize = chunksize
+        self._start = b""
+        self._decompressor = None
+        self._compressed = None
+        self._partial = b""
+        self._header = True
+        self._rows = []
+
+    def feed(self, data):
+        """ Parse the next bytes of the body
+
+        Returns:
+            list: DataFrames of chunksize results completed by these bytes
+        """
+        if self._compressed is None:
+            # whether the body is compressed is decided from its first two bytes
+            self._start += data
+            if len(self._start) < 2:
+                return []
+            data, self._start = self._start, b""
+            self._compressed = data[:2] == b"\x1f\x8b"
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if self._compressed else None
+        if self._compressed:
+            text = self._decompressor.decompress(data)
+            # concatenated gzip members are each decompressed in turn
+            while self._decompressor.eof and self._decompressor.unused_data:
+                rest = self._decompressor.unused_data
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                text += self._decompressor.decompress(rest)
+            data = text
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        return self._add(lines)
+
+    def close(self):
+        """ Parse the rest of the body
+
+        Returns:
+            list: DataFrames of the remaining results
+        """
+        if self._compressed is None:
+            self._compressed = False
+            self._partial, self._start = self._start, b""
+        lines = [self._partial] if self._partial else []
+        self._partial = b""
+        return self._add(lines) + ([self._frame()] if self._rows else [])
+
+    def _add(self, lines):
+        chunks = []
+        for line in lines:
+            line = line.rstrip(b"\r")
+            if self._header:
+                self._header = False
+                continue
+            if not line:
+                continue
+            fields = line.decode().split("\t")
+            self._rows.append((fields[0] or None, fields[1] if (len(fields) > 1) and fields[1] else None))
+            if len(self._rows) == self.chunksize:
+                chunks.append(self._frame())
+        return chunks
+
+    def _frame(self):
+        chunk = pd.DataFrame(self._rows, columns=["from", "to"], dtype=object)
+        self._rows = []
+        return chunk
+
+
+def read_tsv_chunks(stream, chunksize=STREAM_CHUNK_SIZE, block_size=2 ** 16):
+    """ Parse TSV results, gzip-compressed or not, from a binary file object, reading block_size bytes at a time
+
+    Yields:
+        pd.DataFrame: up to chunksize results with columns 'from' and 'to'
+    """
+    parser = TsvChunkParser(chunksize)
+    for data in iter(lambda: stream.read(block_size), b""):
+        yield from parser.feed(data)
+    yield from parser.close()
+
+
+def iter_id_mapping_results_stream(url, field=None, chunksize=STREAM_CHUNK_SIZE):
+    """ Stream all results of a job as gzip-compressed TSV, parsing them incrementally
+
+    Args:
+        url (str): results URL returned by get_id_mapping_results_link
+        field (str): 'primaryAccession' to return only the accession of UniProtKB entries
+        chunksize (int): number of rows parsed at a time
+
+    Yields:
+        pd.DataFrame: up to chunksize results with columns 'from' and 'to', while the download continues
+    """
+    with session.get(stream_url(url, field), stream=True) as request:
+        check_response(request)
+        request.raw.decode_content = True
+        yield from read_tsv_chunks(request.raw, chunksize)
+
+
+def read_id_mapping_results_stream(url, field=None, chunksize=STREAM_CHUNK_SIZE):
+    """ All results of iter_id_mapping_results_stream in one DataFrame with columns 'from' and 'to'"""
+    chunks = list(iter_id_mapping_results_stream(url, field, chunksize))
+    if len(chunks) == 0:
+        return pd.DataFrame(columns=["from", "to"])
+    return pd.concat(chunks, ignore_index=True)
+
+
+def run_id_mapping_job(ids, from_db, to_db, field=None, stream=False):
+    """ Submit a single ID mapping job and wait for its results
+
+    Args:
+        stream (bool): fetch results from the compressed TSV stream endpoint rather than paging through JSON
+
+    Returns:
+        pd.DataFrame: results with columns 'from' and 'to'
+        list: ids that could not be mapped
+    """
+    job_id = submit_id_mapping(from_db=from_db, to_db=to_db, ids=ids)
     if check_id_mapping_results_ready(job_id):
         link = get_id_mapping_results_link(job_id)
+        if stream:
+            results_df = read_id_mapping_results_stream(link, field=field)
+            mapped = set(results_df["from"])
+            return results_df, [i for i in ids if i not in mapped]
         results = get_id_mapping_results_search(link, field=field)
-    failedIds = results['failedIds']
-    results_df = pd.DataFrame.from_dict(results['results'])
+        return pd.DataFrame.from_dict(results['results']), results['failedIds']
+    return pd.DataFrame(), []
+
+
+class Transport:
+    """ Runs the ID mapping jobs of perform_uniprot_query, up to max_jobs at once in worker threads. The query's
+    index, cache and merging are shared with async_query, which runs the jobs from an event loop instead."""
+    async def run_jobs(self, chunks, from_db, to_db, field, stream, max_jobs):
+        """ Results of run_id_mapping_job for each chunk of ids, in order"""
+        def run_chunk(chunk):
+            return run_id_mapping_job(chunk, from_db, to_db, field, stream=stream)
+        if (max_jobs <= 1) or (len(chunks) == 1):
+            return [run_chunk(chunk) for chunk in chunks]
+        with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+            return list(executor.map(in_context(run_chunk), chunks))
+
+
+def perform_uniprot_query(ids, from_db, to_db, chunk_size=None, max_jobs=None, stream=None):
+    """ Map identifiers using the UniProt ID mapping service
+
+    Large id lists are split into jobs of at most chunk_size ids, with up to max_jobs jobs running at once. If a
+    uniprot_index.UniProtIndex is set, it answers the query instead of the service.
+
+    Args:
+        ids (iterable): identifiers to map
+        from_db (str): UniProt database name of the input ids, e.g. "UniProtKB_AC-ID"
+        to_db (str): Identifier type to map to ("Entrez", "Ensembl", "Symbol", "Uniprot" or "DIP")
+        chunk_size (int): maximum number of ids per job, CHUNK_SIZE if None
+        max_jobs (int): maximum number of concurrent jobs, MAX_CONCURRENT_JOBS if None
+        stream (bool): download results as compressed TSV and parse them in chunks, which uses less memory
+            than paging through JSON for very large mappings. STREAM_RESULTS if None.
+
+    Returns:
+        pd.DataFrame: mapping results with columns 'from' and 'to'
+        list: ids that could not be mapped
+    """
+    return run_sync(_perform_uniprot_query(Transport(), ids, from_db, to_db, chunk_size, max_jobs, stream))
+
+
+async def _perform_uniprot_query(transport, ids, from_db, to_db, chunk_size, max_jobs, stream):
+    index = uniprot_index.get_index()
+    if index is not None:
+        return index.perform_uniprot_query(ids, from_db, TO_DBS[to_db])
+    # need to see how this performs for actual conversions
+    field = 'primaryAccession' if to_db == "Uniprot" else None
+    chunk_size = CHUNK_SIZE if chunk_size is None else chunk_size
+    max_jobs = MAX_CONCURRENT_JOBS if max_jobs is None else max_jobs
+    stream = STREAM_RESULTS if stream is None else stream
+    cached_map, ids = cache.lookup("uniprot", from_db, to_db, ids)
+    cached_df = pd.DataFrame([{"from": k, "to": v} for k in cached_map for v in cached_map[k]], columns=["from", "to"])
+    if len(ids) == 0:
+        return cached_df, []
+    # sorted so the same ids always make the same jobs, which lets recorded jobs be replayed
+    ids = sorted(ids)
+    chunks = [ids[i:i + chunk_size] for i in range(0, len(ids), chunk_size)]
+    if len(chunks) > 1:
+        print("Submitting", len(chunks), "ID mapping jobs")
+    chunk_results = await transport.run_jobs(chunks, from_db, TO_DBS[to_db], field, stream, max_jobs)
+    failedIds = [failed for _, chunk_failed in chunk_results for failed in chunk_failed]
+    results_df = pd.concat([chunk_df for chunk_df, _ in chunk_results], ignore_index=True)
+    if len(results_df) > 0:
+        cache.store("uniprot", from_db, to_db, results_df.groupby("from")["to"].apply(list).to_dict())
+    if len(cached_df) > 0:
+        results_df = pd.concat([cached_df, results_df], ignore_index=True)
     return results_df, failedIds
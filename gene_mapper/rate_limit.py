@@ -0,0 +1,228 @@
+import time
+import random
+import asyncio
+import threading
+import weakref
+from contextlib import contextmanager, asynccontextmanager
+from gene_mapper.Timer import record
+
+# Requests per second and requests in flight allowed to each service, across all threads of the process.
+# HGNC asks for fewer than 10 requests per second and Ensembl allows 15; the others are conservative.
+SERVICE_LIMITS = {"hgnc": {"rate": 10, "concurrency": 10}, "ensembl": {"rate": 15, "concurrency": 15},
+                  "uniprot": {"rate": 25, "concurrency": 10}, "mygene": {"rate": 10, "concurrency": 10}}
+# responses asking the client to slow down, which are retried once the service's bucket refills
+THROTTLE_STATUSES = [429]
+MAX_THROTTLE_RETRIES = 5
+# seconds to wait after a throttled response without Retry-After, doubled on each retry
+THROTTLE_BACKOFF = 1
+
+_scheduler = None
+
+
+class TokenBucket:
+    """ Thread-safe token bucket limiting how often requests are sent to a service.
+
+    Args:
+        rate (float): tokens added per second, i.e. the sustained request rate
+        capacity (float): maximum tokens held, i.e. the largest allowed burst. Defaults to rate.
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        """ Block until `tokens` tokens are available and take them"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=1):
+        """ Wait without blocking the event loop until `tokens` tokens are available and take them
+
+        The tokens are reserved at once, leaving the bucket in debt until they are refilled, so the coroutine
+        sleeps a single time. The lock is only tried, since blocking on it would stall the event loop while a
+        thread holds it; it is held for a few operations, so yielding once is enough to get it.
+        """
+        while not self._lock.acquire(blocking=False):
+            await asyncio.sleep(0)
+        try:
+            self._refill()
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate
+        finally:
+            self._lock.release()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """ Empty the bucket so no tokens are available for `seconds`, e.g. after a 429 with Retry-After"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+def retry_after(response, default):
+    """ Seconds to wait before retrying, from a response's Retry-After header if it has one"""
+    return parse_retry_after(response.headers.get("Retry-After"), default)
+
+
+def parse_retry_after(value, default):
+    try:
+        return max(float(value), 0)
+    except (TypeError, ValueError):
+        return default
+
+
+class ServiceLimiter:
+    """ Token bucket and concurrency cap for one service, shared by every thread and coroutine sending to it.
+
+    Args:
+        name (str): service name, e.g. "ensembl"
+        rate (float): sustained requests per second
+        concurrency (int): maximum requests in flight
+    """
+    def __init__(self, name, rate, concurrency):
+        self.name = name
+        self.rate = rate
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate)
+        self.throttled = 0
+        self._slots = threading.BoundedSemaphore(concurrency)
+        # coroutines wait for a slot on their event loop's semaphore, so that waiting does not poll
+        self._loop_slots = weakref.WeakKeyDictionary()
+
+    @contextmanager
+    def slot(self):
+        """ Hold one of the service's concurrent requests, after waiting for a token"""
+        with self._slots:
+            self.bucket.acquire()
+            yield
+
+    @asynccontextmanager
+    async def slot_async(self):
+        """ As slot, waiting without blocking the event loop. The concurrency cap applies to the coroutines of
+        each event loop, and the token bucket is shared with every thread."""
+        loop = asyncio.get_running_loop()
+        slots = self._loop_slots.get(loop)
+        if slots is None:
+            slots = self._loop_slots.setdefault(loop, asyncio.Semaphore(self.concurrency))
+        async with slots:
+            await self.bucket.acquire_async()
+            yield
+
+    def throttle(self, status, retry_after_value, retry):
+        """ Handle a response status, pausing the whole service if it asks clients to slow down
+
+        Args:
+            status (int): HTTP status of the response
+            retry_after_value (str): its Retry-After header, or None
+            retry (int): number of times the request has already been retried
+
+        Returns:
+            float: seconds the service is paused for if the request should be sent again, otherwise None
+        """
+        if (status not in THROTTLE_STATUSES) or (retry >= MAX_THROTTLE_RETRIES):
+            return None
+        wait = parse_retry_after(retry_after_value, THROTTLE_BACKOFF * 2 ** retry * random.uniform(0.5, 1))
+        print(f"{self.name} returned {status}, pausing requests for {wait:.1f}s")
+        self.throttled += 1
+        record(retries=1)
+        # every thread waits for the bucket to refill, rather than each backing off on its own
+        self.bucket.pause(wait)
+        return wait
+
+
+class Scheduler:
+    """ Rate limits and concurrency caps of all upstream services, applied to every request by the transports
+    in gene_mapper.replay.
+
+    Args:
+        limits (dict): {service: {"rate": requests per second, "concurrency": requests in flight}}, by default
+            SERVICE_LIMITS
+    """
+    def __init__(self, limits=None):
+        limits = SERVICE_LIMITS if limits is None else limits
+        self.services = {name: ServiceLimiter(name, **limit) for name, limit in limits.items()}
+
+    def __getitem__(self, service):
+        return self.services[service]
+
+    @property
+    def limits(self):
+        return {name: {"rate": limiter.rate, "concurrency": limiter.concurrency}
+                for name, limiter in self.services.items()}
+
+    def configure(self, service, rate=None, concurrency=None):
+        """ Replace the limits of a service. Requests already waiting keep the old limits."""
+        limiter = self.services[service]
+        self.services[service] = ServiceLimiter(service, rate if rate is not None else limiter.rate,
+                                                concurrency if concurrency is not None else limiter.concurrency)
+
+    def divided(self, n):
+        """ Scheduler for one of n processes, so that together they stay within these limits (at least 1 request
+        in flight each)"""
+        return Scheduler({name: {"rate": limit["rate"] / n, "concurrency": max(1, limit["concurrency"] // n)}
+                          for name, limit in self.limits.items()})
+
+    def send(self, service, send, status, retry_after_value, discard=None):
+        """ Send a request within the service's limits, resending it after throttled responses
+
+        Args:
+            service (str): service name
+            send (callable): sends the request and returns the response
+            status (callable): HTTP status of a response
+            retry_after_value (callable): Retry-After header of a response, or None
+            discard (callable): releases the connection of a throttled response that is not returned
+
+        Returns:
+            the response of the last attempt
+        """
+        limiter = self.services[service]
+        retry = 0
+        while True:
+            with limiter.slot():
+                response = send()
+            if limiter.throttle(status(response), retry_after_value(response), retry) is None:
+                return response
+            if discard is not None:
+                discard(response)
+            retry += 1
+
+    async def send_async(self, service, send, status, retry_after_value, discard=None):
+        """ As send, for coroutine functions send and discard"""
+        limiter = self.services[service]
+        retry = 0
+        while True:
+            async with limiter.slot_async():
+                response = await send()
+            if limiter.throttle(status(response), retry_after_value(response), retry) is None:
+                return response
+            if discard is not None:
+                await discard(response)
+            retry += 1
+
+
+def set_scheduler(scheduler):
+    """ Set the Scheduler every request to the upstream services goes through"""
+    global _scheduler
+    _scheduler = scheduler
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler()
+    return _scheduler
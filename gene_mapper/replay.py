@@ -0,0 +1,282 @@
+import io
+import json
+import zlib
+import sqlite3
+import hashlib
+import threading
+import httpx
+import httplib2
+import urllib3
+from requests.adapters import HTTPAdapter
+from gene_mapper import rate_limit
+
+MODES = ["record", "replay", "auto"]
+# headers describing the transfer rather than the content, which are not archived
+TRANSFER_HEADERS = {"content-encoding", "transfer-encoding", "content-length", "connection", "keep-alive", "status"}
+
+_archive = None
+
+
+class ArchiveMiss(LookupError):
+    """ Raised in replay mode for a request that is not in the archive"""
+
+
+class HTTPArchive:
+    """ SQLite file of HTTP exchanges with the upstream services, keyed by method, URL and request body.
+
+    In "record" mode every response is stored, in "replay" mode responses are served from the archive without
+    touching the network, and in "auto" mode archived responses are replayed and the rest are recorded.
+    A repeated request keeps its latest response, so polling and retried requests replay their final outcome,
+    but an error or 304 Not Modified never replaces a successful response. Bodies are stored zlib-compressed.
+
+    Record with the mapping cache disabled or empty, otherwise ids answered from the cache are not captured.
+
+    Args:
+        path (str): archive file, created if it does not exist
+        mode (str): "record", "replay" or "auto"
+    """
+    def __init__(self, path, mode="replay"):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, not {mode}")
+        self.path = path
+        self.mode = mode
+        self.hits = 0
+        self.recorded = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS exchanges (
+                                key TEXT PRIMARY KEY, method TEXT, url TEXT, status INTEGER, headers TEXT,
+                                body BLOB)""")
+        self._conn.commit()
+
+    @staticmethod
+    def key(method, url, body=None):
+        if isinstance(body, str):
+            body = body.encode()
+        return hashlib.sha256(b"\n".join([method.upper().encode(), url.encode(), body or b""])).hexdigest()
+
+    def lookup(self, method, url, body=None):
+        """ The archived response to a request, if it should be replayed
+
+        Returns:
+            tuple: (status, headers, content), or None if the request should be sent
+        """
+        if self.mode == "record":
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT status, headers, body FROM exchanges WHERE key=?",
+                                     (self.key(method, url, body),)).fetchone()
+            if row is not None:
+                self.hits += 1
+        if row is None:
+            if self.mode == "replay":
+                raise ArchiveMiss(f"{method} {url} is not in the HTTP archive {self.path}")
+            return None
+        return row[0], json.loads(row[1]), zlib.decompress(row[2])
+
+    def store(self, method, url, body, status, headers, content):
+        """ Archive a response, unless it is unsuccessful and a successful response is already archived"""
+        key = self.key(method, url, body)
+        headers = archived_headers(headers)
+        with self._lock:
+            if not 200 <= status < 300:
+                row = self._conn.execute("SELECT status FROM exchanges WHERE key=?", (key,)).fetchone()
+                if (row is not None) and (200 <= row[0] < 300):
+                    return
+            self._conn.execute("INSERT OR REPLACE INTO exchanges VALUES (?, ?, ?, ?, ?, ?)",
+                               (key, method.upper(), url, status, json.dumps(headers), zlib.compress(content)))
+            self._conn.commit()
+            self.recorded += 1
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM exchanges").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def archived_headers(headers):
+    # httplib2 adds pseudo-headers starting with "-"
+    return [(k, v) for k, v in headers if (k.lower() not in TRANSFER_HEADERS) and not k.startswith("-")]
+
+
+def set_archive(archive):
+    """ Record or replay all requests to the upstream services with archive, or stop if archive is None"""
+    global _archive
+    _archive = archive
+
+
+def get_archive():
+    return _archive
+
+
+def load_archive(path, mode="replay"):
+    """ Open an HTTPArchive file and use it for all requests"""
+    archive = HTTPArchive(path, mode)
+    set_archive(archive)
+    return archive
+
+
+def replaying():
+    """ True if every request is answered from the archive, so rate limits need not be respected"""
+    return (_archive is not None) and (_archive.mode == "replay")
+
+
+def _status(response):
+    return response.status_code
+
+
+def _retry_after(response):
+    return response.headers.get("Retry-After")
+
+
+class ArchiveAdapter(HTTPAdapter):
+    """ requests transport adapter recording or replaying responses when an archive is set
+
+    Requests that are sent go through the rate_limit scheduler of the service, if one is given.
+    """
+    __attrs__ = HTTPAdapter.__attrs__ + ["service"]
+
+    def __init__(self, service=None, **kwargs):
+        self.service = service
+        super().__init__(**kwargs)
+
+    def _scheduled_send(self, request, **kwargs):
+        def send():
+            return super(ArchiveAdapter, self).send(request, **kwargs)
+        if self.service is None:
+            return send()
+        return rate_limit.get_scheduler().send(self.service, send, _status, _retry_after,
+                                               discard=lambda response: response.close())
+
+    def send(self, request, **kwargs):
+        archive = get_archive()
+        if archive is None:
+            return self._scheduled_send(request, **kwargs)
+        stored = archive.lookup(request.method, request.url, request.body)
+        if stored is None:
+            response = self._scheduled_send(request, **kwargs)
+            stored = response.status_code, archived_headers(response.headers.items()), response.content
+            archive.store(request.method, request.url, request.body, *stored)
+        status, headers, content = stored
+        headers = headers + [("Content-Length", str(len(content)))]
+        raw = urllib3.HTTPResponse(body=io.BytesIO(content), headers=headers, status=status, preload_content=False,
+                                   decode_content=False)
+        return self.build_response(request, raw)
+
+
+class ArchiveHttp(httplib2.Http):
+    """ httplib2 connection recording or replaying responses when an archive is set
+
+    Requests that are sent go through the rate_limit scheduler of the service, if one is given.
+    """
+    def __init__(self, service=None, **kwargs):
+        self.service = service
+        super().__init__(**kwargs)
+
+    def _scheduled_request(self, *args, **kwargs):
+        def send():
+            return super(ArchiveHttp, self).request(*args, **kwargs)
+        if self.service is None:
+            return send()
+        return rate_limit.get_scheduler().send(self.service, send, lambda result: result[0].status,
+                                               lambda result: result[0].get("retry-after"))
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        archive = get_archive()
+        if archive is None:
+            return self._scheduled_request(uri, method, body, headers, *args, **kwargs)
+        stored = archive.lookup(method, uri, body)
+        if stored is None:
+            response, content = self._scheduled_request(uri, method, body, headers, *args, **kwargs)
+            archive.store(method, uri, body, response.status, list(response.items()), content)
+            return response, content
+        status, headers, content = stored
+        return httplib2.Response({**dict(headers), "status": str(status)}), content
+
+
+class ArchiveTransport(httpx.BaseTransport):
+    """ httpx transport recording or replaying responses when an archive is set
+
+    Replayed responses are marked as cached, as the MyGene client expects. Requests that are sent go through the
+    rate_limit scheduler of the service, if one is given.
+    """
+    def __init__(self, transport=None, service=None):
+        self.transport = transport if transport is not None else httpx.HTTPTransport()
+        self.service = service
+
+    def _scheduled_send(self, request):
+        def send():
+            return self.transport.handle_request(request)
+        if self.service is None:
+            return send()
+        return rate_limit.get_scheduler().send(self.service, send, _status, _retry_after,
+                                               discard=lambda response: response.close())
+
+    def handle_request(self, request):
+        archive = get_archive()
+        if archive is None:
+            return self._scheduled_send(request)
+        body = request.read()
+        stored = archive.lookup(request.method, str(request.url), body)
+        if stored is None:
+            response = self._scheduled_send(request)
+            response = httpx.Response(response.status_code, headers=response.headers, stream=response.stream,
+                                      request=request)
+            content = response.read()
+            response.close()
+            archive.store(request.method, str(request.url), body, response.status_code,
+                          list(response.headers.items()), content)
+            return httpx.Response(response.status_code, headers=archived_headers(response.headers.items()),
+                                  content=content, request=request)
+        status, headers, content = stored
+        return httpx.Response(status, headers=headers, content=content, request=request,
+                              extensions={"hishel_from_cache": True})
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncArchiveTransport(httpx.AsyncBaseTransport):
+    """ Asynchronous httpx transport recording or replaying responses when an archive is set
+
+    Requests that are sent go through the rate_limit scheduler of the service named by the "service" request
+    extension, if there is one.
+    """
+    def __init__(self, transport=None):
+        self.transport = transport if transport is not None else httpx.AsyncHTTPTransport()
+
+    async def _scheduled_send(self, request):
+        async def send():
+            return await self.transport.handle_async_request(request)
+
+        async def discard(response):
+            await response.aclose()
+        service = request.extensions.get("service")
+        if service is None:
+            return await send()
+        return await rate_limit.get_scheduler().send_async(service, send, _status, _retry_after, discard=discard)
+
+    async def handle_async_request(self, request):
+        archive = get_archive()
+        if archive is None:
+            return await self._scheduled_send(request)
+        body = await request.aread()
+        stored = archive.lookup(request.method, str(request.url), body)
+        if stored is None:
+            response = await self._scheduled_send(request)
+            response = httpx.Response(response.status_code, headers=response.headers, stream=response.stream,
+                                      request=request)
+            content = await response.aread()
+            await response.aclose()
+            archive.store(request.method, str(request.url), body, response.status_code,
+                          list(response.headers.items()), content)
+            return httpx.Response(response.status_code, headers=archived_headers(response.headers.items()),
+                                  content=content, request=request)
+        status, headers, content = stored
+        return httpx.Response(status, headers=headers, content=content, request=request)
+
+    async def aclose(self):
+        await self.transport.aclose()
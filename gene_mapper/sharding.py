@@ -0,0 +1,189 @@
+import os
+import zlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from gene_mapper import mapper
+from gene_mapper import cache
+from gene_mapper import replay
+from gene_mapper import rate_limit
+from gene_mapper import hgnc_snapshot
+from gene_mapper import ensembl_history
+from gene_mapper import uniprot_index
+from gene_mapper import ncbi_genes
+from gene_mapper import name_index
+from gene_mapper import query_hgnc as hgnc
+from gene_mapper import query_uniprot as uni
+from gene_mapper import query_ensembl as ensg
+from gene_mapper import query_mygene
+from gene_mapper.Timer import Timer
+from gene_mapper.mapping_table import MappingTable
+
+# Map very large node sets in several processes. The nodes are split into shards by a stable hash, each
+# shard is classified, queried and post-processed by update_nodes or convert_node_ids in a worker process,
+# and the results are merged in a fixed order. Worker processes are started with forkserver (or spawn where it
+# is not available) rather than forked, since forking a process whose threads may hold locks in connection
+# pools, executors or SQLite can deadlock the child. Each worker is set up from a description of the parent's
+# configuration and reloads the offline backends from their files.
+
+# worker processes used when none is given
+PROCESSES = os.cpu_count() or 1
+# inputs smaller than this per process are mapped in the calling process
+MIN_SHARD_SIZE = 10000
+# request statistics collected from the worker processes
+REQUEST_COUNTS = ["requests", "bytes", "retries"]
+# get, set and load functions of the offline backends. Backends loaded from files are loaded again by each
+# worker from the same files, and others are sent to the workers.
+BACKENDS = [(hgnc_snapshot.get_snapshot, hgnc_snapshot.set_snapshot, hgnc_snapshot.load_snapshot),
+            (ensembl_history.get_history, ensembl_history.set_history, ensembl_history.load_history),
+            (uniprot_index.get_index, uniprot_index.set_index, uniprot_index.load_index),
+            (ncbi_genes.get_genes, ncbi_genes.set_genes, ncbi_genes.load_genes),
+            (name_index.get_index, name_index.set_index, name_index.load_index)]
+
+
+def shard_nodes(nodes, n_shards):
+    """ Split nodes into n_shards sorted lists, always placing the same node in the same shard
+
+    Returns:
+        list: a list of nodes per shard
+    """
+    shards = [[] for _ in range(n_shards)]
+    for node in nodes:
+        shards[zlib.crc32(str(node).encode()) % n_shards].append(node)
+    return [sorted(shard, key=str) for shard in shards]
+
+
+def merge_results(results):
+    """ Combine the (node map, failed nodes) results of each shard
+
+    Shards hold disjoint nodes, so the maps are combined in shard order and the failed nodes are sorted, giving
+    the same result for the same input however the shards were scheduled.
+    """
+    failed = [node for _, shard_failed in results for node in shard_failed]
+    return MappingTable.concat([shard_map for shard_map, _ in results]), sorted(failed, key=str)
+
+
+def worker_budget(total, processes):
+    """ Concurrent requests allowed in each worker so all workers together stay within total (at least 1)"""
+    return max(1, total // processes)
+
+
+def start_method():
+    """ Start method of the worker processes: forkserver if the platform has it, otherwise spawn"""
+    return "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def worker_state(processes):
+    """ What a new worker process needs to map like this process: service URLs, batch sizes, each worker's share
+    of the concurrency and rate limits, the cache, HTTP archive, approved symbols and offline backends
+
+    Returns:
+        dict: picklable state for _init_worker
+    """
+    mapping_cache = cache.get_cache()
+    archive = replay.get_archive()
+    backends = []
+    for get, set_backend, load in BACKENDS:
+        backend = get()
+        source = getattr(backend, "source", None)
+        backends.append((load, *source) if source is not None else (set_backend, (backend,), {}))
+    return {"urls": {"hgnc": hgnc.HGNC_URL, "uniprot": uni.API_URL, "ensembl": ensg.ENSEMBL_URL,
+                     "mygene": query_mygene.client.url},
+            "workers": {"hgnc": worker_budget(hgnc.MAX_WORKERS, processes),
+                        "ensembl": worker_budget(ensg.MAX_WORKERS, processes),
+                        "mygene": worker_budget(query_mygene.MAX_WORKERS, processes),
+                        "uniprot": worker_budget(uni.MAX_CONCURRENT_JOBS, processes)},
+            "batch_sizes": {"ensembl": ensg.BATCH_SIZE, "mygene": query_mygene.BATCH_SIZE, "uniprot": uni.CHUNK_SIZE},
+            "uniprot_stream": uni.STREAM_RESULTS,
+            "limits": rate_limit.get_scheduler().divided(processes).limits,
+            # an in-memory cache cannot be shared, so each worker then starts an empty one
+            "cache": None if mapping_cache is None else
+            {"path": mapping_cache.path, "ttls": mapping_cache.ttls, "max_entries": mapping_cache.max_entries,
+             "negative_ttls": mapping_cache.negative_ttls, "max_failures": mapping_cache.max_failures},
+            "cache_dir": cache._cache_dir,
+            "archive": None if archive is None else (archive.path, archive.mode),
+            "approved": hgnc._approved,
+            "backends": backends}
+
+
+def _init_worker(state):
+    hgnc.HGNC_URL, uni.API_URL, ensg.ENSEMBL_URL = (state["urls"][service] for service in ["hgnc", "uniprot",
+                                                                                          "ensembl"])
+    query_mygene.client = query_mygene.new_client(state["urls"]["mygene"])
+    hgnc.MAX_WORKERS = state["workers"]["hgnc"]
+    ensg.MAX_WORKERS = state["workers"]["ensembl"]
+    query_mygene.MAX_WORKERS = state["workers"]["mygene"]
+    uni.MAX_CONCURRENT_JOBS = state["workers"]["uniprot"]
+    ensg.BATCH_SIZE = state["batch_sizes"]["ensembl"]
+    query_mygene.BATCH_SIZE = state["batch_sizes"]["mygene"]
+    uni.CHUNK_SIZE = state["batch_sizes"]["uniprot"]
+    uni.STREAM_RESULTS = state["uniprot_stream"]
+    rate_limit.set_scheduler(rate_limit.Scheduler(state["limits"]))
+    if state["cache"] is not None:
+        cache.set_cache(cache.MappingCache(**state["cache"]))
+    cache._cache_dir = state["cache_dir"]
+    if state["archive"] is not None:
+        replay.load_archive(*state["archive"])
+    hgnc._approved = state["approved"]
+    for function, args, kwargs in state["backends"]:
+        function(*args, **kwargs)
+
+
+def _map_shard(function, nodes, *args, **kwargs):
+    timer = Timer()
+    node_map, failed = getattr(mapper, function)(set(nodes), *args, timer=timer, **kwargs)
+    counts = {}
+    for span in timer.spans:
+        for key in REQUEST_COUNTS:
+            if key in span.attributes:
+                counts[key] = counts.get(key, 0) + span.attributes[key]
+    return node_map, list(failed), counts
+
+
+def map_sharded(function, nodes, *args, processes=None, timer=None, **kwargs):
+    """ Run mapper.update_nodes or mapper.convert_node_ids on shards of nodes in worker processes
+
+    Args:
+        function (str): "update_nodes" or "convert_node_ids"
+        nodes (set): identifiers to map
+        *args: passed to the mapping function after the shard of nodes
+        processes (int): number of worker processes, PROCESSES if None. The concurrent requests and rate limit
+            of each service are divided between them.
+        **kwargs: passed to the mapping function
+
+    Returns:
+        MappingTable: mapping between input nodes and new identifiers
+        list: nodes that could not be mapped, sorted
+    """
+    processes = PROCESSES if processes is None else processes
+    processes = max(1, min(processes, len(nodes) // MIN_SHARD_SIZE))
+    if timer is None:
+        timer = Timer()
+    with timer.span("Sharded " + function, processes=processes, nodes=len(nodes)) as span:
+        if processes == 1:
+            node_map, failed = getattr(mapper, function)(nodes, *args, timer=timer, **kwargs)
+            return node_map, sorted(failed, key=str)
+        if (function == "update_nodes") and (args[0] == "Symbol") and (hgnc_snapshot.get_snapshot() is None):
+            # downloaded once here and passed to the workers, rather than by every worker
+            hgnc.get_approved_symbols()
+        shards = shard_nodes(nodes, processes)
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context(start_method()),
+                                 initializer=_init_worker, initargs=(worker_state(processes),)) as executor:
+            futures = [executor.submit(_map_shard, function, shard, *args, **kwargs) for shard in shards]
+            results = [future.result() for future in futures]
+        for _, _, counts in results:
+            span.add(**counts)
+        node_map, failed = merge_results([result[:2] for result in results])
+        span.set(mapped=len(node_map), failed=len(failed))
+    return node_map, failed
+
+
+def update_nodes_sharded(nodes, id_type, keep="present", processes=None, timer=None):
+    """ mapper.update_nodes split across worker processes, see map_sharded"""
+    return map_sharded("update_nodes", nodes, id_type, keep=keep, processes=processes, timer=timer)
+
+
+def convert_node_ids_sharded(nodes, initial_id, target_id, processes=None, timer=None, planner=None):
+    """ mapper.convert_node_ids split across worker processes, see map_sharded. Each worker uses a copy of the
+    planner, so costs measured by the workers are not kept."""
+    return map_sharded("convert_node_ids", nodes, initial_id, target_id, processes=processes, timer=timer,
+                       planner=planner)
@@ -0,0 +1,230 @@
+import os
+import re
+import sys
+import json
+import argparse
+import numpy as np
+import pandas as pd
+
+# Offline UniProt ID mapping from the idmapping files at
+# https://ftp.uniprot.org/pub/databases/uniprot/current_release/knowledgebase/idmapping/by_organism/
+# (HUMAN_9606_idmapping.dat.gz, three tab separated columns: accession, database, identifier) and optionally
+# the secondary accession list
+# https://ftp.uniprot.org/pub/databases/uniprot/current_release/knowledgebase/complete/docs/sec_ac.txt
+
+INDEX_VERSION = 1
+# idmapping.dat database names indexed from UniProt accessions, the values of query_uniprot.TO_DBS other than
+# UniProtKB
+TO_DBS = ["GeneID", "Ensembl", "Gene_Name", "DIP"]
+# databases whose identifiers can be mapped back to UniProt accessions, the from_db values other than
+# UniProtKB_AC-ID
+FROM_DBS = ["DIP"]
+# rows of the idmapping file read at a time while building
+READ_CHUNK_SIZE = 1000000
+ACCESSION = re.compile(r"(?:[OPQ][0-9][A-Z0-9]{3}[0-9]|[A-NR-Z][0-9](?:[A-Z][A-Z0-9]{2}[0-9]){1,2})\Z")
+
+_index = None
+
+
+class UniProtIndex:
+    """ Sorted, memory-mapped tables answering UniProt ID mapping queries without network access.
+
+    Each table is a pair of numpy arrays of fixed-width byte strings, keys sorted with their values, saved as .npy
+    files and opened with mmap_mode="r", so loading is instant and only the pages a lookup touches are read.
+    A batch of ids is looked up with one binary search over the keys.
+
+    Input accessions are first resolved to their primary accession through the "UniProtKB" table, which holds
+    every primary accession, entry name (P53_HUMAN) and secondary accession. Isoform accessions (P04637-2) are
+    resolved by their entry's accession.
+
+    Args:
+        path (str): directory written by build_index
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "index.json")) as f:
+            self.metadata = json.load(f)
+        if self.metadata.get("version") != INDEX_VERSION:
+            raise ValueError(f"{path} is not a version {INDEX_VERSION} UniProt index")
+        self.tables = {name: (np.load(os.path.join(path, name + ".keys.npy"), mmap_mode="r"),
+                              np.load(os.path.join(path, name + ".values.npy"), mmap_mode="r"))
+                       for name in self.metadata["tables"]}
+        print("Opened UniProt index", path, "of", self.metadata["source"])
+
+    def __repr__(self):
+        return f"UniProtIndex({self.path!r})"
+
+    def __reduce__(self):
+        # pickled by path, so another process opens its own memory maps rather than receiving a copy of the tables
+        return UniProtIndex, (self.path,)
+
+    def lookup(self, table, ids):
+        """ Look up a batch of ids in one table
+
+        Args:
+            table (str): "UniProtKB", a database in TO_DBS, or "from_" + a database in FROM_DBS
+            ids (list): keys to look up
+
+        Returns:
+            np.ndarray: position in ids of each match, an id with several values appearing once per value
+            np.ndarray: the matching values, as str
+        """
+        keys, values = self.tables[table]
+        query = np.array([str(i).encode() for i in ids], dtype=bytes)
+        if len(query) == 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=object)
+        # longer ids cannot be keys and must not match a key after being truncated to the key width
+        valid = np.char.str_len(query) <= keys.dtype.itemsize
+        query = query.astype(keys.dtype)
+        left = np.searchsorted(keys, query, side="left")
+        right = np.searchsorted(keys, query, side="right")
+        counts = np.where(valid, right - left, 0)
+        positions = np.repeat(np.arange(len(query)), counts)
+        starts = np.repeat(left - (np.cumsum(counts) - counts), counts)
+        matched = np.asarray(values[starts + np.arange(counts.sum())])
+        return positions, np.char.decode(matched).astype(object)
+
+    def primary_accessions(self, ids):
+        """ Primary accession of each UniProt accession, isoform or entry name that is in the index
+
+        Returns:
+            dict: primary accessions of each resolved id
+        """
+        ids = list(ids)
+        positions, primary = self.lookup("UniProtKB", ids)
+        resolved = {}
+        for position, accession in zip(positions, primary):
+            resolved.setdefault(ids[position], []).append(accession)
+        isoforms = [i for i in ids if (i not in resolved) and ("-" in str(i))]
+        entries = [str(i).split("-")[0] for i in isoforms]
+        positions, primary = self.lookup("UniProtKB", entries)
+        for position, accession in zip(positions, primary):
+            resolved.setdefault(isoforms[position], []).append(accession)
+        return resolved
+
+    def perform_uniprot_query(self, ids, from_db, to_db):
+        """ Same return values as query_uniprot.perform_uniprot_query, without network access
+
+        Args:
+            ids (iterable): identifiers to map
+            from_db (str): "UniProtKB_AC-ID" or a database in FROM_DBS
+            to_db (str): "UniProtKB" for primary accessions, or a database in TO_DBS
+        """
+        ids = list(ids)
+        if from_db == "UniProtKB_AC-ID":
+            sources = self.primary_accessions(ids)
+        elif from_db in FROM_DBS:
+            positions, accessions = self.lookup("from_" + from_db, ids)
+            sources = {}
+            for position, accession in zip(positions, accessions):
+                sources.setdefault(ids[position], []).append(accession)
+        else:
+            raise NotImplementedError(f"Mapping from {from_db} is not indexed, use one of "
+                                      f"{['UniProtKB_AC-ID'] + FROM_DBS}")
+        pairs = [(i, accession) for i in ids for accession in sources.get(i, [])]
+        if to_db == "UniProtKB":
+            results = pairs
+        elif to_db not in TO_DBS:
+            raise NotImplementedError(f"Mapping to {to_db} is not indexed, use one of {['UniProtKB'] + TO_DBS}")
+        else:
+            accessions = sorted({accession for _, accession in pairs})
+            positions, values = self.lookup(to_db, accessions)
+            targets = {}
+            for position, value in zip(positions, values):
+                targets.setdefault(accessions[position], []).append(value)
+            results = [(i, value) for i, accession in pairs for value in targets.get(accession, [])]
+        results_df = pd.DataFrame(results, columns=["from", "to"]).drop_duplicates(ignore_index=True)
+        found = set(results_df["from"])
+        return results_df, [i for i in ids if i not in found]
+
+
+def read_secondary_accessions(path):
+    """ (secondary, primary) accession pairs from UniProt's sec_ac.txt, skipping its header"""
+    pairs = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if (len(fields) == 2) and ACCESSION.match(fields[0]) and ACCESSION.match(fields[1]):
+                pairs.append((fields[0], fields[1]))
+    return pairs
+
+
+def _save_table(path, name, keys, values):
+    keys = np.array([str(k).encode() for k in keys], dtype=bytes)
+    values = np.array([str(v).encode() for v in values], dtype=bytes)
+    order = np.lexsort((values, keys))
+    np.save(os.path.join(path, name + ".keys.npy"), keys[order])
+    np.save(os.path.join(path, name + ".values.npy"), values[order])
+
+
+def build_index(idmapping_path, path, secondary_path=None, chunksize=READ_CHUNK_SIZE):
+    """ Build a UniProtIndex from an idmapping.dat(.gz) file
+
+    Args:
+        idmapping_path (str): UniProt idmapping file, e.g. HUMAN_9606_idmapping.dat.gz
+        path (str): directory to write the index to, created if needed
+        secondary_path (str): sec_ac.txt, to resolve secondary accessions to primary ones
+        chunksize (int): rows of the idmapping file read at a time
+
+    Returns:
+        UniProtIndex: the index, opened from path
+    """
+    os.makedirs(path, exist_ok=True)
+    keep = set(TO_DBS) | set(FROM_DBS) | {"UniProtKB-ID"}
+    frames = []
+    reader = pd.read_csv(idmapping_path, sep="\t", header=None, names=["accession", "db", "id"], dtype=str,
+                         chunksize=chunksize, keep_default_na=False)
+    for chunk in reader:
+        frames.append(chunk.loc[chunk["db"].isin(keep)])
+    rows = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["accession", "db", "id"])
+    # the file also lists isoform accessions, which are looked up by their entry's accession
+    rows = rows.loc[~rows["accession"].str.contains("-", regex=False)]
+    primary = pd.unique(rows["accession"])
+    names = rows.loc[rows["db"] == "UniProtKB-ID"]
+    secondary = pd.DataFrame(read_secondary_accessions(secondary_path) if secondary_path is not None else [],
+                             columns=["secondary", "primary"])
+    _save_table(path, "UniProtKB", np.concatenate([primary, names["id"].values, secondary["secondary"].values]),
+                np.concatenate([primary, names["accession"].values, secondary["primary"].values]))
+    for db in TO_DBS:
+        table = rows.loc[rows["db"] == db]
+        _save_table(path, db, table["accession"].values, table["id"].values)
+    for db in FROM_DBS:
+        table = rows.loc[rows["db"] == db]
+        _save_table(path, "from_" + db, table["id"].values, table["accession"].values)
+    tables = ["UniProtKB"] + TO_DBS + ["from_" + db for db in FROM_DBS]
+    with open(os.path.join(path, "index.json"), "w") as f:
+        json.dump({"version": INDEX_VERSION, "source": os.path.basename(idmapping_path), "tables": tables,
+                   "accessions": len(primary), "secondary_accessions": len(secondary)}, f, indent=1)
+    print("Indexed", len(primary), "UniProt accessions in", path)
+    return UniProtIndex(path)
+
+
+def set_index(index):
+    """ Set the UniProtIndex used by query_uniprot in place of the ID mapping service. None restores the API."""
+    global _index
+    _index = index
+
+
+def get_index():
+    return _index
+
+
+def load_index(path):
+    """ Open a UniProtIndex directory and use it for all UniProt ID mapping queries"""
+    set_index(UniProtIndex(path))
+    return _index
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python -m gene_mapper.uniprot_index",
+                                     description="Build an offline UniProt ID mapping index")
+    parser.add_argument("idmapping", help="UniProt idmapping file, e.g. HUMAN_9606_idmapping.dat.gz")
+    parser.add_argument("index", help="directory to write the index to")
+    parser.add_argument("--secondary", help="sec_ac.txt, to resolve secondary accessions")
+    args = parser.parse_args(args)
+    build_index(args.idmapping, args.index, secondary_path=args.secondary)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
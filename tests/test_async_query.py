@@ -0,0 +1,67 @@
+from gene_mapper import async_query as aq
+from gene_mapper import mapper
+from gene_mapper import planner
+from benchmarks import run_benchmarks as bench
+from benchmarks.mock_services import MockServices, use_services, input_ids
+import unittest
+from unittest import mock
+import asyncio
+
+
+class Test(unittest.TestCase):
+    def test_gather_limited(self):
+        running, peak = [0], [0]
+
+        async def square(x):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(0.01 * (x % 3))
+            running[0] -= 1
+            return x * x
+        results = asyncio.run(aq.gather_limited(square, range(20), workers=4))
+        self.assertEqual(results, [x * x for x in range(20)])
+        self.assertEqual(peak[0], 4)
+        self.assertEqual(asyncio.run(aq.gather_limited(square, [], workers=4)), [])
+
+    def test_batched(self):
+        self.assertEqual(list(aq.batched({"c", "a", "b"}, 2)), [["a", "b"], ["c"]])
+
+    def test_same_results_as_sync(self):
+        with MockServices(n_genes=100) as services, use_services(services.urls), bench.isolated(1000):
+            for function, initial_id, target_id in bench.CASES:
+                nodes = set(input_ids(initial_id, 100))
+                if function == "update_nodes":
+                    expected = mapper.update_nodes(nodes, initial_id)
+                    results = asyncio.run(mapper.async_update_nodes(nodes, initial_id))
+                else:
+                    expected = mapper.convert_node_ids(nodes, initial_id, target_id)
+                    results = asyncio.run(mapper.async_convert_node_ids(nodes, initial_id, target_id))
+                self.assertEqual(results[0], expected[0], (initial_id, target_id))
+                self.assertEqual(sorted(results[1]), sorted(expected[1]), (initial_id, target_id))
+
+    def test_stream_results(self):
+        with MockServices(n_genes=100) as services, use_services(services.urls), bench.isolated(1000):
+            nodes = set(input_ids("Uniprot", 100))
+            expected = mapper.convert_node_ids(nodes, "Uniprot", "Entrez")
+            with mock.patch.object(aq.uni, "STREAM_RESULTS", True), \
+                    mock.patch.object(aq.uni, "TsvChunkParser", wraps=aq.uni.TsvChunkParser) as read:
+                streamed = mapper.convert_node_ids(nodes, "Uniprot", "Entrez")
+                self.assertGreater(read.call_count, 0)
+                read.reset_mock()
+                results = asyncio.run(mapper.async_convert_node_ids(nodes, "Uniprot", "Entrez"))
+                self.assertGreater(read.call_count, 0)
+        self.assertEqual(streamed[0], expected[0])
+        self.assertEqual(results[0], expected[0])
+        self.assertEqual(sorted(results[1]), sorted(expected[1]))
+
+    def test_planner_argument(self):
+        edges = {("uniprot", "Uniprot", "Entrez"): lambda ids: {i: "1" for i in ids if i == "P1"}}
+        conversion = planner.ConversionPlanner(edges, planner.CostModel())
+        expected = mapper.convert_node_ids({"P1", "P2"}, "Uniprot", "Entrez", planner=conversion)
+        results = asyncio.run(mapper.async_convert_node_ids({"P1", "P2"}, "Uniprot", "Entrez", planner=conversion))
+        self.assertEqual(dict(results[0]), {"P1": "1"})
+        self.assertEqual((results[0], list(results[1])), (expected[0], list(expected[1])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+from benchmarks import run_benchmarks as bench
+import unittest
+
+
+class Test(unittest.TestCase):
+    def test_all_cases_against_mock_services(self):
+        # every tenth identifier is unknown to the mock services
+        results = bench.run_benchmarks(sizes=[20], memory=False, requests_per_second=1000, out=None)
+        self.assertEqual(len(results), len(bench.CASES))
+        for result in results:
+            self.assertNotIn("error", result, result["id_type"])
+            self.assertEqual(result["mapped"] + result["failed"], 20, result["id_type"])
+        mapped = {result["id_type"]: result["mapped"] for result in results}
+        self.assertEqual(mapped["DIP"], 20)
+        # previous and alias symbols are only resolved by update_nodes
+        self.assertEqual(mapped["Symbol->Entrez"], 14)
+        self.assertTrue(all(n == 18 for id_type, n in mapped.items() if id_type not in ["DIP", "Symbol->Entrez"]))
+        self.assertEqual(results[0]["requests"]["uniprot"], 0)
+        self.assertGreater(results[0]["requests"]["hgnc"], 0)
+
+    def test_error_injection(self):
+        results = bench.run_benchmarks(sizes=[1000], cases=[("update_nodes", "Ensembl", None)], memory=True,
+                                       requests_per_second=1000, out=None,
+                                       services={"ensembl": {"error_rate": 0.5, "error_status": 429}})
+        self.assertEqual(results[0]["mapped"], 900)
+        self.assertGreater(results[0]["errors"]["ensembl"], 0)
+        self.assertEqual(results[0]["requests"]["ensembl"], 10 + results[0]["errors"]["ensembl"])
+        self.assertGreater(results[0]["peak_memory_mb"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+from gene_mapper import cache
+from gene_mapper import query_hgnc as hgnc
+from gene_mapper import mapper
+import unittest
+from unittest import mock
+import pandas as pd
+import os
+import time
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = os.path.dirname(os.path.realpath(__file__))
+        self.cache = cache.MappingCache(":memory:", ttls={"hgnc": 100}, max_entries=5)
+
+    def tearDown(self):
+        cache.set_cache(None)
+        self.cache.close()
+
+    def test_hits_and_misses(self):
+        self.cache.set_many("hgnc", "Symbol", "Symbol", {"ERF1": "ETF1", "C11orf1": "C11orf1"})
+        found = self.cache.get_many("hgnc", "Symbol", "Symbol", ["ERF1", "CDK6"])
+        self.assertEqual(found, {"ERF1": "ETF1"})
+        stats = self.cache.stats()["hgnc"]
+        self.assertEqual((stats["entries"], stats["hits"], stats["misses"]), (2, 1, 1))
+
+    def test_keys_are_separate(self):
+        self.cache.set_many("hgnc", "Symbol", "Entrez", {"CDK6": "1021"})
+        self.assertEqual(self.cache.get_many("hgnc", "Symbol", "Symbol", ["CDK6"]), {})
+        self.assertEqual(self.cache.get_many("mygene", "Symbol", "Entrez", ["CDK6"]), {})
+
+    def test_ttl_expiry(self):
+        self.cache.ttls["hgnc"] = 0.01
+        self.cache.set_many("hgnc", "Symbol", "Symbol", {"ERF1": "ETF1"})
+        time.sleep(0.05)
+        self.assertEqual(self.cache.get_many("hgnc", "Symbol", "Symbol", ["ERF1"]), {})
+
+    def test_size_bounded_eviction(self):
+        self.cache.set_many("ensembl", "Ensembl", "Ensembl", {str(i): str(i) for i in range(4)})
+        time.sleep(0.01)
+        self.cache.get_many("ensembl", "Ensembl", "Ensembl", ["0"])
+        self.cache.set_many("ensembl", "Ensembl", "Ensembl", {str(i): str(i) for i in range(4, 7)})
+        self.assertEqual(self.cache.stats()["ensembl"]["entries"], 5)
+        self.assertIn("0", self.cache.get_many("ensembl", "Ensembl", "Ensembl", ["0"]))
+
+    def test_lookup_without_cache(self):
+        cache.set_cache(None)
+        hits, remaining = cache.lookup("hgnc", "Symbol", "Symbol", ["A", "B"])
+        self.assertEqual((hits, remaining), ({}, ["A", "B"]))
+
+    def test_lookup_and_store(self):
+        cache.set_cache(self.cache)
+        cache.store("uniprot", "UniProtKB_AC-ID", "Entrez", {"P1": ["1", "2"]})
+        hits, remaining = cache.lookup("uniprot", "UniProtKB_AC-ID", "Entrez", ["P1", "P2"])
+        self.assertEqual(hits, {"P1": ["1", "2"]})
+        self.assertEqual(remaining, ["P2"])
+
+    def test_negative_ttl_and_eviction(self):
+        self.cache.max_failures = 3
+        self.cache.set_failed("hgnc", "Symbol", "Symbol", ["PARTICIPANT", "CHEBI:1"])
+        self.assertEqual(self.cache.get_failed("hgnc", "Symbol", "Symbol", ["PARTICIPANT", "CDK6"]), {"PARTICIPANT"})
+        self.assertEqual(self.cache.get_failed("mapper", "Symbol", "Symbol", ["PARTICIPANT"]), set())
+        time.sleep(0.01)
+        self.cache.set_failed("mapper", "Symbol", "Entrez", ["X1", "X2"])
+        self.assertEqual(self.cache.stats()["hgnc"]["failures"], 1)
+        self.assertEqual(self.cache.get_failed("hgnc", "Symbol", "Symbol", ["CHEBI:1"]), set())
+        self.cache.negative_ttls["mapper"] = 0.01
+        time.sleep(0.05)
+        self.assertEqual(self.cache.get_failed("mapper", "Symbol", "Entrez", ["X1", "X2"]), set())
+        self.assertEqual(self.cache.stats()["hgnc"]["failed_hits"], 1)
+
+    def test_known_failures_short_circuit(self):
+        cache.set_cache(self.cache)
+        def fake_fetch(path):
+            return None if path.endswith("ERR") else []
+        with mock.patch.object(hgnc, "search_approved_symbols",
+                               side_effect=lambda ids: ({}, set(ids), frozenset(["CDK6"]))), \
+                mock.patch.object(hgnc, "search_gene_names", side_effect=lambda ids, approved: ({}, list(ids))), \
+                mock.patch.object(hgnc, "fetch_docs", side_effect=fake_fetch) as fetch:
+            _, missing = hgnc.perform_hgnc_query(["PARTICIPANT", "ERR"], "Symbol", "Symbol")
+            self.assertEqual(missing, {"PARTICIPANT", "ERR"})
+            fetch.reset_mock()
+            _, missing = hgnc.perform_hgnc_query(["PARTICIPANT", "ERR"], "Symbol", "Symbol")
+        self.assertEqual(missing, {"PARTICIPANT", "ERR"})
+        # only the symbol whose requests failed is queried again
+        self.assertEqual(sorted(call[0][0] for call in fetch.call_args_list),
+                         ["/search/alias_symbol/ERR", "/search/prev_symbol/ERR"])
+
+    def test_convert_known_failures(self):
+        cache.set_cache(self.cache)
+        found = pd.DataFrame({"entrezgene": ["672"]}, index=["ENSG2"])
+        with mock.patch.object(mapper, "query_mygene", return_value=(found, ["ENSG1"])) as query:
+            mapper.convert_node_ids({"ENSG1", "ENSG2"}, "Ensembl", "Entrez")
+            node_map, still_missing = mapper.convert_node_ids({"ENSG1"}, "Ensembl", "Entrez")
+        self.assertEqual(query.call_count, 1)
+        self.assertEqual(len(node_map), 0)
+        self.assertEqual(still_missing, ["ENSG1"])
+
+    def test_duplicate_hits_are_not_misses(self):
+        cache.set_cache(self.cache)
+        found = pd.DataFrame({"entrezgene": ["673", "674"]}, index=["ENSG1", "ENSG1"])
+        with mock.patch.object(mapper, "query_mygene", return_value=(found, ["ENSG1"])):
+            mapper.convert_node_ids({"ENSG1"}, "Ensembl", "Entrez")
+        self.assertEqual(self.cache.get_failed("mapper", "Ensembl", "Entrez", ["ENSG1"]), set())
+
+    def test_offline_misses_not_recorded(self):
+        cache.set_cache(self.cache)
+        with mock.patch.object(mapper.ncbi_genes, "_genes", mock.Mock()), \
+                mock.patch.object(mapper, "query_mygene", return_value=(pd.DataFrame(), ["ENSG1"])):
+            mapper.convert_node_ids({"ENSG1"}, "Ensembl", "Entrez")
+        self.assertEqual(self.cache.get_failed("mapper", "Ensembl", "Entrez", ["ENSG1"]), set())
+
+    def test_row_round_trip(self):
+        df = pd.DataFrame({"_id": ["1", "2", "3"], "symbol": ["A", "B", "C"]}, index=["q1", "q2", "q2"])
+        rows = cache.frame_to_rows(df, exclude=["q3"])
+        rebuilt, dups = cache.rows_to_frame(rows)
+        self.assertEqual(dups, ["q2"])
+        self.assertEqual(list(rebuilt.loc["q2", "symbol"]), ["B", "C"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+from gene_mapper import classify
+from gene_mapper import mapper
+from benchmarks import run_benchmarks as bench
+from benchmarks.mock_services import MockServices, use_services, input_ids
+import unittest
+from unittest import mock
+import pandas as pd
+
+
+class Test(unittest.TestCase):
+    def test_classify_ids(self):
+        ids = {"TP53": "Symbol", "C11orf1": "Symbol", "HLA-A": "Symbol", "7157": "Entrez", "P04637": "Uniprot",
+               "P04637-2": "Uniprot", "A0A024RBG1": "Uniprot", "P53_HUMAN": "Uniprot",
+               "ENSG00000141510": "Ensembl", "ENSG00000141510.17": "Ensembl", "ENSP00000269305": "EnsemblProtein",
+               "NM_000546.6": "Refseq", "NP_000537": "Refseq", "DIP-1N": "DIP", "CHEBI:15377": "CHEBI",
+               "Mastermind like 1": classify.UNKNOWN, "": classify.UNKNOWN, "TP53\n": classify.UNKNOWN}
+        labels = classify.classify_ids(ids.keys())
+        self.assertEqual(labels.to_dict(), ids)
+        self.assertEqual(len(classify.classify_ids([])), 0)
+
+    def test_split_by_type(self):
+        groups = classify.split_by_type(["7157", "TP53", "DIP-1N", "672", "CHEBI:15377"])
+        self.assertEqual(groups, {"Entrez": ["7157", "672"], "Symbol": ["TP53"], "DIP": ["DIP-1N"],
+                                  "CHEBI": ["CHEBI:15377"]})
+
+    def test_gene_names_grouped_with_symbols(self):
+        groups = classify.split_by_type(["TP53", "Cyclin dependent kinase 6", "TP53\n"])
+        self.assertEqual(groups, {"Symbol": ["TP53", "Cyclin dependent kinase 6"], classify.UNKNOWN: ["TP53\n"]})
+
+    def test_accession_shaped_symbols_retried(self):
+        nodes = {"B3GAT1", "P2RY12", "P04637", "Cyclin dependent kinase 6"}
+        labels = classify.classify_ids(nodes)
+        self.assertEqual(set(labels[labels == "Uniprot"].index), {"B3GAT1", "P2RY12", "P04637"})
+        uniprot_df = pd.DataFrame({"from": ["P04637"], "to": ["P04637"]})
+        symbols = {"B3GAT1": "B3GAT1", "P2RY12": "P2RY12", "Cyclin dependent kinase 6": "CDK6"}
+        def fake_hgnc(ids, from_id, to_id):
+            return {i: symbols[i] for i in ids if i in symbols}, {i for i in ids if i not in symbols}
+        with mock.patch.object(mapper.uni, "perform_uniprot_query",
+                               return_value=(uniprot_df, ["B3GAT1", "P2RY12"])), \
+                mock.patch.object(mapper.hgnc, "perform_hgnc_query", side_effect=fake_hgnc) as hgnc_query:
+            node_map, failed = mapper.update_mixed_nodes(nodes, keep="all")
+        self.assertEqual(dict(node_map), {"P04637": "P04637", "B3GAT1": "B3GAT1", "P2RY12": "P2RY12",
+                                          "Cyclin dependent kinase 6": "CDK6"})
+        self.assertEqual(failed, [])
+        self.assertEqual(sorted(hgnc_query.call_args_list[-1][0][0]), ["B3GAT1", "P2RY12"])
+
+    def test_can_convert(self):
+        self.assertTrue(mapper.can_convert("Symbol", "Entrez"))
+        self.assertFalse(mapper.can_convert("Symbol", "Uniprot"))
+        self.assertTrue(mapper.can_convert("DIP", "Entrez"))
+        self.assertTrue(mapper.can_convert("Refseq", "Uniprot"))
+        self.assertFalse(mapper.can_convert("CHEBI", "Entrez"))
+
+    def test_mixed_nodes_against_mock_services(self):
+        id_types = ["Symbol", "Entrez", "Ensembl", "Refseq"]
+        nodes = {node for id_type in id_types for node in input_ids(id_type, 50)} | {"DIP-1N", "CHEBI:15377"}
+        with MockServices(n_genes=50) as services, use_services(services.urls), bench.isolated(1000):
+            node_map, failed = mapper.update_mixed_nodes(nodes)
+            for id_type in id_types:
+                expected = mapper.update_nodes(set(input_ids(id_type, 50)), id_type)[0]
+                self.assertEqual({node: node_map[node] for node in expected}, expected, id_type)
+            self.assertEqual(len(node_map) + len(failed), len(nodes))
+            self.assertIn("CHEBI:15377", failed)
+            self.assertEqual(node_map["DIP-1N"], "DIP-1N")
+            converted, failed = mapper.convert_mixed_node_ids(nodes, "Entrez")
+            expected = mapper.convert_node_ids(set(input_ids("Ensembl", 50)), "Ensembl", "Entrez")[0]
+            self.assertEqual({node: converted[node] for node in expected}, expected)
+            # nodes that are already Entrez ids are updated
+            self.assertEqual(converted["100001"], node_map["100001"])
+            self.assertIn("CHEBI:15377", failed)
+            self.assertEqual(len(converted) + len(failed), len(nodes))
+
+
+if __name__ == '__main__':
+    unittest.main()
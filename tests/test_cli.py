@@ -0,0 +1,62 @@
+from gene_mapper import cli
+from gene_mapper import query_ensembl as ensg
+import unittest
+from unittest import mock
+import os
+import tempfile
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        self.in_path = os.path.join(self.dir_path, "ids.txt")
+        self.out_path = os.path.join(self.dir_path, "map.tsv")
+        self.failed_path = os.path.join(self.dir_path, "failed.txt")
+        with open(self.in_path, "w") as f:
+            f.write("DIP-1N\nCDK6\n\nDIP-2N\nDIP-1N\n")
+
+    def tearDown(self):
+        for f in os.listdir(self.dir_path):
+            os.remove(os.path.join(self.dir_path, f))
+        os.rmdir(self.dir_path)
+
+    def test_update(self):
+        code = cli.main(["update", "--id-type", "DIP", "-i", self.in_path, "-o", self.out_path,
+                         "--failed", self.failed_path, "--chunk-size", "2"])
+        self.assertEqual(code, 0)
+        with open(self.out_path) as f:
+            self.assertEqual(f.read().splitlines(), ["from\tto", "DIP-1N\tDIP-1N", "DIP-2N\tDIP-2N"])
+        with open(self.failed_path) as f:
+            self.assertEqual(f.read().splitlines(), ["CDK6"])
+
+    def test_replay_archive(self):
+        archive_path = os.path.join(self.dir_path, "exchanges.sqlite")
+        with mock.patch.object(cli.replay, "_archive", None):
+            cli.main(["update", "--id-type", "DIP", "-i", self.in_path, "-o", self.out_path, "--replay", archive_path])
+            self.assertEqual(cli.replay.get_archive().mode, "replay")
+            cli.replay.get_archive().close()
+        with self.assertRaises(SystemExit), mock.patch("sys.stderr"):
+            cli.parse_args(["update", "--id-type", "DIP", "--record", archive_path, "--replay", archive_path])
+
+    def test_mapping_function(self):
+        args = cli.parse_args(["update", "--id-type", "auto", "--keep", "all"])
+        self.assertEqual(cli.mapping_function(args), ("update_mixed_nodes", (), {"keep": "all"}))
+        args = cli.parse_args(["convert", "--from", "Uniprot", "--to", "Entrez"])
+        self.assertEqual(cli.mapping_function(args), ("convert_node_ids", ("Uniprot", "Entrez"), {"planner": None}))
+
+    def test_read_ids(self):
+        self.assertEqual(list(cli.read_ids([self.in_path], chunk_size=2)), [["DIP-1N", "CDK6"], ["DIP-2N"]])
+
+    def test_configure_services(self):
+        with mock.patch.multiple(ensg, MAX_WORKERS=4, BATCH_SIZE=100), \
+                mock.patch.multiple(cli.query_mygene, MAX_WORKERS=4, BATCH_SIZE=1000), \
+                mock.patch.multiple(cli.uni, MAX_CONCURRENT_JOBS=4, CHUNK_SIZE=10000, STREAM_RESULTS=False), \
+                mock.patch.object(cli.hgnc, "MAX_WORKERS", 8):
+            cli.configure_services(workers=16, batch_size=50, uniprot_stream=True)
+            self.assertEqual((ensg.MAX_WORKERS, ensg.BATCH_SIZE), (16, 50))
+            self.assertEqual((cli.uni.MAX_CONCURRENT_JOBS, cli.hgnc.MAX_WORKERS), (16, 16))
+            self.assertTrue(cli.uni.STREAM_RESULTS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+from gene_mapper import ensembl_history
+from gene_mapper import query_ensembl as ensg
+import unittest
+import gzip
+import os
+import tempfile
+
+# old_stable_id, old_version, new_stable_id, new_version, mapping_session_id, type, score
+STABLE_ID_EVENTS = [
+    "ENSG01\t1\tENSG01\t2\t10\tgene\t1",
+    "ENSG01\t2\tENSG02\t1\t11\tgene\t0.9",
+    "ENSG02\t1\tENSG03\t1\t12\tgene\t1",
+    "ENSG03\t1\tENSG03\t2\t13\tgene\t1",
+    "ENSG04\t1\tENSG05\t1\t12\tgene\t0.4",
+    "ENSG04\t1\tENSG06\t1\t12\tgene\t0.8",
+    "ENSG07\t1\t\\N\t0\t12\tgene\t0",
+    "ENSP01\t1\tENSP02\t1\t12\ttranslation\t1",
+    "ENST01\t1\tENST02\t1\t12\ttranscript\t1",
+]
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir_path, "stable_id_event.txt.gz")
+        with gzip.open(self.path, "wt") as f:
+            f.write("\n".join(STABLE_ID_EVENTS) + "\n")
+        self.history = ensembl_history.EnsemblHistory.from_files(self.path)
+
+    def tearDown(self):
+        ensembl_history.set_history(None)
+        for f in os.listdir(self.dir_path):
+            os.remove(os.path.join(self.dir_path, f))
+        os.rmdir(self.dir_path)
+
+    def test_chained_retirements(self):
+        self.assertEqual(self.history.latest["ENSG01"], "ENSG03")
+        self.assertEqual(self.history.latest["ENSG02"], "ENSG03")
+        self.assertEqual(self.history.latest["ENSG03"], "ENSG03")
+
+    def test_split_and_retired(self):
+        self.assertEqual(self.history.latest["ENSG04"], "ENSG06")
+        self.assertEqual(self.history.latest["ENSG07"], "ENSG07")
+
+    def test_types(self):
+        self.assertEqual(self.history.latest["ENSP01"], "ENSP02")
+        self.assertNotIn("ENST01", self.history.latest)
+
+    def test_id_history_converter(self):
+        path = os.path.join(self.dir_path, "history.csv")
+        with open(path, "w") as f:
+            f.write("Old stable ID, New stable ID, Release, Mapping score\n")
+            f.write("ENSG10.1, ENSG11.1, 100, 0.95\nENSG11.1, <retired>, 101, 0\n")
+        history = ensembl_history.EnsemblHistory.from_files(path)
+        self.assertEqual(history.latest["ENSG10"], "ENSG11")
+
+    def test_offline_update(self):
+        ensembl_history.set_history(self.history)
+        results_df, missing = ensg.get_latest_ensembl_id(["ENSG01.2", "ENSP01", "ENSG99"])
+        self.assertEqual(dict(zip(results_df["from"], results_df["to"])), {"ENSG01.2": "ENSG03", "ENSP01": "ENSP02"})
+        self.assertEqual(missing, ["ENSG99"])
+
+
+if __name__ == '__main__':
+    unittest.main()
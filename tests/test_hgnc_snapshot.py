@@ -0,0 +1,58 @@
+from gene_mapper import hgnc_snapshot
+from gene_mapper import query_hgnc as hgnc
+import unittest
+import json
+import os
+import tempfile
+
+HGNC_TSV = """hgnc_id\tsymbol\tname\tstatus\talias_symbol\tprev_symbol\tentrez_id
+HGNC:3477\tETF1\teukaryotic translation termination factor 1\tApproved\tERF1|SUP45L1\tERF\t2107
+HGNC:1777\tCDK6\tcyclin dependent kinase 6\tApproved\tPLSTIRE\t\t1021
+HGNC:30398\tINAVA\tinnate immunity activator\tApproved\t\tC11orf1\t55765
+HGNC:99999\tOLD1\twithdrawn gene\tEntry Withdrawn\t\t\t
+"""
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        self.tsv = os.path.join(self.dir_path, "hgnc_complete_set.txt")
+        with open(self.tsv, "w") as f:
+            f.write(HGNC_TSV)
+        self.snapshot = hgnc_snapshot.HGNCSnapshot.from_file(self.tsv)
+
+    def tearDown(self):
+        hgnc_snapshot.set_snapshot(None)
+        for f in os.listdir(self.dir_path):
+            os.remove(os.path.join(self.dir_path, f))
+        os.rmdir(self.dir_path)
+
+    def test_indexes(self):
+        self.assertEqual(self.snapshot.approved, frozenset(["ETF1", "CDK6", "INAVA"]))
+        self.assertEqual(self.snapshot.previous["C11orf1"], {"INAVA"})
+        self.assertEqual(self.snapshot.alias["ERF1"], {"ETF1"})
+        self.assertEqual(self.snapshot.entrez["CDK6"], "1021")
+
+    def test_json_snapshot(self):
+        path = os.path.join(self.dir_path, "hgnc_complete_set.json")
+        docs = [{"symbol": "ETF1", "status": "Approved", "alias_symbol": ["ERF1"], "entrez_id": "2107"}]
+        with open(path, "w") as f:
+            json.dump({"response": {"docs": docs}}, f)
+        snapshot = hgnc_snapshot.HGNCSnapshot.from_file(path)
+        self.assertEqual(snapshot.query_alias_symbols(["ERF1", "X"]), ({"ERF1": "ETF1"}, {"X"}))
+
+    def test_offline_hgnc_query(self):
+        hgnc_snapshot.set_snapshot(self.snapshot)
+        ids = ["CDK6", "ERF1", "C11orf1", "Cyclin dependent kinase 6", "PARTICIPANT"]
+        id_map, missing = hgnc.perform_hgnc_query(ids, "Symbol", "Symbol")
+        self.assertEqual(id_map, {"CDK6": "CDK6", "ERF1": "ETF1", "C11orf1": "INAVA",
+                                  "Cyclin dependent kinase 6": "CDK6"})
+        self.assertEqual(missing, {"PARTICIPANT"})
+
+    def test_offline_entrez(self):
+        hgnc_snapshot.set_snapshot(self.snapshot)
+        self.assertEqual(hgnc.query_other_id(["ETF1", "OLD1"], "Entrez"), ({"ETF1": "2107"}, {"OLD1"}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+from gene_mapper import incremental
+from gene_mapper import mapper
+from gene_mapper import cli
+from gene_mapper.Timer import Timer
+from benchmarks import run_benchmarks as bench
+from benchmarks.mock_services import MockServices, use_services, input_ids
+import unittest
+import os
+import tempfile
+import time
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "manifest.json.gz")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_only_new_nodes_are_queried(self):
+        node_map, failed, manifest = incremental.update_nodes_incremental({"DIP-1N", "DIP-2N", "x"}, "DIP")
+        self.assertEqual((node_map, failed), ({"DIP-1N": "DIP-1N", "DIP-2N": "DIP-2N"}, ["x"]))
+        manifest.save(self.path)
+        timer = Timer()
+        node_map, failed, manifest = incremental.update_nodes_incremental(
+            {"DIP-1N", "DIP-3N", "x", "y"}, "DIP", manifest=incremental.load_manifest(self.path), keep="all",
+            timer=timer)
+        self.assertEqual(timer.spans[0].attributes["reused"], 2)
+        self.assertEqual(timer.spans[0].attributes["queried"], 2)
+        self.assertEqual(set(failed), {"x", "y"})
+        self.assertEqual(dict(manifest.mapping), {"DIP-1N": "DIP-1N", "DIP-3N": "DIP-3N"})
+        self.assertEqual(set(node_map), {"DIP-1N", "DIP-3N", "x", "y"})
+        timer = Timer()
+        _, failed, _ = incremental.update_nodes_incremental({"x"}, "DIP", manifest=manifest, retry_failed=True,
+                                                            timer=timer)
+        self.assertEqual(timer.spans[0].attributes["queried"], 1)
+        self.assertEqual(failed, ["x"])
+
+    def test_manifest_checks(self):
+        manifest = incremental.Manifest("update_nodes", ["DIP"], {"DIP-1N": "DIP-1N"}, created=time.time() - 100)
+        with self.assertRaises(ValueError):
+            incremental.update_nodes_incremental({"DIP-1N"}, "Symbol", manifest=manifest)
+        timer = Timer()
+        incremental.update_nodes_incremental({"DIP-1N"}, "DIP", manifest=manifest, max_age=10, timer=timer)
+        self.assertEqual(timer.spans[0].attributes["queried"], 1)
+        self.assertIsNone(incremental.load_manifest(self.path))
+
+    def test_same_result_as_full_run(self):
+        nodes = set(input_ids("Ensembl", 100))
+        with MockServices(n_genes=100) as services, use_services(services.urls), bench.isolated(1000):
+            _, _, manifest = incremental.update_nodes_incremental(set(list(nodes)[:80]), "Ensembl")
+            services.reset()
+            node_map, failed, manifest = incremental.update_nodes_incremental(nodes, "Ensembl", manifest=manifest)
+            self.assertEqual(services.stats()["ensembl"]["requests"], 1)
+            expected_map, expected_failed = mapper.update_nodes(nodes, "Ensembl")
+            self.assertEqual(node_map, expected_map)
+            self.assertEqual(sorted(failed), sorted(expected_failed))
+            self.assertEqual(len(manifest), 100)
+
+    def test_cli_manifest(self):
+        in_path = os.path.join(self.tmp.name, "ids.txt")
+        out_path = os.path.join(self.tmp.name, "map.tsv")
+        with open(in_path, "w") as f:
+            f.write("DIP-1N\nCDK6\nDIP-2N\n")
+        for _ in range(2):
+            cli.main(["update", "--id-type", "DIP", "-i", in_path, "-o", out_path, "--manifest", self.path,
+                      "--chunk-size", "2"])
+        manifest = incremental.load_manifest(self.path)
+        self.assertEqual((len(manifest.mapping), manifest.failed), (2, ["CDK6"]))
+        with open(out_path) as f:
+            self.assertEqual(sorted(f.read().splitlines()[1:]), ["DIP-1N\tDIP-1N", "DIP-2N\tDIP-2N"])
+
+
+if __name__ == '__main__':
+    unittest.main()
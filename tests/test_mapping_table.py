@@ -0,0 +1,62 @@
+from gene_mapper.mapping_table import MappingTable
+import unittest
+import pickle
+import numpy as np
+import pandas as pd
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.mapping = {"a": "A", "b": "B", "c": np.nan, "d": "A"}
+        self.table = MappingTable.from_dict(self.mapping)
+
+    def test_dict_view(self):
+        self.assertEqual(self.table, self.mapping)
+        self.assertEqual(dict(self.table.items()), self.mapping)
+        self.assertEqual(list(self.table), ["a", "b", "c", "d"])
+        self.assertEqual(self.table["d"], "A")
+        self.assertTrue(np.isnan(self.table["c"]))
+        self.assertIn("b", self.table)
+        self.assertNotIn("e", self.table)
+        with self.assertRaises(KeyError):
+            self.table["e"]
+        self.assertEqual(self.table.get("e", "E"), "E")
+        self.assertEqual({**self.table}, self.mapping)
+        self.assertEqual(len(self.table.categories), 2)
+
+    def test_repeated_keys_keep_last(self):
+        table = MappingTable(["a", "b", "a"], ["A", "B", "Z"])
+        self.assertEqual(table, {"a": "Z", "b": "B"})
+        self.assertEqual(MappingTable.concat([self.table, {"a": "Z"}])["a"], "Z")
+        self.assertEqual(MappingTable.concat([]), {})
+
+    def test_apply(self):
+        series = pd.Series(["d", "x", "c", "a"], index=[3, 2, 1, 0], name="source")
+        mapped = self.table.apply(series, default=None)
+        self.assertEqual(mapped.tolist(), ["A", None, None, "A"])
+        self.assertEqual((mapped.index.tolist(), mapped.name), ([3, 2, 1, 0], "source"))
+        self.assertEqual(self.table.apply(np.array(["x", "b"]), keep_unmapped=True).tolist(), ["x", "B"])
+        self.assertEqual(MappingTable().apply(["a"], default=None).tolist(), [None])
+
+    def test_conversions(self):
+        self.assertEqual(MappingTable(["1", "2"], [7157, None]).astype(str), {"1": "7157", "2": np.nan})
+        frame = self.table.to_frame()
+        self.assertEqual(frame["from"].tolist(), ["a", "b", "c", "d"])
+        self.assertIsInstance(frame["to"].dtype, pd.CategoricalDtype)
+        self.assertEqual(MappingTable.from_frame(frame), self.mapping)
+        self.assertEqual(pickle.loads(pickle.dumps(self.table)), self.mapping)
+
+    def test_to_arrow(self):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        arrow = self.table.to_arrow()
+        self.assertEqual(arrow.column("from").to_pylist(), ["a", "b", "c", "d"])
+        self.assertEqual(arrow.column("to").to_pylist(), ["A", "B", None, "A"])
+        indices = arrow.column("to").chunk(0).indices
+        self.assertEqual(indices.buffers()[1].address, self.table.codes.ctypes.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+from gene_mapper import name_index
+from gene_mapper import query_hgnc as hgnc
+import unittest
+from unittest import mock
+import pandas as pd
+import os
+import tempfile
+
+HGNC_TSV = """hgnc_id\tsymbol\tname\tstatus\talias_name\tprev_name
+HGNC:1777\tCDK6\tcyclin dependent kinase 6\tApproved\t\tcyclin-dependent kinase 6
+HGNC:6016\tIL5RA\tinterleukin 5 receptor subunit alpha\tApproved\t\tinterleukin 5 receptor, alpha
+HGNC:8808\tPDHB\tpyruvate dehydrogenase E1 subunit beta\tApproved\t\tpyruvate dehydrogenase (lipoamide) beta
+HGNC:11486\tSUPT4H1\tSPT4 homolog, DSIF elongation factor subunit\tApproved\tsuppressor of Ty 4 homolog 1\t
+HGNC:2545\tCTSL\tcathepsin L\tApproved\t\t
+HGNC:2546\tCTSV\tcathepsin V\tApproved\tcathepsin L2\t
+HGNC:99999\tOLD1\tcyclin withdrawn gene\tEntry Withdrawn\t\t
+"""
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        self.tsv = os.path.join(self.dir_path, "hgnc_complete_set.txt")
+        with open(self.tsv, "w") as f:
+            f.write(HGNC_TSV)
+        self.index = name_index.load_index(self.tsv)
+
+    def tearDown(self):
+        name_index.set_index(None)
+        for f in os.listdir(self.dir_path):
+            os.remove(os.path.join(self.dir_path, f))
+        os.rmdir(self.dir_path)
+
+    def test_normalize(self):
+        self.assertEqual(name_index.normalize("Interleukin-5 receptor, α (IL5R)"),
+                         ["interleukin", "5", "receptor", "alpha", "il5r"])
+
+    def test_exact_names(self):
+        self.assertEqual(len(self.index), 11)
+        self.assertEqual(self.index.search("Cyclin-dependent kinase 6"), [("CDK6", 1.0)])
+        self.assertEqual(self.index.search("Interleukin 5 receptor, alpha"), [("IL5RA", 1.0)])
+        self.assertEqual(self.index.search("Suppressor of Ty 4 homolog 1"), [("SUPT4H1", 1.0)])
+
+    def test_ranked_names(self):
+        symbol, score = self.index.search("pyruvate dehydrogenase beta subunit E1")[0]
+        self.assertEqual(symbol, "PDHB")
+        self.assertLess(score, 1)
+        self.assertEqual(self.index.search("cyclin dependent kinase"), [])
+        self.assertEqual(self.index.search("cathepsin"), [])
+        self.assertEqual(self.index.search("withdrawn gene"), [])
+        self.assertEqual(self.index.search("PARTICIPANT"), [])
+
+    def test_shared_names_unmatched(self):
+        index = name_index.NameIndex([("ZZZ9", "shared kinase", "alias"), ("AAA1", "shared kinase", "alias"),
+                                      ("BBB2", "other kinase", "approved"), ("CCC3", "other kinase", "alias")])
+        self.assertEqual(index.search("Shared kinase"), [("AAA1", 1.0), ("ZZZ9", 1.0)])
+        self.assertEqual(index.search_gene_names(["shared kinase", "other kinase"]),
+                         ({"other kinase": "BBB2"}, ["shared kinase"]))
+
+    def test_mygene_fallback(self):
+        ids = ["Cyclin dependent kinase 6", "Keratin 14"]
+        name_df = pd.DataFrame({"symbol": ["KRT14", "KRT14P1"], "_score": [20.0, 3.0]},
+                               index=["Keratin 14", "Keratin 14"])
+        with mock.patch.object(hgnc, "query_mygene", return_value=(name_df, [])) as query:
+            name_map, missing = hgnc.search_gene_names(ids)
+        query.assert_called_once_with(["Keratin 14"], scopes="name,other_names", fields="symbol")
+        self.assertEqual(name_map, {"Cyclin dependent kinase 6": "CDK6", "Keratin 14": "KRT14"})
+        self.assertEqual(missing, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
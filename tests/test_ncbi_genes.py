@@ -0,0 +1,94 @@
+from gene_mapper import ncbi_genes
+from gene_mapper import query_mygene
+from gene_mapper import mapper
+import unittest
+from unittest import mock
+import gzip
+import os
+import tempfile
+import pandas as pd
+
+GENE_INFO = [
+    "#tax_id\tGeneID\tSymbol\tLocusTag\tSynonyms\tdbXrefs\tchromosome",
+    "9606\t672\tBRCA1\t-\tBRCAI|BRCC1\tHGNC:HGNC:1100\t17",
+    "9606\t7157\tTP53\t-\tP53\tHGNC:HGNC:11998\t17",
+    "9606\t100000001\tNEWGENE\t-\t-\t-\t1",
+    "10090\t22059\tTrp53\t-\t-\t-\t11",
+]
+# tax_id, GeneID (current, '-' if withdrawn), Discontinued_GeneID, Discontinued_Symbol, Discontinue_Date
+GENE_HISTORY = [
+    "#tax_id\tGeneID\tDiscontinued_GeneID\tDiscontinued_Symbol\tDiscontinue_Date",
+    "9606\t7157\t1001\tOLDTP53\t20050101",
+    "9606\t1001\t1000\tOLDERTP53\t20040101",
+    "9606\t-\t2000\tWITHDRAWN\t20100101",
+    "9606\t100000001\t3000\tMERGED\t20200101",
+    "10090\t22059\t4000\tOldTrp53\t20100101",
+]
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        self.info_path = os.path.join(self.dir_path, "gene_info.gz")
+        self.history_path = os.path.join(self.dir_path, "gene_history.gz")
+        for path, lines in [(self.info_path, GENE_INFO), (self.history_path, GENE_HISTORY)]:
+            with gzip.open(path, "wt") as f:
+                f.write("\n".join(lines) + "\n")
+        self.genes = ncbi_genes.NCBIGenes.from_files(self.info_path, self.history_path, chunksize=2)
+
+    def tearDown(self):
+        ncbi_genes.set_genes(None)
+        for f in os.listdir(self.dir_path):
+            os.remove(os.path.join(self.dir_path, f))
+        os.rmdir(self.dir_path)
+
+    def test_arrays(self):
+        self.assertEqual(list(self.genes.gene_ids), [672, 7157, 100000001])
+        self.assertEqual(list(self.genes.symbols[self.genes.symbol_codes]), ["BRCA1", "TP53", "NEWGENE"])
+        self.assertEqual(list(self.genes.old_ids), [1000, 1001, 2000, 3000])
+
+    def test_current_ids(self):
+        current = self.genes.current_ids(["7157", 672, "1000", "1001", "2000", "3000", "4000", "BRCA1", "12.5"])
+        self.assertEqual(list(current), [7157, 672, 7157, 7157, -1, 100000001, -1, -1, -1])
+
+    def test_same_form_as_mygene(self):
+        ncbi_genes.set_genes(self.genes)
+        with mock.patch.object(query_mygene, "run_batches") as run_batches:
+            results, failed = query_mygene.get_mygene(["1000", "672", "2000"], "symbol")
+        run_batches.assert_not_called()
+        self.assertEqual(list(results.columns), ["from", "to"])
+        self.assertEqual(results["to"].to_dict(), {"1000": "TP53", "672": "BRCA1"})
+        self.assertEqual(failed, ["2000"])
+
+    def test_mapper_offline(self):
+        ncbi_genes.set_genes(self.genes)
+        with mock.patch.object(query_mygene, "run_batches") as run_batches:
+            updated, failed = mapper.update_nodes({"1000", "672", "2000"}, "Entrez", keep="updated")
+            symbols, missing = mapper.convert_node_ids({"3000", "7157"}, "Entrez", "Symbol")
+        run_batches.assert_not_called()
+        self.assertEqual(dict(updated), {"1000": "7157"})
+        self.assertEqual(failed, ["2000"])
+        self.assertEqual(dict(symbols), {"3000": "NEWGENE", "7157": "TP53"})
+
+    def test_symbol_ids(self):
+        genes = ncbi_genes.NCBIGenes(pd.DataFrame({"GeneID": [1, 2, 3, 4], "Symbol": ["A", "B", "B", None]}))
+        results, missing = genes.symbol_ids(["A", "B", "C"])
+        self.assertEqual(results["_id"].to_dict(), {"A": "1"})
+        self.assertEqual(missing, ["B", "C"])
+        ncbi_genes.set_genes(self.genes)
+        with mock.patch.object(query_mygene, "run_batches") as run_batches:
+            entrez, failed = mapper.convert_node_ids({"TP53"}, "Symbol", "Entrez")
+        run_batches.assert_not_called()
+        self.assertEqual(entrez["TP53"], "7157")
+
+    def test_other_fields_use_mygene(self):
+        ncbi_genes.set_genes(self.genes)
+        ensembl = pd.DataFrame({"query": ["7157"], "ensembl.gene": ["ENSG00000141510"]}).set_index("query")
+        with mock.patch.object(query_mygene, "run_batches", return_value=[ensembl]) as run_batches:
+            results, failed = query_mygene.get_mygene(["7157"], "ensembl.gene")
+        run_batches.assert_called_once()
+        self.assertEqual(results["to"].to_dict(), {"7157": "ENSG00000141510"})
+
+
+if __name__ == '__main__':
+    unittest.main()
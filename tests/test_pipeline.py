@@ -0,0 +1,49 @@
+from gene_mapper import pipeline
+import unittest
+import pandas as pd
+import os
+import tempfile
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        self.in_path = os.path.join(self.dir_path, "edges.tsv")
+        self.out_path = os.path.join(self.dir_path, "edges_out.tsv")
+        with open(self.in_path, "w") as f:
+            f.write("a\tb\t0.5\nb\tc\t0.1\nc\td\t0.9\nDIP-1N\tDIP-2N\t1\n")
+
+    def tearDown(self):
+        for f in os.listdir(self.dir_path):
+            os.remove(os.path.join(self.dir_path, f))
+        os.rmdir(self.dir_path)
+
+    def test_collect_nodes(self):
+        nodes = pipeline.collect_nodes(self.in_path, chunksize=2)
+        self.assertEqual(nodes, {"a", "b", "c", "d", "DIP-1N", "DIP-2N"})
+
+    def test_remap_drop_unmapped(self):
+        n = pipeline.remap_edges(self.in_path, self.out_path, {"a": "A", "b": "B", "c": "C"}, chunksize=2)
+        out = pd.read_csv(self.out_path, sep="\t", header=None, dtype=str)
+        self.assertEqual(n, 2)
+        self.assertEqual(out.values.tolist(), [["A", "B", "0.5"], ["B", "C", "0.1"]])
+
+    def test_remap_keep_unmapped_with_header(self):
+        with open(self.in_path, "w") as f:
+            f.write("source\ttarget\na\tb\nc\td\n")
+        pipeline.remap_edges(self.in_path, self.out_path, {"a": "A"}, columns=("source", "target"), header=0,
+                             drop_unmapped=False)
+        out = pd.read_csv(self.out_path, sep="\t", dtype=str)
+        self.assertEqual(list(out.columns), ["source", "target"])
+        self.assertEqual(out.values.tolist(), [["A", "b"], ["c", "d"]])
+
+    def test_update_edge_file(self):
+        n, failed = pipeline.update_edge_file(self.in_path, self.out_path, "DIP", chunksize=3)
+        out = pd.read_csv(self.out_path, sep="\t", header=None, dtype=str)
+        self.assertEqual(n, 1)
+        self.assertEqual(out.values.tolist(), [["DIP-1N", "DIP-2N", "1"]])
+        self.assertEqual(set(failed), {"a", "b", "c", "d"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+from gene_mapper import planner
+from gene_mapper import cache
+import unittest
+import os
+import tempfile
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+        def edge(name, mapping):
+            def run(ids):
+                self.calls.append((name, list(ids)))
+                return {i: mapping[i] for i in ids if i in mapping}
+            return run
+        self.edges = {("uniprot", "Uniprot", "Entrez"): edge("direct", {"P1": "1"}),
+                      ("uniprot", "Uniprot", "Symbol"): edge("to_symbol", {"P1": "A", "P2": "B", "P3": "C"}),
+                      ("mygene", "Symbol", "Entrez"): edge("symbol_to_entrez", {"A": "1", "B": "2"})}
+        self.costs = planner.CostModel()
+
+    def test_paths(self):
+        conversion = planner.ConversionPlanner(self.edges, self.costs)
+        paths = conversion.paths("Uniprot", "Entrez")
+        self.assertEqual(len(paths), 2)
+        self.assertEqual(conversion.paths("Entrez", "Uniprot"), [])
+
+    def test_cheapest_path_first_with_fallback(self):
+        self.costs.measurements["uniprot:Uniprot:Entrez"] = (1.0, 0.5)
+        conversion = planner.ConversionPlanner(self.edges, self.costs)
+        converted, missing = conversion.convert(["P1", "P2", "P3"], "Uniprot", "Entrez")
+        self.assertEqual([c[0] for c in self.calls], ["to_symbol", "symbol_to_entrez", "direct"])
+        self.assertEqual(self.calls[2][1], ["P3"])
+        self.assertEqual(converted, {"P1": "1", "P2": "2"})
+        self.assertEqual(missing, ["P3"])
+
+    def test_fallback_only_remaining(self):
+        conversion = planner.ConversionPlanner(self.edges, self.costs)
+        converted, missing = conversion.convert(["P1", "P2", "P3"], "Uniprot", "Entrez")
+        self.assertEqual(self.calls[0], ("direct", ["P1", "P2", "P3"]))
+        self.assertEqual(self.calls[1], ("to_symbol", ["P2", "P3"]))
+        self.assertEqual(converted, {"P1": "1", "P2": "2"})
+
+    def test_costs_measured_and_saved(self):
+        path = os.path.join(tempfile.mkdtemp(), planner.COSTS_FILE)
+        conversion = planner.ConversionPlanner(self.edges, planner.CostModel(path))
+        conversion.convert(["P1", "P2", "P3"], "Uniprot", "Entrez")
+        reloaded = planner.CostModel(path)
+        prior_hit_rate = planner.PRIOR_COSTS["uniprot"][1]
+        self.assertLess(reloaded.estimate(("uniprot", "Uniprot", "Entrez"))[1], prior_hit_rate)
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+
+    def test_cached_ids_not_measured(self):
+        def cached_edge(ids):
+            hits, missing = cache.lookup("uniprot", "UniProtKB_AC-ID", "Entrez", ids)
+            return {**hits, **{i: "2" for i in missing}}
+        edge = ("uniprot", "Uniprot", "Entrez")
+        conversion = planner.ConversionPlanner({edge: cached_edge}, self.costs)
+        saved = cache.get_cache()
+        cache.set_cache(cache.MappingCache())
+        try:
+            cache.store("uniprot", "UniProtKB_AC-ID", "Entrez", {"P1": "1", "P2": "2"})
+            conversion.convert(["P1", "P2"], "Uniprot", "Entrez")
+            self.assertEqual(self.costs.measurements, {})
+            conversion.convert(["P1", "P3"], "Uniprot", "Entrez")
+            self.assertIn(self.costs.key(edge), self.costs.measurements)
+        finally:
+            cache.set_cache(saved)
+
+    def test_no_path(self):
+        with self.assertRaises(ValueError):
+            planner.ConversionPlanner(self.edges, self.costs).convert(["1"], "Entrez", "Uniprot")
+
+
+if __name__ == '__main__':
+    unittest.main()
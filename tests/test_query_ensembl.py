@@ -1,7 +1,12 @@
 import gene_mapper as gmap
+from gene_mapper import query_ensembl as ensg
+from gene_mapper import rate_limit
 import unittest
+from unittest import mock
 import pandas as pd
 import os
+import json
+import time
 
 
 class Test(unittest.TestCase):
@@ -70,6 +75,38 @@ class Test(unittest.TestCase):
     
     def test_previous_versus_alias(self):
         pass
+
+    def test_archive_retry_after(self):
+        unavailable = mock.Mock(status_code=503, headers={"Retry-After": "0.5"})
+        ok = mock.Mock(status_code=200, headers={})
+        ok.json.return_value = [{"id": "ENSG1", "is_current": "1", "latest": "ENSG1.2"},
+                                {"id": "ENSG2", "is_current": "", "latest": "ENSG3.1"}]
+        with mock.patch.object(ensg.session, "post", side_effect=[unavailable, ok]), \
+                mock.patch.object(ensg.time, "sleep") as sleep:
+            results_df, missing = ensg.get_latest_ensembl_id(["ENSG1", "ENSG2", "ENSG4"])
+        sleep.assert_called_once_with(0.5)
+        self.assertEqual(dict(zip(results_df["from"], results_df["to"])), {"ENSG1": "ENSG1", "ENSG2": "ENSG3"})
+        self.assertEqual(missing, ["ENSG4"])
+
+    def test_concurrent_batches(self):
+        def fake_post(url, headers, data):
+            ids = json.loads(data)["id"]
+            response = mock.Mock(status_code=200, headers={})
+            response.json.return_value = [{"id": i, "is_current": "1", "latest": i + ".1"} for i in ids]
+            return response
+        ids = ["ENSG" + str(i) for i in range(10)]
+        with mock.patch.object(ensg.session, "post", side_effect=fake_post) as post:
+            results_df, missing = ensg.get_latest_ensembl_id(ids, batch_size=3, workers=3)
+        self.assertEqual(post.call_count, 4)
+        self.assertEqual(list(results_df["from"]), ids)
+        self.assertEqual(missing, [])
+
+    def test_token_bucket(self):
+        bucket = rate_limit.TokenBucket(rate=100, capacity=2)
+        start = time.monotonic()
+        for _ in range(6):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.035)
     
 
 if __name__ == '__main__':
@@ -1,7 +1,12 @@
 import gene_mapper as gmap
+from gene_mapper import query_hgnc as hgnc
 import unittest
+from unittest import mock
 import pandas as pd
 import os
+import json
+import time
+import tempfile
 
 
 class Test(unittest.TestCase):
@@ -70,6 +75,36 @@ class Test(unittest.TestCase):
     
     def test_previous_versus_alias(self):
         pass
+
+    def test_concurrent_lookups_keep_order(self):
+        def fake_fetch(path):
+            symbol = path.split("/")[-1]
+            time.sleep(0.01 * (symbol == "A"))
+            return [{"symbol": symbol.lower(), "status": "Approved"}]
+        approved_df = pd.DataFrame({"symbol": ["a", "b", "c"]})
+        with mock.patch.object(hgnc, "fetch_docs", side_effect=fake_fetch):
+            results = hgnc.fetch_symbol_docs(["A", "B", "C"], "/search/prev_symbol/", workers=3)
+            previous_map, missing = hgnc.query_previous_symbols(["A", "B", "C", "D"], approved_df, workers=2)
+        self.assertEqual([r[0] for r in results], ["A", "B", "C"])
+        self.assertEqual(previous_map, {"A": "a", "B": "b", "C": "c"})
+        self.assertEqual(missing, {"D"})
+
+    def test_approved_symbols_revalidated(self):
+        content = json.dumps({"response": {"docs": [{"symbol": "CDK6"}, {"symbol": "ETF1"}]}}).encode()
+        conn = mock.Mock()
+        conn.request.side_effect = [({"status": "200", "etag": '"v1"'}, content), ({"status": "304"}, b"")]
+        cache_dir = tempfile.mkdtemp()
+        with mock.patch.object(hgnc, "get_connection", return_value=conn), \
+                mock.patch.object(hgnc, "_approved", None), \
+                mock.patch.object(hgnc.cache, "_cache_dir", cache_dir):
+            approved = hgnc.get_approved_symbols()
+            self.assertEqual(hgnc.get_approved_symbols(), approved)
+            self.assertEqual(conn.request.call_count, 1)
+            hgnc._approved = None
+            self.assertEqual(hgnc.get_approved_symbols(max_age=0), frozenset(["CDK6", "ETF1"]))
+        self.assertEqual(conn.request.call_args[0][3]["If-None-Match"], '"v1"')
+        os.remove(os.path.join(cache_dir, hgnc.APPROVED_CACHE_FILE))
+        os.rmdir(cache_dir)
     
 
 if __name__ == '__main__':
@@ -0,0 +1,51 @@
+from gene_mapper import query_mygene as mg
+import unittest
+from unittest import mock
+import pandas as pd
+import os
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = os.path.dirname(os.path.realpath(__file__))
+
+    def test_querymany_batches(self):
+        def fake_querymany(qterms, **kwargs):
+            found = [q for q in qterms if q != "NOTAGENE"]
+            return {"out": pd.DataFrame({"_id": [str(len(q)) for q in found]}, index=found),
+                    "dup": pd.DataFrame(columns=["query"]),
+                    "missing": pd.DataFrame({"query": [q for q in qterms if q == "NOTAGENE"]})}
+        genes = ["CDK6", "ETF1", "NOTAGENE", "TP53", "BRCA2"]
+        with mock.patch.object(mg.client, "querymany", side_effect=fake_querymany) as querymany:
+            mapped, unmapped = mg.query_mygene(genes, "symbol", "entrezgene", batch_size=2, workers=2)
+        self.assertEqual(querymany.call_count, 3)
+        self.assertEqual(list(mapped.index), ["BRCA2", "CDK6", "ETF1", "TP53"])
+        self.assertEqual(unmapped, ["NOTAGENE"])
+
+    def test_getgenes_missing_field(self):
+        results = pd.DataFrame({"notfound": [True]}, index=["0"])
+        with mock.patch.object(mg.client, "getgenes", return_value=results):
+            found, failed = mg.get_mygene(["0"], "symbol")
+        self.assertEqual((len(found), failed), (0, ["0"]))
+
+    def test_retry_backoff(self):
+        method = mock.Mock(side_effect=[ConnectionError("down"), ConnectionError("down"), "ok"], __name__="getgenes")
+        with mock.patch.object(mg.time, "sleep") as sleep:
+            self.assertEqual(mg.with_retries(method, ["1"], retries=3), "ok")
+        waits = [c[0][0] for c in sleep.call_args_list]
+        self.assertEqual(len(waits), 2)
+        self.assertTrue(0 <= waits[0] <= mg.BACKOFF_BASE)
+        self.assertTrue(0 <= waits[1] <= mg.BACKOFF_BASE * 2)
+
+
+    def test_client_uses_archive_transport(self):
+        client = mg.new_client("http://localhost:1")
+        self.assertIsInstance(client.http_client._transport, mg.replay.ArchiveTransport)
+        self.assertIsNotNone(client.http_client.timeout.read)
+        client.http_client.close()
+        with mock.patch.object(mg.mygene, "MyGeneInfo", return_value=object()):
+            with self.assertRaises(ImportError):
+                mg.new_client()
+
+if __name__ == '__main__':
+    unittest.main()
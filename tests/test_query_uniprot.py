@@ -1,7 +1,11 @@
 import gene_mapper as gmap
+from gene_mapper import query_uniprot as uni
 import unittest
+from unittest import mock
 import pandas as pd
 import os
+import io
+import gzip
 
 
 class Test(unittest.TestCase):
@@ -70,6 +74,54 @@ class Test(unittest.TestCase):
     
     def test_previous_versus_alias(self):
         pass
+
+    def test_chunked_jobs_merged_in_order(self):
+        def fake_job(ids, from_db, to_db, field, stream=False):
+            return (pd.DataFrame({"from": [i for i in ids if i != "P3"], "to": [i + "_to" for i in ids if i != "P3"]}),
+                    [i for i in ids if i == "P3"])
+        ids = ["P" + str(i) for i in range(7)]
+        with mock.patch.object(uni, "run_id_mapping_job", side_effect=fake_job) as job:
+            results_df, failed = uni.perform_uniprot_query(ids, "UniProtKB_AC-ID", "Entrez", chunk_size=3, max_jobs=2)
+        self.assertEqual(job.call_count, 3)
+        self.assertEqual(list(results_df["from"]), ["P0", "P1", "P2", "P4", "P5", "P6"])
+        self.assertEqual(failed, ["P3"])
+
+    def test_adaptive_polling(self):
+        running = mock.Mock(**{"json.return_value": {"jobStatus": "RUNNING"}})
+        finished = mock.Mock(**{"json.return_value": {"results": [1], "failedIds": []}})
+        with mock.patch.object(uni.session, "get", side_effect=[running, running, running, finished]), \
+                mock.patch.object(uni.time, "sleep") as sleep:
+            self.assertTrue(uni.check_id_mapping_results_ready("job"))
+        waits = [c[0][0] for c in sleep.call_args_list]
+        self.assertEqual(waits[0], uni.MIN_POLLING_INTERVAL)
+        self.assertTrue(waits[0] < waits[1] < waits[2] <= uni.POLLING_INTERVAL)
+
+    def test_tsv_chunk_parser(self):
+        tsv = "From\tEntry\nP1\tP1\nQ9\tP2\nQ9\tP3\n".encode()
+        for body in [tsv, gzip.compress(tsv), gzip.compress(tsv[:12]) + gzip.compress(tsv[12:])]:
+            parser = uni.TsvChunkParser(chunksize=2)
+            chunks = [chunk for i in range(len(body)) for chunk in parser.feed(body[i:i + 1])] + parser.close()
+            self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+            self.assertEqual(list(pd.concat(chunks)["to"]), ["P1", "P2", "P3"])
+
+    def test_stream_results(self):
+        tsv = "From\tEntry\nP1\tP1\nQ9\tP2\nQ9\tP3\n".encode()
+        response = mock.MagicMock(raw=io.BytesIO(gzip.compress(tsv)))
+        response.__enter__.return_value = response
+        with mock.patch.object(uni.session, "get", return_value=response) as get:
+            results_df = uni.read_id_mapping_results_stream(
+                "https://rest.uniprot.org/idmapping/uniprotkb/results/job", field="primaryAccession", chunksize=2)
+        url = get.call_args[0][0]
+        self.assertIn("/results/stream/job", url)
+        self.assertIn("fields=accession", url)
+        self.assertEqual(list(results_df["from"]), ["P1", "Q9", "Q9"])
+        self.assertEqual(list(results_df["to"]), ["P1", "P2", "P3"])
+        response.raw = io.BytesIO(gzip.compress(tsv))
+        with mock.patch.object(uni.session, "get", return_value=response):
+            chunks = list(uni.iter_id_mapping_results_stream(
+                "https://rest.uniprot.org/idmapping/uniprotkb/results/job", field="primaryAccession", chunksize=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+        self.assertEqual(list(chunks[1].columns), ["from", "to"])
     
 
 if __name__ == '__main__':
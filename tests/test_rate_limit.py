@@ -0,0 +1,112 @@
+from gene_mapper import rate_limit
+from gene_mapper import replay
+from requests.adapters import HTTPAdapter
+import unittest
+from unittest import mock
+import threading
+import asyncio
+import time
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.saved = rate_limit.get_scheduler()
+
+    def tearDown(self):
+        rate_limit.set_scheduler(self.saved)
+
+    def test_throttle_pauses_every_request(self):
+        scheduler = rate_limit.Scheduler({"ensembl": {"rate": 1000, "concurrency": 4}})
+        statuses = [429, 200, 200]
+        sent = []
+
+        def send():
+            sent.append(time.monotonic())
+            return statuses[len(sent) - 1]
+        start = time.monotonic()
+        self.assertEqual(scheduler.send("ensembl", send, lambda status: status, lambda status: "0.1"), 200)
+        # another request to the service waits for the same pause
+        self.assertEqual(scheduler.send("ensembl", send, lambda status: status, lambda status: None), 200)
+        self.assertEqual(len(sent), 3)
+        self.assertGreaterEqual(sent[1] - start, 0.09)
+        self.assertGreaterEqual(sent[2] - start, 0.09)
+        self.assertEqual(scheduler["ensembl"].throttled, 1)
+
+    def test_gives_up_after_max_retries(self):
+        scheduler = rate_limit.Scheduler({"hgnc": {"rate": 1000, "concurrency": 1}})
+        with mock.patch.object(rate_limit, "MAX_THROTTLE_RETRIES", 2):
+            response = scheduler.send("hgnc", lambda: 429, lambda status: status, lambda status: "0")
+        self.assertEqual(response, 429)
+        self.assertEqual(scheduler["hgnc"].throttled, 2)
+
+    def test_concurrency_cap(self):
+        scheduler = rate_limit.Scheduler({"uniprot": {"rate": 1000, "concurrency": 2}})
+        running, peak = [0], [0]
+        lock = threading.Lock()
+
+        def send():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+            return 200
+        threads = [threading.Thread(target=scheduler.send, args=("uniprot", send, lambda s: s, lambda s: None))
+                   for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(peak[0], 2)
+
+    def test_send_async(self):
+        scheduler = rate_limit.Scheduler({"mygene": {"rate": 1000, "concurrency": 1}})
+        statuses = iter([429, 200])
+
+        async def send():
+            return next(statuses)
+        response = asyncio.run(scheduler.send_async("mygene", send, lambda s: s, lambda s: "0"))
+        self.assertEqual(response, 200)
+        self.assertEqual(scheduler["mygene"].throttled, 1)
+
+    def test_async_concurrency_cap(self):
+        scheduler = rate_limit.Scheduler({"uniprot": {"rate": 1000, "concurrency": 2}})
+        running, peak = [0], [0]
+
+        async def send():
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(0.02)
+            running[0] -= 1
+            return 200
+
+        async def main():
+            return await asyncio.gather(*[scheduler.send_async("uniprot", send, lambda s: s, lambda s: None)
+                                          for _ in range(6)])
+        start = time.monotonic()
+        self.assertEqual(asyncio.run(main()), [200] * 6)
+        self.assertEqual(peak[0], 2)
+        self.assertLess(time.monotonic() - start, 0.2)
+
+    def test_divided(self):
+        scheduler = rate_limit.Scheduler().divided(4)
+        self.assertEqual(scheduler.limits["ensembl"], {"rate": 15 / 4, "concurrency": 3})
+        self.assertEqual(scheduler.limits["hgnc"]["concurrency"], 2)
+        self.assertEqual(rate_limit.Scheduler({"hgnc": {"rate": 10, "concurrency": 2}}).divided(8).limits,
+                         {"hgnc": {"rate": 1.25, "concurrency": 1}})
+
+    def test_adapter_uses_scheduler(self):
+        rate_limit.set_scheduler(rate_limit.Scheduler({"ensembl": {"rate": 1000, "concurrency": 1}}))
+        throttled = mock.Mock(status_code=429, headers={"Retry-After": "0"})
+        ok = mock.Mock(status_code=200, headers={})
+        adapter = replay.ArchiveAdapter("ensembl")
+        with mock.patch.object(HTTPAdapter, "send", side_effect=[throttled, ok]) as send:
+            self.assertIs(adapter.send(mock.Mock()), ok)
+        self.assertEqual(send.call_count, 2)
+        throttled.close.assert_called_once_with()
+        self.assertEqual(rate_limit.get_scheduler()["ensembl"].throttled, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+from gene_mapper import replay
+from benchmarks import run_benchmarks as bench
+from benchmarks.mock_services import MockServices, use_services, input_ids
+import unittest
+import os
+import tempfile
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "exchanges.sqlite")
+
+    def tearDown(self):
+        replay.set_archive(None)
+        self.tmp.cleanup()
+
+    def test_archive_keeps_successful_responses(self):
+        archive = replay.HTTPArchive(self.path, mode="auto")
+        self.assertIsNone(archive.lookup("GET", "http://hgnc/fetch/symbol/TP53"))
+        archive.store("GET", "http://hgnc/fetch/symbol/TP53", None, 200, [("Content-Type", "application/json"),
+                                                                           ("Content-Encoding", "gzip")], b"{}")
+        archive.store("GET", "http://hgnc/fetch/symbol/TP53", None, 503, [], b"down")
+        self.assertEqual(archive.lookup("get", "http://hgnc/fetch/symbol/TP53"),
+                         (200, [["Content-Type", "application/json"]], b"{}"))
+        archive.store("POST", "http://ensembl/archive/id", b'{"id": ["ENSG1"]}', 429, [], b"slow down")
+        archive.store("POST", "http://ensembl/archive/id", '{"id": ["ENSG1"]}', 200, [], b"[]")
+        self.assertEqual(archive.lookup("POST", "http://ensembl/archive/id", b'{"id": ["ENSG1"]}')[0], 200)
+        self.assertIsNone(archive.lookup("POST", "http://ensembl/archive/id", b'{"id": ["ENSG2"]}'))
+        self.assertEqual(len(archive), 2)
+        archive.mode = "replay"
+        with self.assertRaises(replay.ArchiveMiss):
+            archive.lookup("POST", "http://ensembl/archive/id", b'{"id": ["ENSG2"]}')
+        archive.close()
+
+    def test_record_then_replay_offline(self):
+        cases = [case for case in bench.CASES if case[1] != "DIP"]
+        with MockServices(n_genes=100) as services, use_services(services.urls), bench.isolated(1000):
+            replay.load_archive(self.path, mode="record")
+            recorded = [bench.run_case(case, set(input_ids(case[1], 100)), services=services, memory=False)
+                        for case in cases]
+            self.assertGreater(replay.get_archive().recorded, 0)
+            replay.get_archive().close()
+        # the services are gone, so every response has to come from the archive
+        with use_services(services.urls), bench.isolated(1000):
+            archive = replay.load_archive(self.path, mode="replay")
+            replayed = [bench.run_case(case, set(input_ids(case[1], 100)), memory=False) for case in cases]
+        for before, after in zip(recorded, replayed):
+            self.assertNotIn("error", after, after["id_type"])
+            self.assertEqual((before["mapped"], before["failed"]), (after["mapped"], after["failed"]))
+        self.assertGreater(archive.hits, 0)
+        self.assertEqual(archive.recorded, 0)
+        archive.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
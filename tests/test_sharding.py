@@ -0,0 +1,82 @@
+from gene_mapper import sharding
+from gene_mapper import mapper
+from gene_mapper import planner
+from gene_mapper.Timer import Timer
+from benchmarks import run_benchmarks as bench
+from benchmarks.mock_services import MockServices, use_services, input_ids
+import pickle
+import unittest
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.min_shard_size = sharding.MIN_SHARD_SIZE
+        sharding.MIN_SHARD_SIZE = 10
+
+    def tearDown(self):
+        sharding.MIN_SHARD_SIZE = self.min_shard_size
+
+    def test_shard_nodes(self):
+        nodes = {f"GENE{i}" for i in range(100)}
+        shards = sharding.shard_nodes(nodes, 4)
+        self.assertEqual(len(shards), 4)
+        self.assertEqual(sorted(node for shard in shards for node in shard), sorted(nodes))
+        self.assertTrue(all(shard == sorted(shard) for shard in shards))
+        self.assertEqual(sharding.shard_nodes(sorted(nodes, reverse=True), 4), shards)
+
+    def test_merge_results(self):
+        node_map, failed = sharding.merge_results([({"a": "A"}, ["d", "b"]), ({"c": "C"}, {"e"})])
+        self.assertEqual(node_map, {"a": "A", "c": "C"})
+        self.assertEqual(failed, ["b", "d", "e"])
+
+    def test_worker_budget(self):
+        self.assertEqual(sharding.worker_budget(8, 4), 2)
+        self.assertEqual(sharding.worker_budget(4, 64), 1)
+
+    def test_worker_state(self):
+        self.assertNotEqual(sharding.start_method(), "fork")
+        state = pickle.loads(pickle.dumps(sharding.worker_state(4)))
+        self.assertEqual(len(state["backends"]), len(sharding.BACKENDS))
+        self.assertEqual(state["workers"]["hgnc"], sharding.worker_budget(sharding.hgnc.MAX_WORKERS, 4))
+        self.assertEqual(state["batch_sizes"]["uniprot"], sharding.uni.CHUNK_SIZE)
+
+    def test_small_inputs_are_not_sharded(self):
+        timer = Timer()
+        node_map, failed = sharding.update_nodes_sharded({"DIP-1N", "x"}, "DIP", processes=4, timer=timer)
+        self.assertEqual(node_map, {"DIP-1N": "DIP-1N"})
+        self.assertEqual(failed, ["x"])
+        self.assertEqual(timer.spans[0].attributes["processes"], 1)
+
+    def test_same_results_as_unsharded(self):
+        cases = [("update_nodes", "Symbol", None), ("update_nodes", "Ensembl", None),
+                 ("convert_node_ids", "Uniprot", "Entrez")]
+        with MockServices(n_genes=100) as services, use_services(services.urls), bench.isolated(1000):
+            for function, initial_id, target_id in cases:
+                nodes = set(input_ids(initial_id, 100))
+                timer = Timer()
+                if function == "update_nodes":
+                    expected = mapper.update_nodes(nodes, initial_id)
+                    results = sharding.update_nodes_sharded(nodes, initial_id, processes=3, timer=timer)
+                else:
+                    expected = mapper.convert_node_ids(nodes, initial_id, target_id)
+                    results = sharding.convert_node_ids_sharded(nodes, initial_id, target_id, processes=3,
+                                                                timer=timer)
+                self.assertEqual(results[0], expected[0], initial_id)
+                self.assertEqual(results[1], sorted(expected[1]), initial_id)
+                self.assertEqual(timer.spans[0].attributes["processes"], 3)
+                self.assertGreater(timer.spans[0].attributes["requests"], 0)
+
+
+    def test_planner_in_workers(self):
+        with MockServices(n_genes=100) as services, use_services(services.urls), bench.isolated(1000):
+            nodes = set(input_ids("Uniprot", 100))
+            expected = mapper.convert_node_ids(nodes, "Uniprot", "Entrez",
+                                               planner=planner.ConversionPlanner(costs=planner.CostModel()))
+            results = sharding.convert_node_ids_sharded(nodes, "Uniprot", "Entrez", processes=2,
+                                                        planner=planner.ConversionPlanner(costs=planner.CostModel()))
+        self.assertEqual(results[0], expected[0])
+        self.assertEqual(results[1], sorted(expected[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
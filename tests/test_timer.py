@@ -0,0 +1,125 @@
+from gene_mapper import Timer as timing
+from gene_mapper.Timer import Timer
+import unittest
+import json
+import os
+import tempfile
+import threading
+import asyncio
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.timer = Timer()
+
+    def test_nested_and_repeated_spans(self):
+        self.timer.start("Update Nodes")
+        self.timer.start("Query")
+        self.timer.end("Query")
+        self.timer.start("Query")
+        self.timer.end("Query")
+        self.timer.end("Update Nodes")
+        self.assertEqual(self.timer.tasks, ["Update Nodes", "Query", "Query1"])
+        self.assertEqual([span.depth for span in self.timer.spans], [0, 1, 1])
+        self.assertEqual(set(self.timer.elapsed_times), {"Update Nodes", "Query", "Query1"})
+        self.assertGreaterEqual(self.timer.spans[0].elapsed, self.timer.spans[1].elapsed)
+
+    def test_threads_nest_separately(self):
+        with self.timer.span("main"):
+            def work(i):
+                with self.timer.span("batch", batch=i):
+                    pass
+            threads = [threading.Thread(target=work, args=(i,)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        batches = [span for span in self.timer.spans if span.name == "batch"]
+        self.assertEqual(len(batches), 4)
+        self.assertTrue(all(span.parent is None and span.finish is not None for span in batches))
+        self.assertEqual(sorted(span.attributes["batch"] for span in batches), [0, 1, 2, 3])
+
+    def test_concurrent_tasks_nest_separately(self):
+        async def query(i):
+            with self.timer.span("UniProt query", chunk=i):
+                await asyncio.sleep(0.01)
+
+        async def main():
+            with self.timer.span("Convert"):
+                await asyncio.gather(query(0), query(1))
+        asyncio.run(main())
+        queries = [span for span in self.timer.spans if span.name == "UniProt query"]
+        self.assertEqual([span.parent.label for span in queries], ["Convert", "Convert"])
+
+    def test_end_closes_own_span(self):
+        started, ended = threading.Barrier(2), threading.Event()
+        def work(i):
+            self.timer.start("Update Nodes", thread=i)
+            started.wait()
+            if i == 0:
+                self.timer.end("Update Nodes")
+                ended.set()
+            else:
+                ended.wait()
+                self.timer.start("Query")
+                self.timer.end("Query")
+                self.timer.end("Update Nodes")
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        first, second, query = self.timer.spans
+        self.assertLess(first.finish, query.start)
+        self.assertGreater(second.finish, query.finish)
+        self.assertIs(query.parent, second)
+
+    def test_recorded_requests(self):
+        timing.record(requests=1)
+        with self.timer.span("UniProt query", record_requests=True, service="uniprot") as span:
+            timing.record(requests=1, bytes=100)
+            timing.record(requests=1, bytes=50, retries=1)
+        timing.record(requests=1)
+        self.assertEqual(span.attributes, {"service": "uniprot", "requests": 2, "bytes": 150, "retries": 1})
+
+    def test_concurrent_recording_spans(self):
+        barrier = threading.Barrier(2)
+        def work(service, n):
+            with self.timer.span("query", record_requests=True, service=service):
+                barrier.wait()
+                for _ in range(n):
+                    timing.record(requests=1)
+                barrier.wait()
+                # worker threads of a query report to the span of the thread that started them
+                thread = threading.Thread(target=timing.in_context(timing.record), kwargs={"requests": 10})
+                thread.start()
+                thread.join()
+        threads = [threading.Thread(target=work, args=("hgnc", 2)), threading.Thread(target=work, args=("mygene", 3))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        requests = {span.attributes["service"]: span.attributes["requests"] for span in self.timer.spans}
+        self.assertEqual(requests, {"hgnc": 12, "mygene": 13})
+        self.assertIsNone(timing._recording.get())
+
+    def test_exports(self):
+        with self.timer.span("Convert node IDs", nodes=3):
+            with self.timer.span("MyGene query", service="mygene"):
+                pass
+        path = os.path.join(tempfile.mkdtemp(), "trace.json")
+        self.timer.to_chrome_trace(path)
+        with open(path) as f:
+            events = json.load(f)["traceEvents"]
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+        self.assertEqual([e["name"] for e in events], ["Convert node IDs", "MyGene query"])
+        self.assertEqual(events[1]["cat"], "mygene")
+        self.assertTrue(all(e["ph"] == "X" and e["dur"] >= 0 for e in events))
+        spans = self.timer.to_json()
+        self.assertEqual(spans[1]["parent"], "Convert node IDs")
+        self.assertEqual(spans[0]["attributes"], {"nodes": 3})
+
+
+if __name__ == '__main__':
+    unittest.main()
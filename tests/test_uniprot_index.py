@@ -0,0 +1,92 @@
+from gene_mapper import uniprot_index
+from gene_mapper import query_uniprot as uni
+from gene_mapper import mapper
+import unittest
+from unittest import mock
+import gzip
+import os
+import tempfile
+
+# accession, database, identifier
+IDMAPPING = [
+    "P04637\tUniProtKB-ID\tP53_HUMAN",
+    "P04637\tGeneID\t7157",
+    "P04637\tGene_Name\tTP53",
+    "P04637\tEnsembl\tENSG00000141510",
+    "P04637\tDIP\tDIP-366N",
+    "P04637-2\tEnsembl\tENSG00000141510",
+    "P04637\tRefSeq\tNP_000537.3",
+    "P38398\tUniProtKB-ID\tBRCA1_HUMAN",
+    "P38398\tGeneID\t672",
+    "P38398\tGene_Name\tBRCA1",
+    "Q9Y6K9\tGeneID\t8517",
+    "Q9Y6K9\tGeneID\t100000001",
+]
+SEC_AC = """UniProt - Swiss-Prot Protein Knowledgebase
+Secondary AC  Primary AC
+____________  __________
+O08000        P04637
+Q15086        P04637
+"""
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.dir_path = tempfile.mkdtemp()
+        path = os.path.join(self.dir_path, "HUMAN_9606_idmapping.dat.gz")
+        with gzip.open(path, "wt") as f:
+            f.write("\n".join(IDMAPPING) + "\n")
+        with open(os.path.join(self.dir_path, "sec_ac.txt"), "w") as f:
+            f.write(SEC_AC)
+        self.index = uniprot_index.build_index(path, os.path.join(self.dir_path, "index"),
+                                               secondary_path=os.path.join(self.dir_path, "sec_ac.txt"), chunksize=4)
+
+    def tearDown(self):
+        uniprot_index.set_index(None)
+        for root, dirs, files in os.walk(self.dir_path, topdown=False):
+            for f in files:
+                os.remove(os.path.join(root, f))
+            for d in dirs:
+                os.rmdir(os.path.join(root, d))
+        os.rmdir(self.dir_path)
+
+    def test_primary_accessions(self):
+        resolved = self.index.primary_accessions(["P04637", "P53_HUMAN", "O08000", "P04637-2", "P38398-7",
+                                                  "P0463", "P046377", "XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX"])
+        self.assertEqual(resolved, {"P04637": ["P04637"], "P53_HUMAN": ["P04637"], "O08000": ["P04637"],
+                                    "P04637-2": ["P04637"], "P38398-7": ["P38398"]})
+
+    def test_lookup_batches_multiple_values(self):
+        positions, values = self.index.lookup("GeneID", ["Q9Y6K9", "P00000", "P04637"])
+        self.assertEqual(list(positions), [0, 0, 2])
+        self.assertEqual(list(values), ["100000001", "8517", "7157"])
+
+    def test_same_form_as_service(self):
+        uniprot_index.set_index(uniprot_index.UniProtIndex(os.path.join(self.dir_path, "index")))
+        with mock.patch.object(uni, "run_id_mapping_job") as job:
+            results_df, failed = uni.perform_uniprot_query(["Q15086", "P38398", "P99999"], "UniProtKB_AC-ID",
+                                                           "Entrez")
+            dip_df, dip_failed = uni.perform_uniprot_query(["DIP-366N", "DIP-1N"], "DIP", "Uniprot")
+        job.assert_not_called()
+        self.assertEqual(list(results_df.columns), ["from", "to"])
+        self.assertEqual(dict(zip(results_df["from"], results_df["to"])), {"Q15086": "7157", "P38398": "672"})
+        self.assertEqual(failed, ["P99999"])
+        self.assertEqual(dict(zip(dip_df["from"], dip_df["to"])), {"DIP-366N": "P04637"})
+        self.assertEqual(dip_failed, ["DIP-1N"])
+
+    def test_mapper_offline(self):
+        uniprot_index.set_index(self.index)
+        with mock.patch.object(uni, "run_id_mapping_job") as job:
+            node_map, failed = mapper.update_nodes({"O08000", "P53_HUMAN", "P38398"}, "Uniprot")
+            symbols, _ = mapper.convert_node_ids({"P04637", "P38398"}, "Uniprot", "Symbol")
+        job.assert_not_called()
+        self.assertEqual(dict(node_map), {"O08000": "P04637", "P53_HUMAN": "P04637", "P38398": "P38398"})
+        self.assertEqual(dict(symbols), {"P04637": "TP53", "P38398": "BRCA1"})
+
+    def test_unsupported_database(self):
+        with self.assertRaises(NotImplementedError):
+            self.index.perform_uniprot_query(["P04637"], "UniProtKB_AC-ID", "RefSeq")
+
+
+if __name__ == '__main__':
+    unittest.main()